@@ -0,0 +1,140 @@
+"""
+In-memory schedule of users' alarms.
+
+Alarms are grouped into (timezone, local time, weekdays) slots, so "is
+anyone due in the next few minutes?" costs one next-fire computation per
+distinct slot (with cached zone rules) rather than one per alarm, and
+listing the due alarms touches only the due slots. send_daily_alerts uses
+it to skip the due-alarm query when no slot fires inside the look-ahead
+window; prepare_digests uses it to find whose digest to render early.
+"""
+import logging
+import threading
+from datetime import time
+
+import database
+import timezones
+
+logger = logging.getLogger("CryptoBot.AlarmSchedule")
+
+
+class AlarmSchedule:
+    """alarm_id -> (user_id, alarm_time, timezone, weekdays), indexed by slot and by user."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.alarms = {}
+        self.slots = {}  # (timezone, alarm_time, weekdays) -> set of alarm_ids
+        self.by_user = {}  # user_id -> set of alarm_ids
+        self.loaded = False
+        # False while other processes may change alarms without this one hearing about it
+        self.sees_all_writes = True
+
+    def set_user(self, user_id, rows):
+        """Replaces a user's alarms with [(alarm_id, alarm_time, timezone, weekdays[, next_fire_utc])].
+
+        Paused alarms (next_fire_utc None) are left out.
+        """
+        with self._lock:
+            for alarm_id in self.by_user.pop(user_id, ()):
+                self._discard(alarm_id)
+            for alarm_id, alarm_time, tz_name, weekdays, *next_fire in rows:
+                if next_fire and next_fire[0] is None:
+                    continue
+                self._add(alarm_id, user_id, alarm_time, tz_name, weekdays)
+
+    def remove_user(self, user_id):
+        self.set_user(user_id, [])
+
+    def has_user(self, user_id):
+        return user_id in self.by_user
+
+    def _add(self, alarm_id, user_id, alarm_time, tz_name, weekdays):
+        self.alarms[alarm_id] = (user_id, alarm_time, tz_name, weekdays)
+        self.slots.setdefault((tz_name, alarm_time, weekdays), set()).add(alarm_id)
+        self.by_user.setdefault(user_id, set()).add(alarm_id)
+
+    def _discard(self, alarm_id):
+        previous = self.alarms.pop(alarm_id, None)
+        if previous is not None:
+            user_id, alarm_time, tz_name, weekdays = previous
+            slot = (tz_name, alarm_time, weekdays)
+            self.slots[slot].discard(alarm_id)
+            if not self.slots[slot]:
+                del self.slots[slot]
+
+    def replace_all(self, rows):
+        """Swaps in a full set of (alarm_id, user_id, alarm_time, timezone, weekdays) rows."""
+        with self._lock:
+            self.alarms, self.slots, self.by_user = {}, {}, {}
+            for alarm_id, user_id, alarm_time, tz_name, weekdays in rows:
+                self._add(alarm_id, user_id, alarm_time, tz_name, weekdays)
+            self.loaded = True
+
+    def load_from_db(self):
+        conn = database.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT alarm_id, user_id, alarm_time, timezone, weekdays FROM user_alarms WHERE next_fire_utc IS NOT NULL;")
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        self.replace_all(rows)
+        logger.info(f"Loaded {len(self.alarms)} alarms in {len(self.slots)} slots.")
+
+    def _due_slots(self, now_utc, horizon):
+        """{slot: fire_at} for slots firing in (now_utc, now_utc + horizon]; None if a zone is unknown."""
+        with self._lock:
+            slots = list(self.slots)
+        due = {}
+        for slot in slots:
+            tz_name, alarm_time, weekdays = slot
+            try:
+                fire_at = timezones.next_fire(alarm_time, tz_name, weekdays, now_utc)
+            except (KeyError, ValueError, OSError):
+                # Let the database decide for zones we can't load
+                return None
+            if fire_at is not None and fire_at <= now_utc + horizon:
+                due[slot] = fire_at
+        return due
+
+    def has_due(self, now_utc, horizon):
+        """True if any slot fires in (now_utc, now_utc + horizon]."""
+        due = self._due_slots(now_utc, horizon)
+        return due is None or bool(due)
+
+    def due_alarms(self, now_utc, horizon):
+        """[(alarm_id, user_id, alarm_time, timezone, fire_at)] for alarms firing in (now_utc, now_utc + horizon]."""
+        due = self._due_slots(now_utc, horizon) or {}
+        result = []
+        with self._lock:
+            for slot, fire_at in due.items():
+                for alarm_id in self.slots.get(slot, ()):
+                    user_id, alarm_time, tz_name, _ = self.alarms[alarm_id]
+                    result.append((alarm_id, user_id, alarm_time, tz_name, fire_at))
+        return result
+
+    # --- Snapshot support ---
+    def to_records(self):
+        """(alarm_ids, user_ids, minutes_of_day, weekdays, tz_indexes, tz_names) for compact serialisation."""
+        with self._lock:
+            items = list(self.alarms.items())
+        tz_names = sorted({tz_name for _, (_, _, tz_name, _) in items})
+        tz_index = {name: i for i, name in enumerate(tz_names)}
+        return (
+            [alarm_id for alarm_id, _ in items],
+            [user_id for _, (user_id, _, _, _) in items],
+            [t.hour * 60 + t.minute for _, (_, t, _, _) in items],
+            [weekdays for _, (_, _, _, weekdays) in items],
+            [tz_index[tz_name] for _, (_, _, tz_name, _) in items],
+            tz_names,
+        )
+
+    def load_records(self, alarm_ids, user_ids, minutes, weekdays, tz_indexes, tz_names):
+        self.replace_all(
+            (int(alarm_id), int(user_id), time(int(minute) // 60, int(minute) % 60), tz_names[int(tz)], int(days))
+            for alarm_id, user_id, minute, days, tz in zip(alarm_ids, user_ids, minutes, weekdays, tz_indexes)
+        )
+
+
+schedule = AlarmSchedule()
@@ -0,0 +1,259 @@
+"""
+Offline alert simulator.
+
+Loads a window of coin_prices plus the alarms, watchlists and coin mapping
+into memory once, then advances a virtual clock through the window the way
+the JobQueue would (a send_daily_alerts run every ALERT_JOB_INTERVAL) and
+records which daily digests and dip triggers would have fired, and what
+they would have said. Nothing is sent and nothing is written to the
+database, so thresholds, scheduling and dip logic can be compared against
+a week of real data in seconds.
+
+Usage:
+    python alert_simulator.py --days 7 --dip-alert 15 --show 3 --output alerts.ndjson
+"""
+import argparse
+import heapq
+import json
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+
+import pytz
+
+import database
+import price_collector
+import timezones
+
+logger = logging.getLogger("CryptoBot.Simulator")
+
+ALERT_JOB_INTERVAL = timedelta(minutes=2)
+ALERT_LOOKAHEAD = timedelta(minutes=5)
+HIGH_WINDOW = timedelta(days=7)
+
+
+class _CoinSeries:
+    """Price ticks for one coin, replayed in time order with a rolling-max window."""
+
+    __slots__ = ('times', 'prices', 'pos', 'window_max', 'current')
+
+    def __init__(self):
+        self.times = []
+        self.prices = []
+        self.pos = 0
+        self.window_max = deque()  # (time, price), prices strictly decreasing
+        self.current = None
+
+    def advance(self, now, window):
+        while self.pos < len(self.times) and self.times[self.pos] <= now:
+            t, p = self.times[self.pos], self.prices[self.pos]
+            while self.window_max and self.window_max[-1][1] <= p:
+                self.window_max.pop()
+            self.window_max.append((t, p))
+            self.current = p
+            self.pos += 1
+        cutoff = now - window
+        while self.window_max and self.window_max[0][0] <= cutoff:
+            self.window_max.popleft()
+        if not self.window_max:
+            # No tick within the window (the coin stopped ticking): no price to report or dip against
+            self.current = None
+
+    def high(self):
+        return self.window_max[0][1] if self.window_max else None
+
+
+class AlertSimulator:
+    """Replays alarms and price history against an in-memory copy of the database."""
+
+    def __init__(self, start, end, job_interval=ALERT_JOB_INTERVAL, lookahead=ALERT_LOOKAHEAD,
+                 high_window=HIGH_WINDOW, dip_alert=price_collector.DIP_ALERT_THRESHOLD,
+                 dip_warning=price_collector.DIP_WARNING_THRESHOLD):
+        self.start = start
+        self.end = end
+        self.job_interval = job_interval
+        self.lookahead = lookahead
+        self.high_window = high_window
+        self.thresholds = {'alert_threshold': dip_alert, 'warning_threshold': dip_warning}
+
+        self.series = {}
+        self.symbols = {}
+        self.alarms = []
+        self.watchlists = {}
+
+    # --- Loading ---
+    def load(self):
+        """Reads the simulation window into memory with a handful of queries."""
+        conn = database.get_read_connection(max_staleness=300)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT coin_id, symbol FROM coin_mapping;")
+                self.symbols = dict(cur.fetchall())
+
+                cur.execute(
+                    """
+                    SELECT coin_id, timestamp, price FROM coin_prices
+                    WHERE timestamp > %s AND timestamp <= %s
+                    ORDER BY coin_id, timestamp;
+                    """,
+                    (self._naive(self.start - self.high_window), self._naive(self.end))
+                )
+                for coin_id, ts, price in cur:
+                    series = self.series.get(coin_id)
+                    if series is None:
+                        series = self.series[coin_id] = _CoinSeries()
+                    series.times.append(pytz.UTC.localize(ts))
+                    series.prices.append(price)
+
+                cur.execute(
+                    "SELECT alarm_id, user_id, alarm_time, timezone, weekdays FROM user_alarms "
+                    "WHERE next_fire_utc IS NOT NULL;"
+                )
+                self.alarms = cur.fetchall()
+
+                cur.execute("SELECT user_id, coin_id FROM user_coins ORDER BY user_id, coin_id;")
+                for user_id, coin_id in cur:
+                    self.watchlists.setdefault(user_id, []).append(coin_id)
+        finally:
+            conn.close()
+        logger.info(
+            f"Loaded {sum(len(s.times) for s in self.series.values())} ticks for {len(self.series)} coins "
+            f"and {len(self.alarms)} alarms."
+        )
+        return self
+
+    @staticmethod
+    def _naive(dt):
+        # coin_prices.timestamp is a naive UTC TIMESTAMP
+        return dt.astimezone(pytz.UTC).replace(tzinfo=None)
+
+    # --- Scheduling ---
+    def _alarm_events(self):
+        """Yields (fire_time_utc, alarm_id, user_id, local_date, timezone) for every alarm occurrence in the window."""
+        for alarm_id, user_id, alarm_time, tz_name, weekdays in self.alarms:
+            fire_at = timezones.next_fire(alarm_time, tz_name, weekdays, self.start - timedelta(microseconds=1))
+            while fire_at is not None and fire_at <= self.end + self.lookahead:
+                yield fire_at, alarm_id, user_id, timezones.local_date(fire_at, tz_name), tz_name
+                fire_at = timezones.next_fire(alarm_time, tz_name, weekdays, fire_at)
+
+    def _job_times(self):
+        t = self.start
+        while t <= self.end:
+            yield t
+            t += self.job_interval
+
+    # --- Replay ---
+    def _coin_snapshot(self, coin_ids):
+        coin_data = {}
+        for coin_id in coin_ids:
+            series = self.series.get(coin_id)
+            if series is None or series.current is None:
+                continue
+            high = series.high()
+            coin_data[coin_id] = {
+                'current_price': series.current,
+                'seven_day_high': high,
+                'dip_percentage': ((high - series.current) / high) * 100,
+                'symbol': self.symbols.get(coin_id, coin_id.upper()),
+            }
+        return coin_data
+
+    def run(self):
+        """Advances the virtual clock over the window. Returns (alerts, dip_triggers)."""
+        events = list(self._alarm_events())
+        heapq.heapify(events)
+        dipping = set()
+        alerts, dip_triggers = [], []
+
+        for now in self._job_times():
+            for coin_id, series in self.series.items():
+                series.advance(now, self.high_window)
+                if series.current is None:
+                    continue
+                dip = ((series.high() - series.current) / series.high()) * 100
+                if dip >= self.thresholds['alert_threshold']:
+                    if coin_id not in dipping:
+                        dipping.add(coin_id)
+                        dip_triggers.append({
+                            'time': now.isoformat(), 'coin_id': coin_id,
+                            'price': series.current, 'seven_day_high': series.high(), 'dip_percentage': dip,
+                        })
+                else:
+                    dipping.discard(coin_id)
+
+            # Same rule as send_daily_alerts: each occurrence fires once, from the first run within lookahead of it
+            while events and events[0][0] <= now + self.lookahead:
+                fire_at, alarm_id, user_id, local_day, tz_name = heapq.heappop(events)
+                user_coins = self.watchlists.get(user_id)
+                if not user_coins:
+                    continue
+                coin_data = self._coin_snapshot(user_coins)
+                if not coin_data:
+                    continue
+                alerts.append({
+                    'time': now.isoformat(),
+                    'alarm_at': fire_at.isoformat(),
+                    'alarm_id': alarm_id,
+                    'user_id': user_id,
+                    'local_date': local_day.isoformat(),
+                    'dip_alerts': [c for c, d in coin_data.items()
+                                   if d['dip_percentage'] >= self.thresholds['alert_threshold']],
+                    'message': price_collector.build_alert_message(
+                        user_coins, coin_data, tz_name, now, **self.thresholds
+                    ),
+                })
+        return alerts, dip_triggers
+
+
+def simulate(days=7, end=None, **options):
+    """Loads the last `days` of history ending at `end` and replays it."""
+    end = end or datetime.now(pytz.UTC)
+    return AlertSimulator(end - timedelta(days=days), end, **options).load().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=7, help="length of the replay window")
+    parser.add_argument("--end", help="window end as an ISO timestamp in UTC (default: now)")
+    parser.add_argument("--dip-alert", type=float, default=price_collector.DIP_ALERT_THRESHOLD)
+    parser.add_argument("--dip-warning", type=float, default=price_collector.DIP_WARNING_THRESHOLD)
+    parser.add_argument("--job-minutes", type=float, default=ALERT_JOB_INTERVAL.total_seconds() / 60)
+    parser.add_argument("--lookahead-minutes", type=float, default=ALERT_LOOKAHEAD.total_seconds() / 60)
+    parser.add_argument("--show", type=int, default=0, help="print this many rendered digests")
+    parser.add_argument("--output", help="write every alert and dip trigger as NDJSON")
+    args = parser.parse_args()
+
+    end = pytz.UTC.localize(datetime.fromisoformat(args.end)) if args.end else None
+    started = datetime.now()
+    alerts, dip_triggers = simulate(
+        days=args.days, end=end,
+        job_interval=timedelta(minutes=args.job_minutes),
+        lookahead=timedelta(minutes=args.lookahead_minutes),
+        dip_alert=args.dip_alert, dip_warning=args.dip_warning,
+    )
+    elapsed = (datetime.now() - started).total_seconds()
+
+    print(f"Simulated {args.days:g} days in {elapsed:.2f}s "
+          f"({args.days * 86400 / max(elapsed, 1e-9):,.0f}x real time)")
+    print(f"Daily digests: {len(alerts)} to {len({a['user_id'] for a in alerts})} users, "
+          f"{sum(1 for a in alerts if a['dip_alerts'])} with a DIP ALERT")
+    print(f"Dip triggers (>= {args.dip_alert:g}% below {HIGH_WINDOW.days}d high): {len(dip_triggers)}")
+
+    for alert in alerts[:args.show]:
+        print("-" * 50)
+        print(f"[User {alert['user_id']} @ {alert['time']}]")
+        print(alert['message'])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for alert in alerts:
+                f.write(json.dumps({'type': 'alert', **alert}) + "\n")
+            for trigger in dip_triggers:
+                f.write(json.dumps({'type': 'dip', **trigger}) + "\n")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    main()
@@ -0,0 +1,136 @@
+"""
+Sharded alert delivery across worker processes.
+
+With ALERT_WORKERS set above 1, send_daily_alerts splits the due alarms into
+that many shards by a stable hash of user_id and hands each shard to a
+process in a ProcessPoolExecutor. The bot process still decides who is due
+and gathers prepared digests, watchlists and the price snapshot rows, so
+workers never touch Postgres. Each worker renders the digests that were
+not prepared, sends its shard through its own Telegram client and reports
+back [(alarm_id, user_id, error, kind)]. The bot process then records the
+deliveries, so formatting and HTTP round-trips no longer share a core with
+update polling.
+
+Workers are spawned (not forked) once and reused, so they don't inherit
+the bot's threads or open connections.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger("CryptoBot.AlertWorkers")
+
+# 0 or 1 keeps delivery inside the bot process
+WORKERS = int(os.getenv("ALERT_WORKERS", "0"))
+
+_executor = None
+
+# Per-worker state, set up once by _init_worker
+_loop = None
+_bot = None
+
+
+def shard_of(user_id, shards):
+    """Stable shard for a user, the same in every process and run."""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def enabled():
+    return WORKERS > 1
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+    return _executor
+
+
+def start():
+    """Spawns the workers and preloads their imports so the first alert run doesn't pay for it."""
+    executor = _get_executor()
+    return [executor.submit(_preload) for _ in range(WORKERS)]
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+# --- Worker side ---
+def _init_worker():
+    global _loop
+    _loop = asyncio.new_event_loop()
+
+
+def _preload():
+    # Pulls in telegram and the formatting helpers (not pandas, which workers never use)
+    import price_collector
+    return os.getpid()
+
+
+async def _client(token, base_url):
+    global _bot
+    if _bot is None or _bot.token != token:
+        from telegram import Bot
+
+        _bot = Bot(token, base_url=base_url)
+        await _bot.initialize()
+    return _bot
+
+
+async def _send_shard(token, base_url, jobs, coin_data, footer):
+    import delivery
+    import price_collector
+
+    bot = await _client(token, base_url)
+    results = []
+    for alarm_id, user_id, timezone, user_coins, message in jobs:
+        try:
+            if message is None:
+                message = price_collector.build_alert_message(user_coins, coin_data, timezone)
+            await bot.send_message(chat_id=user_id, text=message + footer, parse_mode='Markdown')
+            results.append((alarm_id, user_id, None, None))
+        except Exception as e:
+            # Classified here: exceptions don't cross the process boundary
+            results.append((alarm_id, user_id, str(e), delivery.classify(e)))
+    return results
+
+
+def deliver_shard(token, base_url, jobs, coin_data, footer):
+    """Worker entry point: renders and sends one shard. Returns [(alarm_id, user_id, error, kind)], both None on success."""
+    return _loop.run_until_complete(_send_shard(token, base_url, jobs, coin_data, footer))
+
+
+# --- Bot side ---
+async def fan_out(bot, jobs, coin_data, footer):
+    """Delivers [(alarm_id, user_id, timezone, user_coins, message or None)] across the workers.
+
+    coin_data holds the snapshot rows for every coin a job without a message needs.
+    Yields each shard's results as it finishes.
+    """
+    shards = [[] for _ in range(WORKERS)]
+    for job in jobs:
+        shards[shard_of(job[1], WORKERS)].append(job)
+
+    # Bot.base_url already has the token appended
+    base_url = bot.base_url[:-len(bot.token)]
+    executor = _get_executor()
+    loop = asyncio.get_running_loop()
+    futures = []
+    for shard in shards:
+        if not shard:
+            continue
+        needed = {coin_id for *_, user_coins, message in shard if message is None for coin_id in user_coins}
+        futures.append(loop.run_in_executor(
+            executor, deliver_shard, bot.token, base_url, shard,
+            {coin_id: coin_data[coin_id] for coin_id in needed if coin_id in coin_data}, footer,
+        ))
+    for future in asyncio.as_completed(futures):
+        yield await future
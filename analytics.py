@@ -0,0 +1,179 @@
+"""
+Vectorised price analytics.
+
+Loads the price history of every tracked coin into one wide pandas frame
+(one column per coin on the 2-minute ingest grid) and computes every
+indicator for all coins in a single pass: dip from N-day highs, rolling
+returns, volatility, drawdown and moving-average crossovers. The result is
+cached per snapshot so the alert renderer and the dashboard share one
+computation instead of issuing SQL per coin per user.
+
+pandas is imported on first use rather than with the module: the bot only
+needs it once an alert is rendered, not to start answering commands.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+
+import database
+import price_store
+
+logger = logging.getLogger("CryptoBot.Analytics")
+
+TICK = timedelta(minutes=2)
+HISTORY_DAYS = 7
+HIGH_WINDOWS_DAYS = (1, 7)
+RETURN_HORIZONS = {'1h': timedelta(hours=1), '24h': timedelta(days=1), '7d': timedelta(days=7)}
+MA_FAST = timedelta(hours=6)
+MA_SLOW = timedelta(hours=24)
+
+# Dashboard processes never see an ingest, so they recompute on this cadence instead
+SNAPSHOT_TTL = 120
+
+_lock = threading.Lock()
+_snapshot = None
+_snapshot_at = 0.0
+_stale = True
+
+
+def load_price_history(days=HISTORY_DAYS):
+    """Returns (prices, symbols, updated_at): a timestamp x coin_id frame on the tick grid,
+    a coin_id -> symbol map and each coin's last real tick in epoch seconds (the grid is forward-filled)."""
+    import pandas as pd
+
+    if price_store.store.warm:
+        return _history_from_store(days)
+
+    # A replica a minute behind is well inside the snapshot's own TTL
+    conn = database.get_read_connection(max_staleness=60)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT coin_id, timestamp, price FROM coin_prices WHERE timestamp > NOW() - INTERVAL '%s days';",
+                (days,)
+            )
+            rows = cur.fetchall()
+            cur.execute("SELECT coin_id, symbol FROM coin_mapping;")
+            symbols = dict(cur.fetchall())
+    finally:
+        conn.close()
+
+    if not rows:
+        return pd.DataFrame(), symbols, pd.Series(dtype=float)
+
+    frame = pd.DataFrame(rows, columns=['coin_id', 'timestamp', 'price'])
+    prices = frame.pivot_table(index='timestamp', columns='coin_id', values='price', aggfunc='last')
+    updated_at = frame.groupby('coin_id')['timestamp'].max().map(price_store.to_epoch)
+    return prices.resample(TICK).last().ffill(), symbols, updated_at
+
+
+def _history_from_store(days):
+    """Builds the same frame from the in-memory ring buffers without touching Postgres."""
+    import pandas as pd
+
+    store = price_store.store
+    cutoff = time.time() - days * 86400
+    columns, updated_at = {}, {}
+    for coin_id in list(store.series):
+        times, prices = store.history(coin_id)
+        recent = times > cutoff
+        if recent.any():
+            columns[coin_id] = pd.Series(prices[recent], index=pd.to_datetime(times[recent], unit='s'))
+            updated_at[coin_id] = times[-1]
+    symbols = {coin_id: meta['symbol'] for coin_id, meta in list(store.coins.items())}
+
+    if not columns:
+        return pd.DataFrame(), symbols, pd.Series(dtype=float)
+    return pd.DataFrame(columns).resample(TICK).last().ffill(), symbols, pd.Series(updated_at, dtype=float)
+
+
+def compute_indicators(prices, high_windows=HIGH_WINDOWS_DAYS, return_horizons=RETURN_HORIZONS,
+                       ma_fast=MA_FAST, ma_slow=MA_SLOW):
+    """Computes every indicator for every coin column in one vectorised pass."""
+    import pandas as pd
+
+    if prices.empty:
+        return pd.DataFrame()
+
+    end = prices.index[-1]
+    ticks_per_day = timedelta(days=1) / TICK
+    current = prices.iloc[-1]
+    out = pd.DataFrame(index=prices.columns)
+    out['current_price'] = current
+
+    for days in high_windows:
+        high = prices[prices.index > end - timedelta(days=days)].max()
+        out[f'high_{days}d'] = high
+        out[f'dip_{days}d'] = (high - current) / high * 100
+
+    for label, delta in return_horizons.items():
+        # Per column: DataFrame.asof skips any row where one coin (say, a new listing) has no price yet
+        past = prices.loc[:end - delta].ffill().iloc[-1] if end - delta >= prices.index[0] else prices.iloc[0]
+        out[f'return_{label}'] = (current / past - 1) * 100
+
+    log_returns = np.log(prices).diff()
+    last_day = log_returns[log_returns.index > end - timedelta(days=1)]
+    out['volatility_24h'] = last_day.std() * np.sqrt(ticks_per_day) * 100
+
+    drawdown = prices / prices.cummax() - 1
+    out['max_drawdown'] = drawdown.min() * 100
+
+    fast = prices.rolling(ma_fast, min_periods=1).mean()
+    slow = prices.rolling(ma_slow, min_periods=1).mean()
+    spread = fast - slow
+    now_above = spread.iloc[-1] > 0
+    was_above = spread.iloc[-2] > 0 if len(spread) > 1 else now_above
+    out['ma_fast'] = fast.iloc[-1]
+    out['ma_slow'] = slow.iloc[-1]
+    out['ma_cross'] = np.select(
+        [now_above & ~was_above, ~now_above & was_above, now_above],
+        ['golden_cross', 'death_cross', 'above'],
+        'below'
+    )
+
+    # Names the alert renderer already uses
+    out['seven_day_high'] = out['high_7d']
+    out['dip_percentage'] = out['dip_7d']
+    return out
+
+
+def mark_stale():
+    """Called after each ingest so the next reader builds a fresh snapshot."""
+    global _stale
+    _stale = True
+
+
+def get_snapshot():
+    """Returns the cached indicator frame, rebuilding it once per ingest (or per SNAPSHOT_TTL)."""
+    global _snapshot, _snapshot_at, _stale
+    with _lock:
+        if _snapshot is not None and not _stale and time.monotonic() - _snapshot_at < SNAPSHOT_TTL:
+            return _snapshot
+
+        started = time.perf_counter()
+        prices, symbols, updated_at = load_price_history()
+        snapshot = compute_indicators(prices)
+        if not snapshot.empty:
+            snapshot['symbol'] = [symbols.get(coin_id, coin_id.upper()) for coin_id in snapshot.index]
+            snapshot['updated_at'] = updated_at.reindex(snapshot.index)
+        _snapshot, _snapshot_at, _stale = snapshot, time.monotonic(), False
+        logger.info(f"Built analytics snapshot for {len(snapshot)} coins in {time.perf_counter() - started:.2f}s")
+        return _snapshot
+
+
+def get_coin_data(coin_ids):
+    """Snapshot rows for the given coins in the shape get_coin_current_and_7d_high returns."""
+    import pandas as pd
+
+    snapshot = get_snapshot()
+    coin_data = {}
+    for coin_id in coin_ids:
+        if coin_id in snapshot.index:
+            row = snapshot.loc[coin_id]
+            if pd.isna(row['current_price']) or pd.isna(row['seven_day_high']):
+                continue
+            coin_data[coin_id] = row.to_dict()
+    return coin_data
@@ -0,0 +1,246 @@
+"""
+Historical price backfill from CoinGecko's market_chart endpoint.
+
+A fresh deployment starts with an empty coin_prices table, so every
+"7-day high" is really a since-boot high until a week has passed. This
+fetches up to 90 days of history for every tracked coin (coin_mapping) and
+every coin on a watchlist. A small worker pool shares one request rate
+limit. Each coin is bulk-loaded with COPY into a staging table, then
+merged with INSERT ... ON CONFLICT DO NOTHING, so live ticks win and
+reruns are harmless.
+
+Progress is checkpointed after every coin, so an interrupted run resumes
+where it stopped. --dump-dir saves each response as <coin_id>.json, and
+--from-dir replays such a directory instead of calling the API (offline,
+or against a stub).
+
+History older than PRICE_RETENTION_DAYS would be deleted by the next
+daily cleanup, so it is not loaded; raise that setting to keep more. A
+running bot picks the new history up on its next reconcile or restart.
+
+Usage:
+    python backfill.py --days 7
+    python backfill.py --days 30 --dump-dir backfill_data
+    python backfill.py --from-dir backfill_data --coins bitcoin,ethereum
+"""
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import requests
+
+import database
+import gecko_api
+
+DEFAULT_CHECKPOINT = os.path.join("state", "backfill.json")
+MAX_DAYS = 90
+# The free tier allows roughly 30 calls a minute; stay under it with the live poller running
+DEFAULT_RATE_PER_MINUTE = 20
+MAX_ATTEMPTS = 5
+
+
+class RateLimiter:
+    """Spaces calls at least 60/per_minute seconds apart across all worker threads."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        time.sleep(slot - now)
+
+    def pause(self, seconds):
+        """Holds every worker back, e.g. after a 429."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+class Checkpoint:
+    """Coins already loaded for a given --days, persisted as JSON after every update."""
+
+    def __init__(self, path, days):
+        self.path = path
+        self.days = days
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get('days') == days:
+                self.done = saved.get('done', {})
+            else:
+                print(f"Ignoring checkpoint for --days {saved.get('days')}; starting over.")
+
+    def mark(self, coin_id, rows):
+        with self._lock:
+            self.done[coin_id] = rows
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({'days': self.days, 'updated_at': datetime.utcnow().isoformat(), 'done': self.done}, f)
+            os.replace(tmp_path, self.path)
+
+
+def tracked_coin_ids():
+    """Every coin in coin_mapping plus any watched coin that fell out of the top list."""
+    conn = database.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT coin_id FROM coin_mapping UNION SELECT DISTINCT coin_id FROM user_coins ORDER BY 1;")
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def fetch_chart(coin_id, days, limiter):
+    """The raw market_chart response, retrying rate limits and transient errors. None for unknown coins."""
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.wait()
+        try:
+            return gecko_api.fetch_market_chart(coin_id, days)
+        except requests.HTTPError as e:
+            status = e.response.status_code
+            if status == 404:
+                return None
+            if status == 429:
+                retry_after = float(e.response.headers.get('Retry-After') or 60)
+                print(f"Rate limited on {coin_id}; pausing {retry_after:.0f}s")
+                limiter.pause(retry_after)
+                continue
+            if status < 500:
+                raise
+        except requests.RequestException as e:
+            print(f"Request for {coin_id} failed ({e}); retrying")
+        limiter.pause(2 ** attempt)
+    raise RuntimeError(f"Gave up on {coin_id} after {MAX_ATTEMPTS} attempts")
+
+
+def load_ticks(coin_id, ticks, source):
+    """Bulk-loads [(timestamp, price)] for one coin. Returns the number of new rows."""
+    if not ticks:
+        return 0
+    buf = io.StringIO()
+    for ts, price in ticks:
+        buf.write(f"{coin_id}\t{ts.isoformat()}\t{price!r}\n")
+    buf.seek(0)
+
+    conn = database.get_db_connection()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "CREATE TEMP TABLE backfill_stage (coin_id TEXT, timestamp TIMESTAMP, price FLOAT) ON COMMIT DROP;"
+                )
+                cur.copy_expert("COPY backfill_stage (coin_id, timestamp, price) FROM STDIN", buf)
+                cur.execute(
+                    """
+                    INSERT INTO coin_prices (coin_id, timestamp, price, source)
+                    SELECT coin_id, timestamp, price, %s FROM backfill_stage
+                    ON CONFLICT (coin_id, timestamp) DO NOTHING;
+                    """,
+                    (source,)
+                )
+                return cur.rowcount
+    finally:
+        conn.close()
+
+
+def backfill_coin(coin_id, days, limiter, from_dir=None, dump_dir=None):
+    """Fetches (or reads) and loads one coin. Returns (points received, rows inserted)."""
+    if from_dir:
+        path = os.path.join(from_dir, f"{coin_id}.json")
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        source = "backfill:file"
+    else:
+        data = fetch_chart(coin_id, days, limiter)
+        if data is None:
+            return 0, 0
+        source = "backfill:coingecko"
+        if dump_dir:
+            with open(os.path.join(dump_dir, f"{coin_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f)
+
+    points = gecko_api.parse_market_chart(data)
+    cutoff = datetime.utcnow() - timedelta(days=min(days, database.PRICE_RETENTION_DAYS))
+    ticks = [(ts, price) for ts, price in points if ts >= cutoff]
+    return len(points), load_ticks(coin_id, ticks, source)
+
+
+def run(coin_ids, days, concurrency, rate_per_minute, checkpoint_path, from_dir=None, dump_dir=None):
+    checkpoint = Checkpoint(checkpoint_path, days)
+    pending = [coin_id for coin_id in coin_ids if coin_id not in checkpoint.done]
+    print(f"Backfilling {days} days for {len(pending)} coins "
+          f"({len(coin_ids) - len(pending)} already done per {checkpoint_path})")
+    if days > database.PRICE_RETENTION_DAYS:
+        print(f"Note: only the last {database.PRICE_RETENTION_DAYS} days are kept (PRICE_RETENTION_DAYS).")
+    if dump_dir:
+        os.makedirs(dump_dir, exist_ok=True)
+
+    limiter = RateLimiter(rate_per_minute)
+    started = time.perf_counter()
+    inserted = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="backfill") as executor:
+        futures = {
+            executor.submit(backfill_coin, coin_id, days, limiter, from_dir, dump_dir): coin_id
+            for coin_id in pending
+        }
+        try:
+            for i, future in enumerate(as_completed(futures), start=1):
+                coin_id = futures[future]
+                try:
+                    points, rows = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"[{i}/{len(pending)}] {coin_id}: failed ({e})")
+                    continue
+                checkpoint.mark(coin_id, rows)
+                inserted += rows
+                print(f"[{i}/{len(pending)}] {coin_id}: {points} points, {rows} new rows")
+        except KeyboardInterrupt:
+            print("Interrupted; finished coins are checkpointed. Rerun the same command to resume.")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    print(f"Inserted {inserted} rows in {time.perf_counter() - started:.1f}s; {failed} coin(s) failed.")
+    return inserted, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=7, help=f"history to fetch, 1-{MAX_DAYS}")
+    parser.add_argument("--coins", help="comma-separated coin ids (default: every tracked or watched coin)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_MINUTE, help="API calls per minute")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--from-dir", help="read <coin_id>.json market_chart dumps instead of calling the API")
+    parser.add_argument("--dump-dir", help="also save every fetched response here")
+    args = parser.parse_args()
+
+    if not 1 <= args.days <= MAX_DAYS:
+        parser.error(f"--days must be between 1 and {MAX_DAYS}")
+
+    database.init_database()
+    coin_ids = args.coins.split(",") if args.coins else tracked_coin_ids()
+    _, failed = run(coin_ids, args.days, args.concurrency, args.rate, args.checkpoint,
+                    from_dir=args.from_dir, dump_dir=args.dump_dir)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    main()
@@ -0,0 +1,527 @@
+"""
+Benchmark suite for the ingest -> alert pipeline against a local Postgres.
+
+Seeds a throwaway database, replays a recorded CoinGecko response from a
+local stub server, points the bot at a fake Telegram Bot API endpoint and
+times the price ingest, the due-alarm scan, the daily alert job and every
+bot command. Reports p50/p99 latency and SQL statement counts, and fails
+if an operation exceeds its QUERY_BUDGETS entry.
+
+Usage:
+    python benchmark.py record                       # capture a real /coins/markets response
+    python benchmark.py seed --users 10000 --days 7  # (re)build the benchmark dataset
+    python benchmark.py run --iterations 20 --json bench_output.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import psycopg2.extras
+import pytz
+
+import alarm_schedule
+import alert_workers
+import change_feed
+import coordination
+import database
+import digests
+import gecko_api
+import timezones
+
+DEFAULT_FIXTURE = os.path.join("bench_data", "coins_markets.json")
+STUB_BOT_TOKEN = "123456:BENCHMARK"
+TICK_INTERVAL = timedelta(minutes=2)
+
+TIMEZONES = [
+    'UTC', 'US/Eastern', 'US/Pacific', 'US/Central', 'US/Mountain',
+    'GMT', 'Europe/Berlin', 'Japan', 'Pacific/Auckland'
+]
+# Real users cluster their alarms around a handful of round morning/evening times
+POPULAR_SLOTS = [(7, 0), (7, 30), (8, 0), (8, 30), (9, 0), (12, 0), (18, 0), (20, 0), (21, 0)]
+
+
+# --- Query budgets ---
+# Most statements each operation may issue (counted by database.query_scope); a run that
+# exceeds one reports it and exits non-zero, so a new N+1 fails the benchmark
+QUERY_BUDGETS = {
+    "get_due_alarms": 1,
+    "/start": 3,
+    "/help": 3,
+    "/list": 1,
+    # Watchlist read on a cold cache, user upsert, insert and its change-feed NOTIFY
+    "/add": 4,
+    # Delete and its change-feed NOTIFY
+    "/remove": 2,
+    "/setalarm": 6,
+    "/message": 1,
+    "/donate": 0,
+}
+
+
+# --- Seeding ---
+def _check_local_database(force):
+    host = urlparse(os.getenv("DATABASE_URL", "")).hostname
+    if host not in ("localhost", "127.0.0.1", "::1") and not force:
+        raise SystemExit(f"Refusing to seed non-local database host '{host}'. Pass --force to override.")
+
+
+def _pick_alarm(rng, tz_name, now_utc, due_fraction):
+    """Returns a local alarm time with the skew real users show."""
+    roll = rng.random()
+    if roll < due_fraction:
+        # A burst of users whose alarm fires in the next few minutes
+        local_now = now_utc.astimezone(timezones.get_zone(tz_name))
+        return (local_now + timedelta(minutes=rng.randint(1, 4))).time().replace(second=0, microsecond=0)
+    if roll < due_fraction + 0.7:
+        hour, minute = rng.choice(POPULAR_SLOTS)
+        return datetime(2000, 1, 1, hour, minute).time()
+    return datetime(2000, 1, 1, rng.randrange(24), rng.randrange(60)).time()
+
+
+def _copy_rows(cur, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def load_markets_fixture(path, coins):
+    """Loads a recorded /coins/markets response, or synthesises one for the given coins."""
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return [
+        {
+            'id': coin_id,
+            'symbol': symbol.lower(),
+            'name': name,
+            'current_price': price,
+            'market_cap_rank': rank,
+            'last_updated': datetime.now(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        }
+        for rank, (coin_id, symbol, name, price) in enumerate(coins, start=1)
+    ]
+
+
+def seed_database(users, coins, days, due_fraction, fixture, seed):
+    """Replaces the benchmark dataset: users, watchlists, coin mapping and price ticks."""
+    rng = random.Random(seed)
+    now_utc = datetime.now(pytz.UTC)
+
+    recorded = load_markets_fixture(fixture, []) if os.path.exists(fixture) else []
+    coin_rows = [
+        (c['id'], c['symbol'].upper(), c['name'], c['current_price'])
+        for c in recorded[:coins]
+    ]
+    for i in range(len(coin_rows), coins):
+        coin_rows.append((f"benchcoin-{i}", f"BC{i}", f"Bench Coin {i}", round(10 ** rng.uniform(-4, 4), 6)))
+
+    conn = database.get_db_connection()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE users, user_alarms, user_delivery_status, user_coins, coin_prices, coin_mapping, alert_deliveries, admin_messages;")
+
+            print(f"Seeding {len(coin_rows)} coins...")
+            _copy_rows(cur, "coin_mapping", ("coin_id", "name", "symbol"),
+                       ((c, n, s) for c, s, n, _ in coin_rows))
+
+            ticks = int(timedelta(days=days) / TICK_INTERVAL)
+            print(f"Seeding {ticks} ticks x {len(coin_rows)} coins...")
+            start = now_utc.replace(tzinfo=None) - ticks * TICK_INTERVAL
+
+            def price_rows():
+                for coin_id, _, _, last_price in coin_rows:
+                    # Random walk that ends on the recorded price
+                    price = last_price
+                    walk = []
+                    for _ in range(ticks):
+                        walk.append(price)
+                        price = max(price * (1 + rng.gauss(0, 0.002)), 1e-9)
+                    for i, p in enumerate(reversed(walk)):
+                        yield (coin_id, f"{p:.10g}", start + (i + 1) * TICK_INTERVAL)
+
+            _copy_rows(cur, "coin_prices", ("coin_id", "price", "timestamp"), price_rows())
+
+            print(f"Seeding {users} users...")
+            user_rows, alarm_rows = [], []
+            for i in range(users):
+                tz_name = rng.choice(TIMEZONES)
+                user_rows.append((1_000_000 + i, tz_name))
+                # Some users add a weekday-only alarm next to their daily one
+                alarms = [(_pick_alarm(rng, tz_name, now_utc, due_fraction), timezones.EVERY_DAY)]
+                if rng.random() < 0.2:
+                    alarms.append((_pick_alarm(rng, tz_name, now_utc, 0), timezones.WEEKDAYS))
+                for alarm_time, weekdays in dict(alarms).items():
+                    next_fire = timezones.next_fire(alarm_time, tz_name, weekdays, now_utc)
+                    alarm_rows.append((1_000_000 + i, alarm_time, tz_name, weekdays, next_fire))
+            _copy_rows(cur, "users", ("user_id", "timezone"), user_rows)
+            _copy_rows(cur, "user_alarms", ("user_id", "alarm_time", "timezone", "weekdays", "next_fire_utc"), alarm_rows)
+
+            # Popularity falls off with market cap rank
+            coin_ids = [c[0] for c in coin_rows]
+            weights = [1 / (rank + 1) for rank in range(len(coin_ids))]
+
+            def watchlist_rows():
+                for user_id, _ in user_rows:
+                    picks = set(rng.choices(coin_ids, weights=weights, k=rng.randint(1, 10)))
+                    for coin_id in picks:
+                        yield (user_id, coin_id)
+
+            _copy_rows(cur, "user_coins", ("user_id", "coin_id"), watchlist_rows())
+            cur.execute("ANALYZE;")
+    conn.close()
+    print("Seeding complete.")
+
+
+# --- Stub servers ---
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves the recorded CoinGecko response and a minimal Telegram Bot API."""
+
+    markets = []
+    telegram_calls = {}
+    # Every n-th seeded user has blocked the bot, as a churning user base does
+    blocked_every = 50
+    _lock = threading.Lock()
+    _message_id = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(payload.get("error_code", 200) if isinstance(payload, dict) else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_params(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw or b"{}")
+        return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+    def do_GET(self):
+        path = urlparse(self.path)
+        if path.path.endswith("/coins/markets"):
+            per_page = int(parse_qs(path.query).get("per_page", ["100"])[0])
+            # Roughly half the coins refresh between polls, like the real endpoint
+            now = datetime.now(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            for coin in self.markets[:per_page]:
+                if random.random() < 0.5:
+                    coin['current_price'] *= random.uniform(0.999, 1.001)
+                    coin['last_updated'] = now
+            self._reply(self.markets[:per_page])
+        else:
+            self._telegram(path.path, {})
+
+    def do_POST(self):
+        self._telegram(urlparse(self.path).path, self._read_params())
+
+    def _telegram(self, path, params):
+        method = path.rsplit("/", 1)[-1]
+        with self._lock:
+            StubHandler.telegram_calls[method] = StubHandler.telegram_calls.get(method, 0) + 1
+            StubHandler._message_id += 1
+            message_id = StubHandler._message_id
+
+        if method == "getMe":
+            self._reply({"ok": True, "result": {
+                "id": 123456, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"
+            }})
+        elif method == "sendMessage" and int(params.get("chat_id", 0)) % self.blocked_every == 0:
+            self._reply({"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"})
+        elif method in ("sendMessage", "sendPhoto", "sendDocument"):
+            self._reply({"ok": True, "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }})
+        else:
+            self._reply({"ok": True, "result": True})
+
+
+def start_stub_server(markets):
+    StubHandler.markets = markets
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# --- Timing ---
+def percentile(samples, pct):
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.results = {}
+        self.budget_violations = []
+
+    async def measure(self, name, func, *args):
+        budget = QUERY_BUDGETS.get(name)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                with database.query_budget(budget if budget is not None else float("inf"), name) as scope:
+                    start = time.perf_counter()
+                    result = func(*args)
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                    elapsed = time.perf_counter() - start
+            except database.QueryBudgetExceeded as e:
+                self.budget_violations.append(str(e))
+        self.results.setdefault(name, []).append((elapsed, scope.count))
+        return result
+
+    def summary(self):
+        rows = []
+        for name, samples in self.results.items():
+            durations = [s[0] * 1000 for s in samples]
+            queries = [s[1] for s in samples]
+            rows.append({
+                'operation': name,
+                'runs': len(samples),
+                'p50_ms': round(percentile(durations, 50), 2),
+                'p99_ms': round(percentile(durations, 99), 2),
+                'queries_p50': percentile(queries, 50),
+                'queries_max': max(queries),
+            })
+        return rows
+
+
+def _fake_update(tg_bot, update_id, user_id, text):
+    from telegram import Update
+
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }, tg_bot)
+
+
+def _count_rows(table):
+    conn = database.get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {table};")
+        count = cur.fetchone()[0]
+    conn.close()
+    return count
+
+
+def _reset_delivery_status():
+    """Un-prunes everyone so each run starts from the same due set."""
+    import price_collector
+
+    # Alarms paused by an earlier run become due again, as if they had never been sent
+    since = datetime.now(pytz.UTC) - price_collector.MISSED_ALARM_GRACE
+    conn = database.get_db_connection()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM user_delivery_status;")
+            cur.execute("SELECT alarm_id, alarm_time, timezone, weekdays FROM user_alarms WHERE next_fire_utc IS NULL;")
+            paused = cur.fetchall()
+            psycopg2.extras.execute_values(
+                cur,
+                "UPDATE user_alarms a SET next_fire_utc = v.next_fire FROM (VALUES %s) AS v (alarm_id, next_fire) "
+                "WHERE a.alarm_id = v.alarm_id;",
+                [(alarm_id, timezones.next_fire(t, tz_name, days, since)) for alarm_id, t, tz_name, days in paused],
+                template="(%s::BIGINT, %s::TIMESTAMPTZ)"
+            )
+    conn.close()
+
+
+def _reset_alert_ledger():
+    conn = database.get_db_connection()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM alert_deliveries;")
+            # Rewind alarms the previous iteration fired so the next one has the same due set
+            cur.execute(
+                "UPDATE user_alarms SET next_fire_utc = last_fired_utc, last_fired_utc = NULL "
+                "WHERE last_fired_utc IS NOT NULL;"
+            )
+    conn.close()
+
+
+async def run_benchmarks(iterations, fixture):
+    from telegram import Bot
+    import bot
+    import price_collector
+    import price_store
+
+    conn = database.get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT coin_id, symbol, name FROM coin_mapping;")
+        mapping = cur.fetchall()
+        cur.execute("SELECT user_id FROM users ORDER BY random() LIMIT %s;", (iterations,))
+        sample_users = [row[0] for row in cur.fetchall()]
+    conn.close()
+    if not sample_users:
+        raise SystemExit("No users found - run `python benchmark.py seed` first.")
+
+    latest = database.get_coin_current_and_7d_high([c[0] for c in mapping])
+    markets = load_markets_fixture(fixture, [
+        (coin_id, symbol, name, latest.get(coin_id, {}).get('current_price', 1.0))
+        for coin_id, symbol, name in mapping
+    ])
+    server, base_url = start_stub_server(markets)
+    gecko_api.COINGECKO_API_URL = f"{base_url}/api/v3"
+
+    tg_bot = Bot(STUB_BOT_TOKEN, base_url=f"{base_url}/bot")
+    await tg_bot.initialize()
+    context = SimpleNamespace(bot=tg_bot)
+    users_total = _count_rows("users")
+
+    _reset_delivery_status()
+    # Like main.py: watchlists are served from memory once the change feed is listening
+    change_feed.start()
+    alarm_schedule.schedule.load_from_db()
+    # One process runs every job, so digests are prepared where they are sent
+    coordination.LEADER_ELECTION = False
+    if alert_workers.enabled():
+        for future in alert_workers.start():
+            future.result()
+    recorder = Recorder()
+    # Startup cost, paid once per process before the jobs run
+    await recorder.measure("price_store.warm_from_db", price_store.store.warm_from_db)
+
+    for _ in range(iterations):
+        await recorder.measure("fetch_and_store_prices", price_collector.fetch_and_store_prices, context)
+        await recorder.measure("get_due_alarms", database.get_due_alarms, price_collector.ALERT_LOOKAHEAD)
+        _reset_alert_ledger()
+        await recorder.measure("send_daily_alerts", price_collector.send_daily_alerts, context)
+
+    coin_ids = [c[0] for c in mapping]
+    commands = [
+        ("start", bot.start, lambda: []),
+        ("help", bot.start, lambda: []),
+        ("list", bot.list_coins, lambda: []),
+        ("add", bot.add_coin, lambda: [random.choice(coin_ids)]),
+        ("remove", bot.remove_coin, lambda: [random.choice(coin_ids)]),
+        ("setalarm", bot.set_alarm, lambda: ["08:30", random.choice(["EST", "UTC", "NZT"])]),
+        ("message", bot.message_admin, lambda: ["benchmark", "feedback"]),
+        ("donate", bot.donate, lambda: []),
+    ]
+    update_id = 0
+    for user_id in sample_users:
+        for name, handler, make_args in commands:
+            update_id += 1
+            args = make_args()
+            update = _fake_update(tg_bot, update_id, user_id, " ".join([f"/{name}"] + args))
+            bot.user_last_command.clear()
+            await recorder.measure(f"/{name}", handler, update, SimpleNamespace(args=args, bot=tg_bot))
+
+    await tg_bot.shutdown()
+    change_feed.stop()
+    alert_workers.shutdown()
+    server.shutdown()
+    return {
+        'users': users_total,
+        'coins': len(mapping),
+        'iterations': iterations,
+        'telegram_calls': dict(StubHandler.telegram_calls),
+        'digests': {'prepared': digests.queue.prepared, 'sent_prepared': digests.queue.taken,
+                    'stale': digests.queue.stale},
+        'delivery': database.get_delivery_report(max_staleness=0),
+        'results': recorder.summary(),
+        'budget_violations': recorder.budget_violations,
+    }
+
+
+def print_report(report):
+    print(f"\nBenchmark: {report['users']} users, {report['coins']} coins, {report['iterations']} iterations")
+    print(f"{'operation':<28}{'runs':>6}{'p50 ms':>12}{'p99 ms':>12}{'queries p50':>14}{'queries max':>14}")
+    for row in report['results']:
+        print(f"{row['operation']:<28}{row['runs']:>6}{row['p50_ms']:>12.2f}{row['p99_ms']:>12.2f}"
+              f"{row['queries_p50']:>14}{row['queries_max']:>14}")
+    print(f"Telegram API calls: {report['telegram_calls']}")
+    if 'digests' in report:
+        print(f"Digests: {report['digests']}")
+    if 'delivery' in report:
+        print(f"Pruned unreachable users: {report['delivery']['pruned']}")
+    for violation in report.get('budget_violations', []):
+        print(f"Query budget exceeded: {violation}")
+
+
+def record_markets(path, limit):
+    """Captures a live /coins/markets response so runs are reproducible."""
+    import requests
+
+    response = requests.get(
+        f"{gecko_api.COINGECKO_API_URL}/coins/markets",
+        params={'vs_currency': 'usd', 'order': 'market_cap_desc', 'per_page': limit, 'page': 1, 'sparkline': False},
+        timeout=30
+    )
+    response.raise_for_status()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(response.json(), f)
+    print(f"Recorded {len(response.json())} coins to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE, help="recorded /coins/markets response")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="record a live CoinGecko response")
+    rec.add_argument("--limit", type=int, default=100)
+
+    seed = sub.add_parser("seed", help="replace the database contents with a benchmark dataset")
+    seed.add_argument("--users", type=int, default=1000)
+    seed.add_argument("--coins", type=int, default=100)
+    seed.add_argument("--days", type=int, default=7)
+    seed.add_argument("--due-fraction", type=float, default=0.05,
+                      help="share of users whose alarm fires in the next few minutes")
+    seed.add_argument("--seed", type=int, default=42)
+    seed.add_argument("--force", action="store_true", help="allow seeding a non-local database")
+
+    run = sub.add_parser("run", help="time the pipeline against the seeded database")
+    run.add_argument("--iterations", type=int, default=10)
+    run.add_argument("--json", help="write the report to this file as well")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_markets(args.fixture, args.limit)
+    elif args.command == "seed":
+        _check_local_database(args.force)
+        database.init_database()
+        seed_database(args.users, args.coins, args.days, args.due_fraction, args.fixture, args.seed)
+    elif args.command == "run":
+        report = asyncio.run(run_benchmarks(args.iterations, args.fixture))
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, default=str)
+        if report['budget_violations']:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    main()
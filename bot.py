@@ -1,48 +1,39 @@
 import logging
 import asyncio
-from telegram import Update
-from telegram.ext import (
-    Application, CommandHandler, ContextTypes,
-    MessageHandler, filters, ConversationHandler
-)
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.ext import CommandHandler, ContextTypes
+import broadcasts
+import charts
+import coin_search
+import coordination
 import database
-import re
-from datetime import datetime, timedelta, time
+import export
+import price_store
+import price_collector
+import profiling
+import timezones
+import watchlists
+from alarm_schedule import schedule as alarm_schedule
+import tempfile
+from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
-from logging_config import setup_logging
 import telegram
 
-ASK_TIMEZONE = 1
-
-
-# --- Logging Setup ---
-setup_logging()
 logger = logging.getLogger("CryptoBot")
-logger.info("Bot starting up...")
-
-# Load .env variables
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-DATABASE_PATH = os.getenv("DATABASE_PATH")
-
-# Unified logger for all messages and commands
-async def log_everything(update, context):
-    """Logs all messages, including commands, with user info."""
-    if update.message:
-        user = update.effective_user
-        user_id = user.id
-        username = user.username or user.full_name
-        text = update.message.text
-        is_command = text.startswith("/")
-        logger.info(
-            f"{'Command' if is_command else 'Message'} from {username} ({user_id}): {text}"
-        )
 
 # --- Abuse Protection Config ---
 COMMAND_COOLDOWN = 5   # seconds between commands
 MAX_COINS_PER_USER = 20
 MAX_MESSAGE_LENGTH = 500
+MAX_ALARMS_PER_USER = 5
+# Telegram user ids allowed to run admin commands such as /broadcast
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+# Exports larger than this spill from memory to a temp file before upload
+EXPORT_SPOOL_BYTES = 4 * 1024 * 1024
+# Inline answers: cards per answer, and how long Telegram may reuse one for the same query
+INLINE_RESULTS = 20
+INLINE_CACHE_TIME = 30
+inline_results = coin_search.ResultCache()
 
 # Track last command per user
 user_last_command = {}
@@ -63,24 +54,45 @@ async def rate_limit(update: Update) -> bool:
     return True
 
 
+def command_handler(name, callback):
+    """CommandHandler whose queries are attributed to /name (see database.query_scope) and that can be profiled as /name."""
+    return CommandHandler(name, profiling.profiled(f"/{name}")(database.scoped(f"/{name}")(callback)))
+
+
+def _schedule_default_alarm(user_id):
+    """Mirrors a freshly created user's default alarm into the in-memory schedule."""
+    if not alarm_schedule.has_user(user_id):
+        alarm_schedule.set_user(user_id, database.get_user_alarms(user_id))
+
+
+def _format_alarms(rows):
+    """Numbered alarm lines, as /delalarm refers to them."""
+    return "\n".join(
+        f"{i}. {alarm_time.strftime('%H:%M')} {tz_name} ({timezones.format_weekdays(weekdays)})"
+        for i, (_, alarm_time, tz_name, weekdays, _) in enumerate(rows, 1)
+    )
+
+
 # --- Bot Commands ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if not database.user_exists(user_id):
         database.add_user_with_default_alarm(user_id)
+        _schedule_default_alarm(user_id)
+    elif database.revive_user(user_id):
+        # They had blocked the bot and are back: their paused alarms fire again
+        alarm_schedule.set_user(user_id, database.get_user_alarms(user_id))
     
-    # Correctly unpack only two values
-    alarm_info = database.get_user_alarm(user_id)
+    alarms = database.get_user_alarms(user_id)
     
     # Check if a user has an alarm set at all
-    if alarm_info and alarm_info[0] and alarm_info[1]:
-        # Unpack only alarm_time and timezone
-        alarm_time, timezone = alarm_info
-        
-        # Now you can use these variables to display the alert info
-        display_time = alarm_time.strftime("%I:%M %p")
-        alert_info = f"📅 Your daily alerts are set for <b>{display_time} {timezone}</b>."
+    if alarms:
+        lines = "\n".join(
+            f"• <b>{alarm_time.strftime('%I:%M %p')} {tz_name}</b> ({timezones.format_weekdays(weekdays)})"
+            for _, alarm_time, tz_name, weekdays, _ in alarms
+        )
+        alert_info = f"📅 Your alerts are set for:\n{lines}"
             
     else:
         alert_info = "📅 No daily alerts set yet"
@@ -92,12 +104,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 I'll keep track of your favourite coins and send you <b>daily dip alerts</b> at your chosen time 🚀
 
 📅 <b>Daily Alerts</b>
-• Use <code>/setalarm &lt;time&gt; &lt;timezone&gt;</code> to schedule alerts  
+• <code>/setalarm &lt;time&gt; &lt;timezone&gt; [days]</code> - Replace your alarms with one  
+• <code>/addalarm &lt;time&gt; [timezone] [days]</code> - Add another alarm  
+• <code>/alarms</code> - List your alarms  
+• <code>/delalarm &lt;number&gt;</code> - Remove an alarm  
 
 💰 <b>Watchlist</b>
 • <code>/add &lt;coin_symbol&gt;</code> - Add a coin  
 • <code>/remove &lt;coin_symbol&gt;</code> - Remove a coin  
 • <code>/list</code> - Show your tracked coins  
+• <code>/price [coins]</code> - Current prices, 24h change and dip  
+• <code>/chart &lt;coin&gt;</code> - Price chart of a coin  
+• <code>/export [days]</code> - Download your coins' price history as CSV  
 
 ⚙️ <b>Other Commands</b>
 • <code>/help</code> - Show this menu again  
@@ -119,16 +137,18 @@ async def add_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please specify a coin! Example: /add bitcoin")
         return
 
-    if len(database.get_user_coins(user_id)) >= MAX_COINS_PER_USER:
+    if len(watchlists.cache.get(user_id)) >= MAX_COINS_PER_USER:
         await update.message.reply_text(f"⚠️ You can only track up to {MAX_COINS_PER_USER} coins.")
         return
 
     coin = context.args[0].lower()
-    if not database.is_valid_coin(coin):
+    if not (price_store.store.has_coin(coin) or database.is_valid_coin(coin)):
         await update.message.reply_text(f"❌ '{coin}' not recognized. Try common names like 'bitcoin', 'ethereum'.")
         return
 
     if database.add_coin_for_user(user_id, coin):
+        watchlists.cache.apply(user_id, coin, added=True)
+        _schedule_default_alarm(user_id)
         await update.message.reply_text(f"✅ Added {coin} to your watchlist!")
         logger.info(f"User {user_id} added coin {coin}")
     else:
@@ -145,6 +165,7 @@ async def remove_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     coin = context.args[0].lower()
     if database.remove_coin_for_user(user_id, coin):
+        watchlists.cache.apply(user_id, coin, added=False)
         await update.message.reply_text(f"✅ Removed {coin} from your watchlist.")
         logger.info(f"User {user_id} removed coin {coin}")
     else:
@@ -153,13 +174,13 @@ async def remove_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def list_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await rate_limit(update): return
     user_id = update.effective_user.id
-    coins = database.get_user_coins(user_id)
+    coins = watchlists.cache.get(user_id)
 
     if not coins:
         await update.message.reply_text("📭 You aren’t tracking any coins yet.\nUse `/add bitcoin` to start!")
         return
 
-    coin_list = "\n".join([f"• {c.capitalize()}" for c in coins])
+    coin_list = "\n".join([_format_list_entry(c) for c in coins])
     await update.message.reply_text(
         f"📊 You’re currently tracking {len(coins)} coin(s):\n\n{coin_list}"
     )
@@ -167,56 +188,269 @@ async def list_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
    
 
 
-async def set_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def _format_list_entry(coin_id):
+    """One /list line, with the latest price when the in-memory store has it."""
+    latest = price_store.store.latest(coin_id)
+    if latest is None:
+        return f"• {coin_id.capitalize()}"
+    age = price_collector.stale_age(latest[0])
+    age_str = f" (as of {price_collector.format_age(age)} ago)" if age else ""
+    return f"• {coin_id.capitalize()}: ${price_collector.format_price(latest[1])}{age_str}"
+
+
+def _quote(coin_id, now):
+    """(emoji, symbol, price, details) for a coin from the price store, or None without a price."""
+    latest = price_store.store.latest(coin_id)
+    if latest is None:
+        return None
+    updated_at, price = latest
+    symbol = price_store.store.coins.get(coin_id, {}).get('symbol', coin_id).upper()
+    emoji, details = "⚪", []
+
+    day_ago = price_store.store.price_at(coin_id, updated_at - 86400)
+    if day_ago is not None and day_ago[1]:
+        details.append(f"24h {(price - day_ago[1]) / day_ago[1] * 100:+.1f}%")
+    high = price_store.store.rolling_high(coin_id, now)
+    if high:
+        dip = (high - price) / high * 100
+        emoji, _ = price_collector.dip_status(dip)
+        details.append(f"{dip:.1f}% below 7d high")
+    age = price_collector.stale_age(updated_at)
+    if age:
+        details.append(f"as of {price_collector.format_age(age)} ago")
+    return emoji, symbol, price, details
+
+
+def _format_quote(coin_id, now):
+    """One /price line: price, 24h change and dip from the 7-day high, all from the price store."""
+    quote = _quote(coin_id, now)
+    if quote is None:
+        return f"❔ {coin_id}: no price yet"
+    emoji, symbol, price, details = quote
+    line = f"{emoji} <b>{symbol}</b> ${price_collector.format_price(price)}"
+    return f"{line} · {' · '.join(details)}" if details else line
+
+
+async def show_prices(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/price [coins] - current prices for the given coins, or the whole watchlist."""
+    if not await rate_limit(update): return
+    user_id = update.effective_user.id
+    coins = [c.lower() for arg in context.args for c in arg.split(",") if c] if context.args else None
+    if not coins:
+        coins = watchlists.cache.get(user_id)
+        if not coins:
+            await update.message.reply_text("Usage: /price bitcoin ethereum\nOr /add coins to get your whole watchlist.")
+            return
+
+    now = datetime.now().timestamp()
+    lines = [_format_quote(coin, now) for coin in coins[:MAX_COINS_PER_USER]]
+    await update.message.reply_html("\n".join(lines))
+    logger.info(f"User {user_id} requested prices for {len(coins)} coin(s)")
 
+
+async def show_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/chart <coin> - a sparkline of the coin's stored price history."""
+    if not await rate_limit(update): return
     user_id = update.effective_user.id
-    args = context.args
 
-    if len(args) != 2:
-        await update.message.reply_text("❌ Incorrect number of arguments.\n\nUsage: `/setalarm <time> <timezone>`\nExample: `/setalarm 14:30 EST` or `/setalarm 14.30 EST`")
+    if not context.args:
+        await update.message.reply_text("Please specify a coin! Example: /chart bitcoin")
+        return
+
+    coin = context.args[0].lower()
+    png = await asyncio.to_thread(charts.cache.get, coin)
+    if png is None:
+        await update.message.reply_text(f"❌ Not enough price history for '{coin}' yet.")
         return
+    await update.message.reply_photo(photo=png, caption=_format_quote(coin, datetime.now().timestamp()),
+                                     parse_mode="HTML")
+    logger.info(f"User {user_id} requested a chart for {coin}")
+
+
+def _inline_card(coin_id, now):
+    quote = _quote(coin_id, now)
+    if quote is None:
+        return None
+    emoji, symbol, price, details = quote
+    name = price_store.store.coins.get(coin_id, {}).get('name') or coin_id
+    return InlineQueryResultArticle(
+        id=coin_id,
+        title=f"{emoji} {symbol} · {name}  ${price_collector.format_price(price)}",
+        description=" · ".join(details) or None,
+        input_message_content=InputTextMessageContent(_format_quote(coin_id, now), parse_mode="HTML"),
+    )
 
-    alarm_time_str = args[0]
-    timezone_str = args[1].upper()
-
-    # The most common issue is using a static timezone string.
-    # We must map to the full, dynamic timezone string that accounts for DST.
-    tz_map = {
-        'EST': 'US/Eastern',
-        'PST': 'US/Pacific',
-        'CST': 'US/Central',
-        'MST': 'US/Mountain',
-        'UTC': 'UTC',
-        'GMT': 'GMT',
-        'CET': 'CET',
-        'JST': 'Japan',
-        'NZT': 'Pacific/Auckland'
-    }
-
-    if timezone_str not in tz_map:
-        await update.message.reply_text(f"❌ Invalid timezone. Please use one of the following: {', '.join(tz_map.keys())}")
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@bot <symbol or name> - ranked price cards, answered from memory."""
+    query = coin_search.normalize(update.inline_query.query)
+    key = (query, price_store.store.version)
+    results = inline_results.get(key)
+    if results is None:
+        now = datetime.now().timestamp()
+        cards = (_inline_card(coin_id, now) for coin_id in coin_search.index.search(query))
+        results = [card for card in cards if card is not None][:INLINE_RESULTS]
+        inline_results.put(key, results)
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+
+
+async def export_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [days] - sends the price history of the user's watchlist as a CSV file."""
+    if not await rate_limit(update): return
+    user_id = update.effective_user.id
+    coins = watchlists.cache.get(user_id)
+
+    if not coins:
+        await update.message.reply_text("📭 Your watchlist is empty, so there is nothing to export.")
         return
 
-    # Use the correct timezone string for the database
-    database_timezone_str = tz_map[timezone_str]
+    days = database.PRICE_RETENTION_DAYS
+    if context.args and context.args[0].isdigit():
+        days = min(max(int(context.args[0]), 1), database.PRICE_RETENTION_DAYS)
+    start = datetime.utcnow() - timedelta(days=days)
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as f:
+        rows = await asyncio.to_thread(export.write, f, 'csv', coins, start)
+        if not rows:
+            await update.message.reply_text("📭 No price history stored for your coins yet.")
+            return
+        f.seek(0)
+        await update.message.reply_document(
+            document=f,
+            filename=f"cryptobot_{days}d_{datetime.utcnow():%Y%m%d}.csv",
+            caption=f"📈 {rows} prices for {len(coins)} coin(s) over the last {days} day(s)",
+        )
+    logger.info(f"User {user_id} exported {rows} rows ({days}d)")
+
 
+def _parse_alarm_time(time_str):
+    """HH:MM or HH.MM as a time, or None."""
     try:
-        # Replace dot with colon to handle both formats
-        formatted_time_str = alarm_time_str.replace('.', ':')
-        
-        # Check if the time is in HH:MM format
-        alarm_time = datetime.strptime(formatted_time_str, '%H:%M').time()
+        return datetime.strptime(time_str.replace('.', ':'), '%H:%M').time()
     except ValueError:
+        return None
+
+
+async def set_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+    user_id = update.effective_user.id
+    args = context.args
+
+    if len(args) not in (2, 3):
+        await update.message.reply_text(
+            "❌ Incorrect number of arguments.\n\nUsage: `/setalarm <time> <timezone> [days]`\n"
+            "Example: `/setalarm 14:30 EST`, `/setalarm 14.30 Europe/Berlin` or `/setalarm 08:00 NZT weekdays`"
+        )
+        return
+
+    # Abbreviations are mapped to the full zone that accounts for DST; any IANA name also works
+    timezone_str = timezones.resolve(args[1])
+    if timezone_str is None:
+        await update.message.reply_text(
+            f"❌ Unknown timezone. Use a zone name such as Europe/London or America/New_York, "
+            f"or one of: {', '.join(timezones.ABBREVIATIONS)}"
+        )
+        return
+
+    weekdays = timezones.parse_weekdays(args[2] if len(args) == 3 else None)
+    if weekdays is None:
+        await update.message.reply_text("❌ Invalid days. Use daily, weekdays, weekends, mon-fri or mon,wed,fri.")
+        return
+
+    alarm_time = _parse_alarm_time(args[0])
+    if alarm_time is None:
         await update.message.reply_text("❌ Invalid time format. Please use HH:MM or HH.MM (e.g., 14:30 or 14.30).")
         return
 
-    if database.set_user_alarm(user_id, alarm_time, database_timezone_str):
-        await update.message.reply_text(f"✅ Your daily alarm has been set for {formatted_time_str} {timezone_str}.")
-        logger.error(f"User {user_id} set alarm for {formatted_time_str} {timezone_str}")
+    rows = database.set_user_alarm(user_id, alarm_time, timezone_str, weekdays)
+    if rows is not None:
+        alarm_schedule.set_user(user_id, rows)
+        await update.message.reply_text(
+            f"✅ Your alarm has been set for {alarm_time.strftime('%H:%M')} {timezone_str} "
+            f"({timezones.format_weekdays(weekdays)})."
+        )
+        logger.info(f"User {user_id} set alarm for {alarm_time} {timezone_str} ({weekdays:07b})")
     else:
         await update.message.reply_text("❌ Failed to set the alarm. Please try again later.")
 
 
+async def add_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/addalarm <time> [timezone] [days]: adds another alarm, in the user's current zone by default."""
+    if not await rate_limit(update): return
+    user_id = update.effective_user.id
+    args = context.args
+
+    if not 1 <= len(args) <= 3:
+        await update.message.reply_text(
+            "Usage: `/addalarm <time> [timezone] [days]`\nExample: `/addalarm 07:30 weekdays` or `/addalarm 18:00 Asia/Tokyo`"
+        )
+        return
+
+    alarm_time = _parse_alarm_time(args[0])
+    if alarm_time is None:
+        await update.message.reply_text("❌ Invalid time format. Please use HH:MM or HH.MM (e.g., 14:30 or 14.30).")
+        return
+
+    # The second argument is a zone unless it reads as days
+    rest = args[1:]
+    timezone_str = None
+    if len(rest) == 2 or (rest and timezones.parse_weekdays(rest[0]) is None):
+        timezone_str = timezones.resolve(rest[0])
+        if timezone_str is None:
+            await update.message.reply_text("❌ Unknown timezone. Use a zone name such as Europe/London or America/New_York.")
+            return
+        rest = rest[1:]
+    timezone_str = timezone_str or database.get_user_timezone(user_id) or database.DEFAULT_TIMEZONE
+
+    weekdays = timezones.parse_weekdays(rest[0] if rest else None)
+    if weekdays is None:
+        await update.message.reply_text("❌ Invalid days. Use daily, weekdays, weekends, mon-fri or mon,wed,fri.")
+        return
+
+    rows = database.add_user_alarm(user_id, alarm_time, timezone_str, weekdays, limit=MAX_ALARMS_PER_USER)
+    if rows is False:
+        await update.message.reply_text(f"⚠️ You can have up to {MAX_ALARMS_PER_USER} alarms. Remove one with /delalarm.")
+    elif rows is None:
+        await update.message.reply_text("❌ Failed to add the alarm. Please try again later.")
+    else:
+        alarm_schedule.set_user(user_id, rows)
+        await update.message.reply_text(f"✅ Alarm added. Your alarms:\n{_format_alarms(rows)}")
+        logger.info(f"User {user_id} added alarm {alarm_time} {timezone_str} ({weekdays:07b})")
+
+
+async def list_alarms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await rate_limit(update): return
+    rows = database.get_user_alarms(update.effective_user.id)
+    if not rows:
+        await update.message.reply_text("📅 You have no alarms. Use /setalarm or /addalarm to create one.")
+        return
+    await update.message.reply_text(f"📅 Your alarms:\n{_format_alarms(rows)}\n\nRemove one with /delalarm <number>.")
+
+
+async def remove_alarm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/delalarm <n>: removes the n-th alarm as numbered by /alarms."""
+    if not await rate_limit(update): return
+    user_id = update.effective_user.id
+
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /delalarm <number> (see /alarms)")
+        return
+
+    alarms = database.get_user_alarms(user_id)
+    index = int(context.args[0]) - 1
+    if not 0 <= index < len(alarms):
+        await update.message.reply_text("❌ No alarm with that number. See /alarms.")
+        return
+
+    rows = database.remove_user_alarm(user_id, alarms[index][0])
+    if rows is None:
+        await update.message.reply_text("❌ Failed to remove the alarm. Please try again later.")
+        return
+    alarm_schedule.set_user(user_id, rows)
+    remaining = f"Your alarms:\n{_format_alarms(rows)}" if rows else "You have no alarms left."
+    await update.message.reply_text(f"🗑 Alarm removed. {remaining}")
+
+
 async def message_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await rate_limit(update): return
     user_id = update.effective_user.id
@@ -235,6 +469,126 @@ async def message_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"User {user_id} sent feedback: {msg}")
 
 
+def is_admin(user_id):
+    return user_id in ADMIN_USER_IDS
+
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin only. /broadcast [all|coin:<id>|tz:<zone>] <message>, /broadcast status, /broadcast cancel [id]."""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ This command is only available to admins.")
+        logger.warning(f"User {user_id} tried to use /broadcast")
+        return
+
+    args = context.args
+    if not args:
+        await update.message.reply_text(
+            "Usage: /broadcast [all|coin:<coin_id>|tz:<zone>] <message>\n"
+            "/broadcast status - recent broadcasts\n/broadcast cancel [id] - stop one"
+        )
+        return
+
+    if args[0].lower() == "status" and len(args) == 1:
+        rows = broadcasts.get_recent()
+        if not rows:
+            await update.message.reply_text("No broadcasts yet.")
+            return
+        lines = [
+            f"#{broadcast_id} {segment} - {status}: {sent} sent, {failed} failed, {blocked} blocked ({created_at:%Y-%m-%d %H:%M})"
+            for broadcast_id, segment, status, sent, failed, blocked, created_at in rows
+        ]
+        await update.message.reply_text("📣 Recent broadcasts:\n" + "\n".join(lines))
+        return
+
+    if args[0].lower() == "cancel" and len(args) <= 2:
+        target = int(args[1]) if len(args) == 2 and args[1].isdigit() else None
+        cancelled = broadcasts.cancel(target)
+        await update.message.reply_text(f"🛑 Broadcast #{cancelled} cancelled." if cancelled else "No open broadcast to cancel.")
+        return
+
+    # Keep the admin's line breaks: take the text after the command rather than the split args
+    text = update.message.text.split(None, 1)[1]
+    segment = 'all'
+    # Only all, coin:... and tz:... are segments; "Maintenance: tonight" is part of the message
+    if args[0].lower() == 'all' or args[0].lower().startswith(('coin:', 'tz:')):
+        segment = broadcasts.parse_segment(args[0])
+        if segment is None:
+            await update.message.reply_text("❌ Unknown segment. Use all, coin:<coin_id> or tz:<zone>.")
+            return
+        text = text.split(None, 1)[1] if len(args) > 1 else ""
+    if not text.strip():
+        await update.message.reply_text("❌ The message is empty.")
+        return
+
+    broadcast_id = broadcasts.create(text, segment, user_id)
+    logger.info(f"Admin {user_id} queued broadcast {broadcast_id} to '{segment}'")
+    await update.message.reply_text(
+        f"📣 Broadcast #{broadcast_id} to {segment} queued. I'll report back when it's done."
+    )
+    # Start now rather than at the next scheduled pass
+    if context.job_queue is not None:
+        context.job_queue.run_once(coordination.leader_only("broadcasts")(broadcasts.run_broadcasts), 0)
+
+
+async def delivery_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin only: how many users were pruned from delivery as unreachable."""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ This command is only available to admins.")
+        return
+    report = database.get_delivery_report()
+    await update.message.reply_text(
+        "📬 Delivery report\n"
+        f"Users: {report['total_users']}\n"
+        f"Pruned (unreachable): {report['pruned']} "
+        f"({report['blocked']} blocked, {report['chat_not_found']} chat not found)\n"
+        f"Pruned in the last 7 days: {report['pruned_7d']}\n"
+        f"Came back after pruning: {report['revived']}\n"
+        f"Reachable with transient failures: {report['transient_failures']}"
+    )
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin only. /profile <target|all> [runs] [sample|cprofile], /profile off [target], /profile status."""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ This command is only available to admins.")
+        return
+
+    args = context.args
+    if not args or (args[0].lower() == "status" and len(args) == 1):
+        armed = profiling.profiler.status()
+        lines = [f"{target}: {runs} runs left ({mode})" for target, (runs, mode) in sorted(armed.items())]
+        await update.message.reply_text(
+            ("🔬 Profiling armed:\n" + "\n".join(lines) if lines else "🔬 Nothing is being profiled.") +
+            "\n\nUsage: /profile <target|all> [runs] [sample|cprofile]\n"
+            "Targets: fetch_prices, daily_alerts, broadcasts, cleanup or a command such as /add\n"
+            "/profile off [target] - stop profiling"
+        )
+        return
+
+    if args[0].lower() == "off" and len(args) <= 2:
+        count = profiling.profiler.disarm(args[1] if len(args) == 2 else None)
+        await update.message.reply_text(f"🔬 Profiling stopped for {count} target(s).")
+        return
+
+    target = args[0]
+    runs = profiling.DEFAULT_RUNS
+    mode = profiling.DEFAULT_MODE
+    for arg in args[1:3]:
+        if arg.isdigit():
+            runs = int(arg)
+        elif arg.lower() in profiling.MODES:
+            mode = arg.lower()
+        else:
+            await update.message.reply_text("❌ Usage: /profile <target|all> [runs] [sample|cprofile]")
+            return
+    profiling.profiler.arm(target, runs, mode)
+    runs = profiling.profiler.status()[target][0]
+    await update.message.reply_text(
+        f"🔬 Profiling the next {runs} runs of {target} ({mode}). Profiles are written to {profiling.PROFILE_DIR}/."
+    )
+
+
 async def donate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await rate_limit(update): return
     await update.message.reply_text(
@@ -253,24 +607,6 @@ async def remind_correct_setalarm(update: Update, context: ContextTypes.DEFAULT_
         )
 
 
-# --- Utils ---
-def parse_time_and_timezone(time_str):
-    """Parse formats like '9:30 AM EST' or '21:30 UTC'"""
-    time_str = time_str.replace(".", ":").upper()
-    match = re.search(r"(\d{1,2})(?::(\d{2}))?\s*(AM|PM)?\s*([A-Z]{2,4})?", time_str)
-    if not match:
-        return None, None, None
-    hour = int(match.group(1))
-    minute = int(match.group(2) or 0)
-    ampm = match.group(3)
-    tz = match.group(4)
-    if ampm == "PM" and hour != 12:
-        hour += 12
-    if ampm == "AM" and hour == 12:
-        hour = 0
-    return hour, minute, tz
-
-
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log the error and send a message to the developer."""
     logger.error("An error occurred during an update:", exc_info=context.error)
@@ -288,23 +624,3 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except telegram.error.TelegramError as e:
             logger.error(f"Failed to send error message to developer: {e}")
 
-
-# --- Main ---
-def main():
-    database.init_database()
-    app = Application.builder().token(BOT_TOKEN).build()
-
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, log_everything), group=0)
-    app.add_handler(CommandHandler("add", add_coin))
-    app.add_handler(CommandHandler("remove", remove_coin))
-    app.add_handler(CommandHandler("setalarm", set_alarm))
-    app.add_handler(CommandHandler("message", message_admin))
-    app.add_handler(CommandHandler("donate", donate))
-    app.add_handler(CommandHandler("list", list_coins))
-    app.add_handler(CommandHandler("help", start))
-    app.add_handler(MessageHandler(filters.Regex(r'^/set alarm'), remind_correct_setalarm))
-
-
-    logger.info("Bot running...")
-    app.run_polling()
-
@@ -0,0 +1,287 @@
+"""
+Admin broadcasts to every user or a segment of them.
+
+/broadcast stores the message in the broadcasts table and the leader's
+run_broadcasts job sends it. Recipients are paged in user_id order,
+BATCH_SIZE at a time, each page a short keyset query of its own so no
+replica snapshot stays open for the hour a large broadcast can take. Each
+batch is sent with up to
+CONCURRENCY requests in flight under a bot-wide SEND_RATE (Telegram
+allows about 30 messages a second). After every batch the last user_id
+and the counters are checkpointed, so a restart, or another replica
+taking over, resumes after the last finished batch instead of re-sending
+from the start. Users whose chat is unreachable are recorded through
+database.record_delivery_errors and left out of later broadcasts.
+"""
+import asyncio
+import logging
+import os
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+import database
+import delivery
+import timezones
+
+logger = logging.getLogger("CryptoBot.Broadcasts")
+
+SEND_RATE = float(os.getenv("BROADCAST_RATE", "28"))  # messages per second, just under Telegram's 30
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 3
+# The recipient list may come from a replica this far behind
+RECIPIENTS_MAX_STALENESS = 60
+
+
+def parse_segment(spec):
+    """Canonical segment for 'all', 'coin:<coin_id>' or 'tz:<zone>'; None if invalid."""
+    kind, _, value = spec.partition(':')
+    kind = kind.lower()
+    if kind == 'all' and not value:
+        return 'all'
+    if kind == 'coin' and value and database.is_valid_coin(value.lower()):
+        return f"coin:{value.lower()}"
+    if kind == 'tz':
+        zone = timezones.resolve(value)
+        return f"tz:{zone}" if zone else None
+    return None
+
+
+# Users whose chat is known to be unreachable are skipped
+_REACHABLE = "NOT EXISTS (SELECT 1 FROM user_delivery_status s WHERE s.user_id = r.user_id AND s.status <> 'ok')"
+
+
+def _recipients_query(segment, after_user_id):
+    kind, _, value = segment.partition(':')
+    if kind == 'coin':
+        return (
+            f"SELECT user_id FROM user_coins r WHERE coin_id = %s AND user_id > %s AND {_REACHABLE} ORDER BY user_id LIMIT %s;",
+            (value, after_user_id, BATCH_SIZE),
+        )
+    if kind == 'tz':
+        return (
+            f"SELECT user_id FROM users r WHERE timezone = %s AND user_id > %s AND {_REACHABLE} ORDER BY user_id LIMIT %s;",
+            (value, after_user_id, BATCH_SIZE),
+        )
+    return (
+        f"SELECT user_id FROM users r WHERE user_id > %s AND {_REACHABLE} ORDER BY user_id LIMIT %s;",
+        (after_user_id, BATCH_SIZE),
+    )
+
+
+# --- Storage ---
+def create(message, segment, created_by):
+    """Queues a broadcast. Returns its id."""
+    conn = database.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO broadcasts (message, segment, created_by) VALUES (%s, %s, %s) RETURNING broadcast_id;",
+                (message, segment, created_by)
+            )
+            broadcast_id = cur.fetchone()[0]
+        conn.commit()
+        return broadcast_id
+    finally:
+        conn.close()
+
+
+def get_recent(limit=5):
+    """[(broadcast_id, segment, status, sent, failed, blocked, created_at)], newest first."""
+    conn = database.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT broadcast_id, segment, status, sent, failed, blocked, created_at
+                FROM broadcasts ORDER BY broadcast_id DESC LIMIT %s;
+                """,
+                (limit,)
+            )
+            return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def cancel(broadcast_id=None):
+    """Cancels the given (or the oldest unfinished) broadcast. Returns its id, or None if none was open."""
+    conn = database.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcasts SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+                WHERE broadcast_id = (
+                    SELECT broadcast_id FROM broadcasts
+                    WHERE status IN ('pending', 'running') AND (%s IS NULL OR broadcast_id = %s)
+                    ORDER BY broadcast_id LIMIT 1
+                )
+                RETURNING broadcast_id;
+                """,
+                (broadcast_id, broadcast_id)
+            )
+            row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def _claim_next():
+    """Marks the oldest unfinished broadcast running and returns (id, message, segment, last_user_id, created_by)."""
+    conn = database.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcasts SET status = 'running'
+                WHERE broadcast_id = (
+                    SELECT broadcast_id FROM broadcasts WHERE status IN ('pending', 'running')
+                    ORDER BY broadcast_id LIMIT 1
+                )
+                RETURNING broadcast_id, message, segment, last_user_id, created_by;
+                """
+            )
+            row = cur.fetchone()
+        conn.commit()
+        return row
+    finally:
+        conn.close()
+
+
+def _checkpoint(broadcast_id, last_user_id, sent, failed, blocked, done=False):
+    """Records a finished batch. Returns the (sent, failed, blocked) totals, or None if it was cancelled meanwhile."""
+    conn = database.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcasts SET
+                    last_user_id = GREATEST(last_user_id, %s),
+                    sent = sent + %s, failed = failed + %s, blocked = blocked + %s,
+                    status = CASE WHEN %s THEN 'done' ELSE status END,
+                    finished_at = CASE WHEN %s THEN CURRENT_TIMESTAMP END
+                WHERE broadcast_id = %s AND status = 'running'
+                RETURNING sent, failed, blocked;
+                """,
+                (last_user_id, sent, failed, blocked, done, done, broadcast_id)
+            )
+            totals = cur.fetchone()
+        conn.commit()
+        return totals
+    finally:
+        conn.close()
+
+
+def _next_batch(segment, after_user_id):
+    """Up to BATCH_SIZE recipient user_ids after after_user_id, in order; empty once everyone is done."""
+    sql, params = _recipients_query(segment, after_user_id)
+    conn = database.get_read_connection(RECIPIENTS_MAX_STALENESS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        conn.commit()
+        return [user_id for (user_id,) in rows]
+    finally:
+        conn.close()
+
+
+# --- Sending ---
+class RateLimiter:
+    """Spaces sends at least 1/rate seconds apart across all tasks; pause() holds everyone back after a 429."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+async def _send(bot, limiter, semaphore, user_id, text):
+    """None once sent, else (kind, error) with kind from delivery.classify."""
+    async with semaphore:
+        for attempt in range(MAX_ATTEMPTS):
+            await limiter.wait()
+            try:
+                await bot.send_message(chat_id=user_id, text=text)
+                return None
+            except RetryAfter as e:
+                logger.warning(f"Flood control hit, pausing broadcast for {e.retry_after}s")
+                limiter.pause(e.retry_after)
+                error = e
+            except BadRequest as e:
+                return delivery.classify(e), str(e)
+            except NetworkError as e:
+                error = e
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                return delivery.classify(e), str(e)
+        return delivery.TRANSIENT, str(error)
+
+
+async def _run(bot, broadcast):
+    broadcast_id, message, segment, last_user_id, created_by = broadcast
+    logger.info(f"Running broadcast {broadcast_id} to '{segment}' from user_id {last_user_id}")
+    limiter = RateLimiter(SEND_RATE)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    while True:
+        user_ids = await asyncio.to_thread(_next_batch, segment, last_user_id)
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+        outcomes = await asyncio.gather(*(_send(bot, limiter, semaphore, user_id, message) for user_id in user_ids))
+        errors = [(user_id, *outcome) for user_id, outcome in zip(user_ids, outcomes) if outcome is not None]
+        await asyncio.to_thread(database.record_delivery_errors, errors)
+        blocked = sum(1 for _, kind, _ in errors if delivery.is_permanent(kind))
+        totals = await asyncio.to_thread(
+            _checkpoint, broadcast_id, last_user_id, len(user_ids) - len(errors), len(errors) - blocked, blocked
+        )
+        if totals is None:
+            logger.info(f"Broadcast {broadcast_id} was cancelled")
+            return
+
+    totals = await asyncio.to_thread(_checkpoint, broadcast_id, 0, 0, 0, 0, True)
+    if totals is None:
+        return
+    sent, failed, blocked = totals
+    logger.info(f"Broadcast {broadcast_id} finished: {sent} sent, {failed} failed, {blocked} blocked")
+    if created_by:
+        try:
+            await bot.send_message(
+                chat_id=created_by,
+                text=f"📣 Broadcast #{broadcast_id} finished: {sent} sent, {failed} failed, {blocked} unreachable (pruned)."
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not report broadcast {broadcast_id} to {created_by}: {e}")
+
+
+_running = False
+
+
+async def run_broadcasts(context):
+    """JobQueue callback: sends queued broadcasts one at a time, resuming any that were interrupted."""
+    global _running
+    if _running:
+        return
+    _running = True
+    try:
+        while True:
+            broadcast = await asyncio.to_thread(_claim_next)
+            if broadcast is None:
+                return
+            await _run(context.bot, broadcast)
+    except Exception as e:
+        # Left 'running'; the next run resumes from the checkpoint
+        logger.error(f"Broadcast run failed: {e}")
+    finally:
+        _running = False
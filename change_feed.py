@@ -0,0 +1,143 @@
+"""
+Cross-process change feed over Postgres LISTEN/NOTIFY.
+
+Writers in database.py and the price ingest queue compact JSON events with
+database.notify_change, inside the same transaction as the write, so an
+event is delivered exactly when its change commits:
+
+    {"k": "alarms", "u": user_id, "d": [[alarm_id, "HH:MM", timezone, weekdays], ...]}
+    {"k": "watch", "u": user_id, "c": coin_id, "op": "+" or "-"}
+    {"k": "prices", "o": origin, "d": [[coin_id, epoch, price], ...]}
+    {"k": "coins", "o": origin, "d": [[coin_id, symbol, name], ...]}
+
+Each process runs one listener thread that applies events to its alarm
+schedule, price store and watchlist cache. Those caches are trusted only
+while the listener is connected. On a reconnect, events may have been
+missed, so the caches are rebuilt from the database before they are
+trusted again.
+"""
+import json
+import logging
+import select
+import threading
+from datetime import datetime
+
+import analytics
+import database
+import price_store
+import watchlists
+from alarm_schedule import schedule as alarm_schedule
+
+logger = logging.getLogger("CryptoBot.ChangeFeed")
+
+# Seconds between liveness checks while the channel is quiet
+HEARTBEAT_INTERVAL = 30
+RECONNECT_DELAY = 5
+
+
+def apply_event(event):
+    """Applies one decoded change event to this process's caches."""
+    kind = event.get('k')
+    if kind == 'alarms':
+        alarm_schedule.set_user(event['u'], [
+            (alarm_id, datetime.strptime(alarm_time, '%H:%M').time(), tz_name, weekdays)
+            for alarm_id, alarm_time, tz_name, weekdays in event['d']
+        ])
+    elif kind == 'watch':
+        watchlists.cache.apply(event['u'], event['c'], event['op'] == '+')
+    elif kind == 'prices':
+        if event.get('o') == database.PROCESS_TAG:
+            return  # the ingest already appended these locally
+        price_store.store.apply_ticks(event['d'])
+        analytics.mark_stale()
+    elif kind == 'coins':
+        if event.get('o') == database.PROCESS_TAG:
+            return
+        price_store.store.update_coins({coin_id: {'symbol': symbol, 'name': name} for coin_id, symbol, name in event['d']})
+    else:
+        logger.warning(f"Ignoring unknown change event {kind!r}")
+
+
+class ChangeListener(threading.Thread):
+    def __init__(self):
+        super().__init__(name="change-feed", daemon=True)
+        self.ready = threading.Event()
+        self._stop_event = threading.Event()
+        self.connected = False
+        self.events = 0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _set_connected(self, connected):
+        self.connected = connected
+        alarm_schedule.sees_all_writes = connected
+        watchlists.cache.set_enabled(connected)
+
+    def _resync(self):
+        """Rebuilds what may have drifted while no events were arriving."""
+        alarm_schedule.load_from_db()
+        if price_store.store.warm:
+            price_store.store.catch_up_from_db()
+            analytics.mark_stale()
+
+    def run(self):
+        reconnecting = False
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = database.connect(keepalives=1, keepalives_idle=10, keepalives_interval=5, keepalives_count=3)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {database.CHANGE_CHANNEL};")
+                # LISTEN is in place before anything is re-read, so no change can slip between the two.
+                # The first connect is followed by main's own reconcile, so only reconnects resync here.
+                if reconnecting:
+                    self._resync()
+                self._set_connected(True)
+                self.ready.set()
+                logger.info(f"Listening for changes on {database.CHANGE_CHANNEL}")
+                self._listen(conn)
+            except Exception as e:
+                logger.error(f"Change feed connection lost: {e}")
+            finally:
+                if self.connected:
+                    self._set_connected(False)
+                if conn is not None:
+                    conn.close()
+            reconnecting = True
+            self._stop_event.wait(RECONNECT_DELAY)
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            if select.select([conn], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    apply_event(json.loads(notify.payload))
+                    self.events += 1
+                except Exception as e:
+                    logger.error(f"Failed to apply change event {notify.payload[:200]!r}: {e}")
+
+
+listener = None
+
+
+def start(timeout=10):
+    """Starts the listener thread and waits until LISTEN is in place (or timeout seconds pass)."""
+    global listener
+    if listener is None or not listener.is_alive():
+        listener = ChangeListener()
+        listener.start()
+    if not listener.ready.wait(timeout):
+        logger.warning("Change feed not connected yet; in-process caches stay bypassed until it is.")
+    return listener
+
+
+def stop():
+    if listener is not None:
+        listener.stop()
@@ -0,0 +1,83 @@
+"""
+Sparkline images for /chart, rendered from the in-memory price store.
+
+Renders are cached per (coin, price store version) in a small LRU. The
+store's version changes on every ingest, so a burst of requests for the
+same coin between two fetches costs one render and no database queries.
+"""
+import io
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import price_store
+
+logger = logging.getLogger("CryptoBot.Charts")
+
+CHART_CACHE_SIZE = 64
+FIGSIZE = (6, 2)
+DPI = 100
+
+
+def render_sparkline(times, prices, title=None):
+    """PNG bytes of a minimal line chart of prices over epoch-second times."""
+    # Figure without pyplot keeps rendering free of global state, so worker threads are safe
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGSIZE, dpi=DPI)
+    ax = fig.add_subplot()
+    color = '#10b981' if prices[-1] >= prices[0] else '#ef4444'
+    dates = [datetime.fromtimestamp(ts, timezone.utc) for ts in times]
+    ax.plot(dates, prices, color=color, linewidth=1.5)
+    ax.fill_between(dates, prices, min(prices), color=color, alpha=0.1)
+    ax.set_xlim(dates[0], dates[-1])
+    ax.margins(y=0.05)
+    for side in ('top', 'right'):
+        ax.spines[side].set_visible(False)
+    ax.tick_params(labelsize=8)
+    if title:
+        ax.set_title(title, fontsize=10, loc='left')
+    fig.autofmt_xdate()
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+class ChartCache:
+    """LRU of rendered PNGs keyed by (coin_id, store version)."""
+
+    def __init__(self, store, maxsize=CHART_CACHE_SIZE):
+        self.store = store
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        # Held while rendering, so concurrent requests for a coin wait for the first render
+        self._lock = threading.Lock()
+        self.renders = 0
+
+    def get(self, coin_id):
+        """PNG bytes for coin_id's stored history, or None if there are fewer than two ticks."""
+        key = (coin_id, self.store.version)
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                return png
+
+            times, prices = self.store.history(coin_id)
+            if len(prices) < 2:
+                return None
+            symbol = self.store.coins.get(coin_id, {}).get('symbol', coin_id).upper()
+            days = (times[-1] - times[0]) / 86400
+            png = render_sparkline(times, prices, f"{symbol} · {days:.0f}d" if days >= 1 else symbol)
+            self.renders += 1
+
+            self._cache[key] = png
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return png
+
+
+cache = ChartCache(price_store.store)
@@ -0,0 +1,90 @@
+"""
+Circuit breaker for calls to flaky upstream APIs.
+
+After `failure_threshold` consecutive failures the breaker opens and
+every call is refused locally until `cooldown` seconds have passed, so an
+outage costs no requests and no stacked timeouts. The first call after the
+cool-off is a single trial (half-open): success closes the breaker, failure
+re-opens it with the cool-off doubled up to `max_cooldown`.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger("CryptoBot.CircuitBreaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, cooldown=60, max_cooldown=900):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.last_success_at = None
+        self.last_error = None
+
+    def allow(self):
+        """True if a call may go out now. In half-open state only one trial call is let through."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                logger.info(f"{self.name}: cool-off over, sending a trial request")
+                return True
+            return False
+
+    def available(self):
+        """Like allow() but without claiming the half-open trial; for picking which upstream to call."""
+        with self._lock:
+            return self.state == CLOSED or (
+                self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown
+            )
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"{self.name}: recovered, closing circuit")
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.last_success_at = time.time()
+
+    def record_failure(self, error=None, retry_after=None):
+        """Counts a failed call; retry_after (seconds, e.g. from a 429) overrides the cool-off."""
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error else None
+            if self.state == HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.failures < self.failure_threshold and retry_after is None:
+                return
+            if retry_after is not None:
+                self.cooldown = min(max(retry_after, self.base_cooldown), self.max_cooldown)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            logger.warning(f"{self.name}: circuit open for {self.cooldown:.0f}s after {self.failures} failure(s): {error}")
+
+    def status(self):
+        """State summary for logs, /status and the dashboard."""
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+            return {
+                'name': self.name,
+                'state': self.state,
+                'failures': self.failures,
+                'retry_in': retry_in,
+                'last_success_at': self.last_success_at,
+                'last_error': self.last_error,
+            }
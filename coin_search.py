@@ -0,0 +1,140 @@
+"""
+Coin search for inline queries (@bot btc), answered entirely from memory.
+
+CoinIndex maps every prefix (up to MAX_PREFIX characters) of each coin's
+symbol, id, name and name words to a ranked list of coin ids, built from
+the price store's coin metadata. It is rebuilt only when that metadata
+changes, so a keystroke is one dict lookup. ResultCache holds finished
+answers per query for a few seconds, keyed by the price store version,
+so repeated keystrokes skip formatting too.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import price_store
+
+logger = logging.getLogger("CryptoBot.CoinSearch")
+
+MAX_PREFIX = 12
+MAX_RESULTS = 50  # Telegram's limit per inline answer
+RESULT_TTL = 10
+RESULT_CACHE_SIZE = 2048
+UNRANKED = 10 ** 6
+
+# Match quality, best first
+EXACT_SYMBOL, SYMBOL_PREFIX, EXACT_NAME, NAME_PREFIX, WORD_PREFIX = range(5)
+
+
+def normalize(query):
+    return query.strip().lower().lstrip('$')
+
+
+def _score(meta, coin_id, q):
+    """Best match quality of q against one coin, or None."""
+    symbol = (meta.get('symbol') or '').lower()
+    name = (meta.get('name') or '').lower()
+    if symbol == q:
+        return EXACT_SYMBOL
+    if symbol.startswith(q):
+        return SYMBOL_PREFIX
+    if q in (coin_id, name):
+        return EXACT_NAME
+    if coin_id.startswith(q) or name.startswith(q):
+        return NAME_PREFIX
+    if any(word.startswith(q) for word in name.replace('-', ' ').split()):
+        return WORD_PREFIX
+    return None
+
+
+def _tokens(meta, coin_id):
+    symbol = (meta.get('symbol') or '').lower()
+    name = (meta.get('name') or '').lower()
+    return {symbol, coin_id, name, *name.replace('-', ' ').split()} - {''}
+
+
+class CoinIndex:
+    """Prefix -> ranked coin ids over the price store's coin metadata."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.prefixes = {}
+        self.top = []  # every coin by market-cap rank, for an empty query
+        self.version = None
+
+    def refresh(self):
+        """Rebuilds the index if coin metadata changed since the last build."""
+        if self.version == self.store.coins_version:
+            return
+        with self._lock:
+            version = self.store.coins_version
+            if self.version == version:
+                return
+            started = time.perf_counter()
+            coins = dict(self.store.coins)
+            candidates = {}
+            for coin_id, meta in coins.items():
+                for token in _tokens(meta, coin_id):
+                    for length in range(1, min(len(token), MAX_PREFIX) + 1):
+                        candidates.setdefault(token[:length], set()).add(coin_id)
+
+            def rank(coin_id):
+                meta = coins[coin_id]
+                return meta.get('rank', UNRANKED), meta.get('symbol') or coin_id
+
+            prefixes = {}
+            for prefix, coin_ids in candidates.items():
+                scored = [(_score(coins[c], c, prefix), *rank(c), c) for c in coin_ids]
+                prefixes[prefix] = [c for *_, c in sorted(s for s in scored if s[0] is not None)]
+            self.prefixes = prefixes
+            self.top = sorted(coins, key=rank)
+            self.version = version
+        logger.info(f"Built coin search index: {len(coins)} coins, {len(prefixes)} prefixes "
+                    f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Coin ids matching query, best first."""
+        self.refresh()
+        q = normalize(query)
+        if not q:
+            return self.top[:limit]
+        matches = self.prefixes.get(q[:MAX_PREFIX], [])
+        if len(q) > MAX_PREFIX:
+            coins = self.store.coins
+            scored = [(_score(coins[c], c, q), i, c) for i, c in enumerate(matches) if c in coins]
+            matches = [c for *_, c in sorted(s for s in scored if s[0] is not None)]
+        return matches[:limit]
+
+
+class ResultCache:
+    """Short-lived LRU of finished answers keyed by (normalized query, price store version)."""
+
+    def __init__(self, ttl=RESULT_TTL, maxsize=RESULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+index = CoinIndex(price_store.store)
@@ -0,0 +1,120 @@
+"""
+Leader election for scheduled jobs across replicas.
+
+Every replica registers the same jobs, but each job body runs only in the
+replica holding that job's Postgres advisory lock. Locks are session-level
+and live on one dedicated connection per process, so they are released the
+moment the leader exits or its connection drops, and a standby takes over
+on its next tick. Server-side TCP keepalives bound how long a leader that
+vanished without closing its socket can keep a lock.
+
+Each job has its own lock, so different replicas can own different jobs.
+Replicas that lose an election skip the job and run its optional standby
+callback instead (for example, catching up on prices the leader stored).
+Bot commands are served by every replica regardless.
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+import database
+import profiling
+
+logger = logging.getLogger("CryptoBot.Coordination")
+
+# Set to "off" for a single instance that should always run every job
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "on").lower() not in ("off", "0", "false")
+
+# First key of the two-key advisory lock space; the second is hashtext(job name)
+LOCK_NAMESPACE = 0x43524A42
+
+# Dead-peer detection on the lock connection, in seconds
+KEEPALIVE_OPTIONS = "-c tcp_keepalives_idle=10 -c tcp_keepalives_interval=5 -c tcp_keepalives_count=3"
+
+
+class Coordinator:
+    """Tracks which job locks this process holds on its lock connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.held = set()
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect(
+                application_name="cryptobot-coordinator",
+                keepalives=1, keepalives_idle=10, keepalives_interval=5, keepalives_count=3,
+                options=KEEPALIVE_OPTIONS,
+            )
+            self._conn.autocommit = True
+        return self._conn
+
+    def _reset(self):
+        if self.held:
+            logger.warning(f"Lost the lock connection; giving up leadership of {', '.join(sorted(self.held))}")
+        self.held.clear()
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def acquire(self, job_name):
+        """True if this process leads job_name, trying to take the lock if nobody does."""
+        with self._lock:
+            try:
+                with self._connection().cursor() as cur:
+                    if job_name in self.held:
+                        # Session locks stack, so only confirm the session is still alive
+                        cur.execute("SELECT 1;")
+                        return True
+                    cur.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s));", (LOCK_NAMESPACE, job_name))
+                    if cur.fetchone()[0]:
+                        self.held.add(job_name)
+                        logger.info(f"Became leader for {job_name}")
+                        return True
+                    return False
+            except Exception as e:
+                logger.error(f"Leader check for {job_name} failed: {e}")
+                self._reset()
+                return False
+
+    def release_all(self):
+        """Hands every job to the other replicas straight away (used on shutdown)."""
+        with self._lock:
+            if self._conn is not None and not self._conn.closed:
+                try:
+                    with self._conn.cursor() as cur:
+                        cur.execute("SELECT pg_advisory_unlock_all();")
+                except Exception as e:
+                    logger.error(f"Failed to release job locks: {e}")
+            self._reset()
+
+    def is_leader(self, job_name):
+        return job_name in self.held
+
+
+coordinator = Coordinator()
+
+
+def leader_only(job_name, standby=None):
+    """Wraps a JobQueue callback so it only runs on the replica that leads job_name.
+
+    Queries either callback issues are attributed to job_name (see database.query_scope),
+    and the leader's runs can be profiled as job_name or func's name (see profiling).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(context):
+            with database.query_scope(job_name):
+                if not LEADER_ELECTION or await asyncio.to_thread(coordinator.acquire, job_name):
+                    with profiling.profiler.profile(job_name, func.__name__):
+                        return await func(context)
+                if standby is not None:
+                    return await standby(context)
+        return wrapper
+    return decorator
@@ -1,12 +1,16 @@
-from flask import Flask, render_template_string
+from flask import Flask, Response, render_template_string, request, stream_with_context
 import database
 from datetime import datetime, timedelta
-import sqlite3
 import os
 from dotenv import load_dotenv
 load_dotenv()  # add this at the very top
 
-DATABASE_PATH = os.getenv("DATABASE_PATH")
+# The page refreshes every 30s; counts a few minutes old are fine and keep this load off the primary
+DASHBOARD_MAX_STALENESS = 300
+
+# /export serves a bounded window: this many days when none is given, and never more than the cap
+EXPORT_DEFAULT_DAYS = 7
+EXPORT_MAX_DAYS = float(os.getenv("EXPORT_MAX_DAYS", "31"))
 
 app = Flask(__name__)
 
@@ -361,21 +365,21 @@ def get_dashboard_data():
     """Get all dashboard data"""
     try:
         # Basic stats
-        stats = database.get_admin_stats()
+        stats = database.get_admin_stats(max_staleness=DASHBOARD_MAX_STALENESS)
         
         # Popular coins with proper formatting
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = database.get_read_connection(max_staleness=DASHBOARD_MAX_STALENESS)
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT 
                 uc.coin_id,
-                COALESCE(ci.symbol, UPPER(uc.coin_id)) as symbol,
-                COALESCE(ci.name, uc.coin_id) as name,
-                COUNT(uc.telegram_id) as user_count
+                COALESCE(cm.symbol, UPPER(uc.coin_id)) as symbol,
+                COALESCE(cm.name, uc.coin_id) as name,
+                COUNT(uc.user_id) as user_count
             FROM user_coins uc
-            LEFT JOIN coin_info ci ON uc.coin_id = ci.coin_id
-            GROUP BY uc.coin_id
+            LEFT JOIN coin_mapping cm ON uc.coin_id = cm.coin_id
+            GROUP BY uc.coin_id, cm.symbol, cm.name
             ORDER BY user_count DESC
             LIMIT 15
         ''')
@@ -391,17 +395,17 @@ def get_dashboard_data():
         
         # Recent signups
         cursor.execute('''
-            SELECT DATE(created_at) as signup_date, COUNT(*) as signups
+            SELECT created_at::DATE as signup_date, COUNT(*) as signups
             FROM users 
-            WHERE created_at >= datetime('now', '-7 days')
-            GROUP BY DATE(created_at)
+            WHERE created_at >= NOW() - INTERVAL '7 days'
+            GROUP BY signup_date
             ORDER BY signup_date DESC
         ''')
         
         recent_signups = []
         for row in cursor.fetchall():
             recent_signups.append({
-                'date': row[0],
+                'date': row[0].isoformat(),
                 'count': row[1]
             })
         
@@ -417,11 +421,11 @@ def get_dashboard_data():
                 END as range_group,
                 COUNT(*) as user_count
             FROM (
-                SELECT u.telegram_id, COUNT(uc.coin_id) as coin_count
+                SELECT u.user_id, COUNT(uc.coin_id) as coin_count
                 FROM users u
-                LEFT JOIN user_coins uc ON u.telegram_id = uc.telegram_id
-                GROUP BY u.telegram_id
-            )
+                LEFT JOIN user_coins uc ON u.user_id = uc.user_id
+                GROUP BY u.user_id
+            ) per_user
             GROUP BY range_group
         ''')
         
@@ -432,17 +436,16 @@ def get_dashboard_data():
                 'count': row[1]
             })
         
-        # Alerts sent today
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('SELECT COUNT(DISTINCT telegram_id) FROM alerts_sent WHERE date_sent = ?', (today,))
+        # Alerts sent today (one ledger row per alarm and local date)
+        cursor.execute('SELECT COUNT(*) FROM alert_deliveries WHERE local_date = CURRENT_DATE')
         alerts_sent_today = cursor.fetchone()[0]
         
-        # Active alarms (users with alarm_time set)
-        cursor.execute('SELECT COUNT(*) FROM users WHERE alarm_time IS NOT NULL AND alarm_time != ""')
+        # Active alarms (a user may have several)
+        cursor.execute('SELECT COUNT(*) FROM user_alarms')
         active_alarms = cursor.fetchone()[0]
         
         # User messages
-        cursor.execute('SELECT telegram_id, message, timestamp, status FROM user_messages ORDER BY timestamp DESC LIMIT 20')
+        cursor.execute('SELECT user_id, message, timestamp, status FROM admin_messages ORDER BY timestamp DESC LIMIT 20')
         user_messages = []
         for row in cursor.fetchall():
             user_messages.append({
@@ -453,7 +456,7 @@ def get_dashboard_data():
             })
         
         # Count unread messages
-        cursor.execute('SELECT COUNT(*) FROM user_messages WHERE status = "unread"')
+        cursor.execute("SELECT COUNT(*) FROM admin_messages WHERE status = 'unread'")
         unread_count = cursor.fetchone()[0]
         
         conn.close()
@@ -499,6 +502,60 @@ def dashboard():
     data = get_dashboard_data()
     return render_template_string(DASHBOARD_HTML, **data)
 
+@app.route('/api/indicators')
+def indicators():
+    """Per-coin dip, returns, volatility, drawdown and MA signals from the shared analytics snapshot"""
+    import analytics
+
+    snapshot = analytics.get_snapshot()
+    if snapshot.empty:
+        coins = []
+    else:
+        # NaN (e.g. no 7d return for a coin listed yesterday) isn't valid JSON
+        rows = snapshot.reset_index(names='coin_id')
+        coins = rows.astype(object).where(rows.notna(), None).to_dict(orient='records')
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'coins': coins
+    }
+
+@app.route('/export')
+def export_prices():
+    """Streams price history: ?format=csv|ndjson|parquet&coins=a,b&start=...&end=...&days=N
+
+    The window defaults to the last EXPORT_DEFAULT_DAYS and may span at most EXPORT_MAX_DAYS.
+    """
+    import export
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return {'error': f"format must be one of {', '.join(export.FORMATS)}"}, 400
+    coins = request.args.get('coins')
+    coin_ids = coins.split(',') if coins else None
+    try:
+        start = export.parse_time(request.args.get('start'))
+        end = export.parse_time(request.args.get('end')) or datetime.utcnow()
+        if request.args.get('days'):
+            days = float(request.args['days'])
+            if not 0 < days <= EXPORT_MAX_DAYS:
+                return {'error': f"days must be greater than 0 and at most {EXPORT_MAX_DAYS:g}"}, 400
+            start = datetime.utcnow() - timedelta(days=days)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if start is None:
+        start = end - timedelta(days=EXPORT_DEFAULT_DAYS)
+    if start >= end:
+        return {'error': "start must be before end"}, 400
+    if end - start > timedelta(days=EXPORT_MAX_DAYS):
+        return {'error': f"the window may span at most {EXPORT_MAX_DAYS:g} days"}, 400
+
+    filename = f"coin_prices_{datetime.utcnow():%Y%m%d_%H%M%S}.{fmt}"
+    return Response(
+        stream_with_context(export.stream(fmt, coin_ids, start, end)),
+        mimetype=export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
 @app.route('/health')
 def health_check():
     """Simple health check endpoint"""
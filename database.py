@@ -1,83 +1,309 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import os
+import contextlib
+import contextvars
+import functools
+import json
 import logging
+import re
+import threading
+import time as time_module
 from urllib.parse import urlparse
 import sys
 from datetime import datetime, time, timezone
 
+import delivery
+import timezones
+
 logger = logging.getLogger("CryptoBot.Database")
 
+# New users get an 8 PM UTC alarm until they choose their own
+DEFAULT_ALARM_TIME = time(20, 0)
+DEFAULT_TIMEZONE = 'UTC'
+
+# coin_prices rows older than this are deleted by the daily cleanup
+PRICE_RETENTION_DAYS = int(os.getenv("PRICE_RETENTION_DAYS", "7"))
+
+# Optional streaming replica for read-only work; see get_read_connection
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+# Replica lag (seconds) a read tolerates unless the caller says otherwise
+DEFAULT_MAX_STALENESS = float(os.getenv("READ_MAX_STALENESS", "30"))
+# Lag is measured at most this often; a replica that refused a connection is skipped for REPLICA_RETRY_AFTER
+REPLICA_LAG_CHECK_INTERVAL = 5
+REPLICA_RETRY_AFTER = 30
+
+_replica_state = {'lag': None, 'checked_at': 0.0, 'down_until': 0.0}
+
+# LISTEN/NOTIFY channel for change_feed; payloads must stay under Postgres's 8000-byte limit
+CHANGE_CHANNEL = "cryptobot_changes"
+MAX_NOTIFY_BYTES = 7500
+# Lets a listener skip the price payloads its own process published
+PROCESS_TAG = f"{os.getpid()}@{os.uname().nodename}"
+
+# --- Query instrumentation ---
+# Every cursor handed out by connect() times its statements and attributes them to the
+# current unit of work (a bot command or job, see query_scope). Set to "off" to disable.
+QUERY_INSTRUMENTATION = os.getenv("QUERY_INSTRUMENTATION", "on").lower() not in ("off", "0", "false")
+# Statements slower than this are logged with their scope
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+# The same statement this many times in one unit of work is flagged as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+# Only the head of a statement is fingerprinted; execute_values can inline megabytes of rows
+FINGERPRINT_CHARS = 2000
+
+_current_scope = contextvars.ContextVar("query_scope", default=None)
+# (scope name, fingerprint) pairs already reported as N+1, so a job that runs every few minutes warns once
+_flagged_repeats = set()
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_VALUE_LISTS = re.compile(r"\([^()]*\)(?:\s*,\s*\([^()]*\))+")
+
+
+def _normalize(text):
+    text = _LITERALS.sub("?", text[:FINGERPRINT_CHARS])
+    return " ".join(_VALUE_LISTS.sub("(...)", text).split())
+
+
+@functools.lru_cache(maxsize=2048)
+def _normalize_template(text):
+    return _normalize(text)
+
+
+def fingerprint(query):
+    """Statement text with literals and value lists replaced, so repeats of one query compare equal."""
+    if isinstance(query, bytes):
+        # Already interpolated (execute_values, mogrify): unique every time, so not worth caching
+        return _normalize(query[:FINGERPRINT_CHARS].decode(errors="replace"))
+    if not isinstance(query, str):
+        query = str(query)
+    return _normalize_template(query)
+
+
+class QueryScope:
+    """Statements, time and rows for one unit of work, per fingerprint."""
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.count = 0
+        self.duration_ms = 0.0
+        self.rows = 0
+        self.by_fingerprint = {}  # fingerprint -> [count, duration_ms]
+        self._lock = threading.Lock()  # statements may arrive from several to_thread workers
+
+    def record(self, fp, count, duration_ms, rows):
+        with self._lock:
+            self.count += count
+            self.duration_ms += duration_ms
+            self.rows += rows
+            entry = self.by_fingerprint.setdefault(fp, [0, 0.0])
+            entry[0] += count
+            entry[1] += duration_ms
+
+    def repeats(self, threshold=None):
+        """[(fingerprint, count)] of statements issued at least threshold times, most repeated first."""
+        threshold = threshold or N_PLUS_ONE_THRESHOLD
+        with self._lock:
+            items = [(fp, count) for fp, (count, _) in self.by_fingerprint.items() if count >= threshold]
+        return sorted(items, key=lambda item: -item[1])
+
+    def merge_into_parent(self):
+        if self.parent is None:
+            return
+        with self._lock:
+            items = list(self.by_fingerprint.items())
+        for fp, (count, duration_ms) in items:
+            self.parent.record(fp, count, duration_ms, 0)
+        with self.parent._lock:
+            self.parent.rows += self.rows
+
+
+def _record(query, count, started, rows):
+    duration_ms = (time_module.perf_counter() - started) * 1000
+    scope = _current_scope.get()
+    if scope is None and duration_ms < SLOW_QUERY_MS:
+        return
+    fp = fingerprint(query)
+    if scope is not None:
+        scope.record(fp, count, duration_ms, rows)
+    if duration_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            f"Slow query ({duration_ms:.0f}ms, {rows} rows) in {scope.name if scope else 'no scope'}: {fp[:300]}"
+        )
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that times every statement and reports it to the current QueryScope."""
+
+    def execute(self, query, vars=None):
+        started = time_module.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record(query, 1, started, max(self.rowcount, 0))
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        started = time_module.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record(query, len(vars_list), started, max(self.rowcount, 0))
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time_module.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _record(sql, 1, started, max(self.rowcount, 0))
+
+
+@contextlib.contextmanager
+def query_scope(name):
+    """Attributes the statements issued inside the block (including asyncio.to_thread calls) to name."""
+    scope = QueryScope(name, _current_scope.get())
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        for fp, count in scope.repeats():
+            if (name, fp) not in _flagged_repeats:
+                _flagged_repeats.add((name, fp))
+                logger.warning(f"Possible N+1 in {name}: {count}x {fp[:300]}")
+        logger.debug(f"{name}: {scope.count} queries, {scope.duration_ms:.1f}ms, {scope.rows} rows")
+        scope.merge_into_parent()
+
+
+def scoped(name):
+    """Decorator running an async handler or job inside query_scope(name)."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with query_scope(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextlib.contextmanager
+def query_budget(max_queries, name="query budget"):
+    """Fails with QueryBudgetExceeded if the block issues more than max_queries statements.
+
+        with database.query_budget(2, "/add"):
+            await bot.add_coin(update, context)
+    """
+    with query_scope(name) as scope:
+        yield scope
+    if scope.count > max_queries:
+        statements = "; ".join(f"{count}x {fp[:120]}" for fp, count in scope.repeats(1))
+        raise QueryBudgetExceeded(f"{name} issued {scope.count} queries, budget {max_queries}: {statements}")
+
+
+def connect(dsn=None, **options):
+    """Opens a connection to dsn (default DATABASE_URL); extra options go to psycopg2.connect. Raises on failure."""
+    url = urlparse(dsn or os.getenv("DATABASE_URL"))
+    if QUERY_INSTRUMENTATION:
+        options.setdefault("cursor_factory", InstrumentedCursor)
+    return psycopg2.connect(
+        dbname=url.path[1:],
+        user=url.username,
+        password=url.password,
+        host=url.hostname,
+        port=url.port,
+        sslmode=os.getenv("DATABASE_SSLMODE", "require"),
+        **options
+    )
+
 def get_db_connection():
     try:
-        url = urlparse(os.getenv("DATABASE_URL"))
-        conn = psycopg2.connect(
-            dbname=url.path[1:],
-            user=url.username,
-            password=url.password,
-            host=url.hostname,
-            port=url.port,
-            sslmode='require'
-        )
-        return conn
+        return connect()
     except Exception as e:
         logger.error(f"Database connection failed: {e}")
         sys.exit(1)
 
-def init_database():
-    """Initializes the tables if they don't exist."""
-    conn = get_db_connection()
+def _replica_lag(conn):
+    """Seconds the replica is behind the primary (0 when fully caught up or not a replica)."""
+    now = time_module.monotonic()
+    if _replica_state['lag'] is not None and now - _replica_state['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_state['lag']
     with conn.cursor() as cur:
-        # Recreate users table without the extra columns
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                timezone TEXT,
-                alarm_time TIME,
-                last_alert_sent_at DATE
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS user_coins (
-                user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
-                coin_id TEXT,
-                PRIMARY KEY (user_id, coin_id)
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS coin_prices (
-                coin_id TEXT,
-                price FLOAT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (coin_id, timestamp)
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS admin_messages (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                message TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS coin_mapping (
-                coin_id TEXT PRIMARY KEY,
-                name TEXT,
-                symbol TEXT
-            );
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS sent_alerts (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                alert_key TEXT UNIQUE,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-    conn.commit()
-    conn.close()
-    logger.info("Database tables initialized successfully.")
+        # An idle primary sends no new transactions, so a streaming replica that has replayed
+        # everything it received is current however old its last replayed commit is
+        cur.execute(
+            """
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+                     AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END;
+            """
+        )
+        lag = float(cur.fetchone()[0])
+    conn.rollback()
+    _replica_state['lag'], _replica_state['checked_at'] = lag, now
+    return lag
+
+def get_read_connection(max_staleness=None):
+    """Read-only connection for queries that tolerate `max_staleness` seconds of replica lag.
+
+    Uses DATABASE_READ_URL when it is set, reachable and fresh enough; otherwise the primary.
+    A max_staleness of 0 always reads the primary.
+    """
+    max_staleness = DEFAULT_MAX_STALENESS if max_staleness is None else max_staleness
+    if DATABASE_READ_URL and max_staleness > 0 and time_module.monotonic() >= _replica_state['down_until']:
+        try:
+            conn = connect(DATABASE_READ_URL, connect_timeout=3)
+        except Exception as e:
+            logger.warning(f"Read replica unavailable, reading from the primary: {e}")
+            _replica_state['down_until'] = time_module.monotonic() + REPLICA_RETRY_AFTER
+        else:
+            try:
+                lag = _replica_lag(conn)
+            except Exception as e:
+                logger.warning(f"Could not measure replica lag, reading from the primary: {e}")
+                lag = float('inf')
+            if lag <= max_staleness:
+                conn.set_session(readonly=True)
+                return conn
+            conn.close()
+            logger.info(f"Replica is {lag:.1f}s behind (limit {max_staleness:g}s), reading from the primary")
+
+    conn = get_db_connection()
+    conn.set_session(readonly=True)
+    return conn
+
+def notify_change(cur, kind, **fields):
+    """Queues a change-feed event on cur's transaction; Postgres delivers it on commit."""
+    payload = json.dumps({'k': kind, **fields}, separators=(',', ':'), default=str)
+    cur.execute("SELECT pg_notify(%s, %s);", (CHANGE_CHANNEL, payload))
+
+def notify_rows(cur, kind, rows):
+    """Publishes rows as one or more events, each small enough for a NOTIFY payload."""
+    chunk, size = [], 0
+    for row in rows:
+        encoded = len(json.dumps(row, separators=(',', ':'), default=str)) + 1
+        if chunk and size + encoded > MAX_NOTIFY_BYTES:
+            notify_change(cur, kind, o=PROCESS_TAG, d=chunk)
+            chunk, size = [], 0
+        chunk.append(row)
+        size += encoded
+    if chunk:
+        notify_change(cur, kind, o=PROCESS_TAG, d=chunk)
+
+def init_database():
+    """Brings the schema up to date. A single version check when nothing is pending."""
+    import migrations
+
+    version = migrations.migrate()
+    logger.info(f"Database schema at version {version}.")
 
 def user_exists(user_id):
     """Checks if a user exists in the database."""
@@ -88,21 +314,56 @@ def user_exists(user_id):
     conn.close()
     return result is not None
 
+def _user_alarm_rows(cur, user_id):
+    cur.execute(
+        """
+        SELECT alarm_id, alarm_time, timezone, weekdays, next_fire_utc FROM user_alarms
+        WHERE user_id = %s ORDER BY alarm_time, alarm_id;
+        """,
+        (user_id,)
+    )
+    return cur.fetchall()
+
+def _publish_alarms(cur, user_id):
+    """Announces the user's full alarm list after a change; returns it."""
+    rows = _user_alarm_rows(cur, user_id)
+    # Paused alarms (next_fire_utc NULL) are left out of every schedule
+    notify_change(cur, 'alarms', u=user_id, d=[
+        [alarm_id, alarm_time.strftime('%H:%M'), tz_name, weekdays]
+        for alarm_id, alarm_time, tz_name, weekdays, next_fire in rows if next_fire is not None
+    ])
+    return rows
+
+def _insert_alarm(cur, user_id, alarm_time, tz_name, weekdays):
+    next_fire = timezones.next_fire(alarm_time, tz_name, weekdays, datetime.now(timezone.utc))
+    cur.execute(
+        """
+        INSERT INTO user_alarms (user_id, alarm_time, timezone, weekdays, next_fire_utc)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, alarm_time, timezone)
+        DO UPDATE SET weekdays = EXCLUDED.weekdays, next_fire_utc = EXCLUDED.next_fire_utc;
+        """,
+        (user_id, alarm_time, tz_name, weekdays, next_fire)
+    )
+
+def _ensure_user(cur, user_id):
+    """Creates the user with the default alarm if they are new. Returns True if created."""
+    cur.execute(
+        "INSERT INTO users (user_id, timezone) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING;",
+        (user_id, DEFAULT_TIMEZONE)
+    )
+    if not cur.rowcount:
+        return False
+    _insert_alarm(cur, user_id, DEFAULT_ALARM_TIME, DEFAULT_TIMEZONE, timezones.EVERY_DAY)
+    _publish_alarms(cur, user_id)
+    return True
+
 def add_user_with_default_alarm(user_id):
     """Adds a new user to the database and sets a default 8 PM UTC alarm."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            default_time = time(20, 0)
-            default_timezone = 'UTC'
-            cur.execute(
-                """
-                INSERT INTO users (user_id, alarm_time, timezone) 
-                VALUES (%s, %s, %s) 
-                ON CONFLICT (user_id) DO NOTHING;
-                """,
-                (user_id, default_time, default_timezone)
-            )
+            _ensure_user(cur, user_id)
         conn.commit()
     except Exception as e:
         logger.error(f"Failed to add user {user_id} with default alarm: {e}")
@@ -110,81 +371,142 @@ def add_user_with_default_alarm(user_id):
     finally:
         conn.close()
 
-def set_user_alarm(user_id, alarm_time, timezone):
-    """Sets a user's daily alarm time and timezone."""
+def set_user_alarm(user_id, alarm_time, timezone_name, weekdays=timezones.EVERY_DAY):
+    """Replaces all of a user's alarms with one. Returns the user's alarm rows, or None on failure."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE users SET alarm_time = %s, timezone = %s, last_alert_sent_at = NULL WHERE user_id = %s;",
-                (alarm_time, timezone, user_id)
-            )
+            _ensure_user(cur, user_id)
+            cur.execute("UPDATE users SET timezone = %s WHERE user_id = %s;", (timezone_name, user_id))
+            cur.execute("DELETE FROM user_alarms WHERE user_id = %s;", (user_id,))
+            # A new alarm may fire again today even if an earlier one already did
+            _insert_alarm(cur, user_id, alarm_time, timezone_name, weekdays)
+            rows = _publish_alarms(cur, user_id)
         conn.commit()
-        return True
+        return rows
     except Exception as e:
         logger.error(f"Failed to set alarm for user {user_id}: {e}")
         conn.rollback()
-        return False
+        return None
     finally:
         conn.close()
 
-def mark_alert_sent_for_alarm(user_id, alert_key):
-    """Marks a specific user alert as sent with a full timestamp."""
+def add_user_alarm(user_id, alarm_time, timezone_name, weekdays=timezones.EVERY_DAY, limit=None):
+    """Adds (or reschedules) one alarm. Returns the user's alarm rows, False over `limit`, None on failure."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE users SET last_alert_sent_at = NOW() WHERE user_id = %s;",
-                (user_id,)
-            )
+            _ensure_user(cur, user_id)
+            # Serialises concurrent adds for the user so the limit holds
+            cur.execute("SELECT timezone FROM users WHERE user_id = %s FOR UPDATE;", (user_id,))
+            existing = _user_alarm_rows(cur, user_id)
+            replacing = any(t == alarm_time and z == timezone_name for _, t, z, _, _ in existing)
+            if limit is not None and not replacing and len(existing) >= limit:
+                conn.rollback()
+                return False
+            cur.execute("UPDATE users SET timezone = %s WHERE user_id = %s;", (timezone_name, user_id))
+            _insert_alarm(cur, user_id, alarm_time, timezone_name, weekdays)
+            rows = _publish_alarms(cur, user_id)
         conn.commit()
+        return rows
     except Exception as e:
-        logger.error(f"Failed to mark alert as sent for user {user_id}: {e}")
+        logger.error(f"Failed to add alarm for user {user_id}: {e}")
         conn.rollback()
+        return None
     finally:
         conn.close()
 
-def get_user_alarm(user_id):
-    """Returns the alarm time and timezone for a user."""
+def remove_user_alarm(user_id, alarm_id):
+    """Deletes one of the user's alarms. Returns the remaining alarm rows, or None if it wasn't theirs."""
     conn = get_db_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT alarm_time, timezone FROM users WHERE user_id = %s;", (user_id,))
-        result = cur.fetchone()
-    conn.close()
-    return result
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM user_alarms WHERE user_id = %s AND alarm_id = %s;", (user_id, alarm_id))
+            if not cur.rowcount:
+                conn.rollback()
+                return None
+            rows = _publish_alarms(cur, user_id)
+        conn.commit()
+        return rows
+    except Exception as e:
+        logger.error(f"Failed to remove alarm {alarm_id} for user {user_id}: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
 
-def get_users_needing_alerts():
+def get_user_alarms(user_id):
+    """[(alarm_id, alarm_time, timezone, weekdays, next_fire_utc)] for a user, earliest time first."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            return _user_alarm_rows(cur, user_id)
+    finally:
+        conn.close()
+
+def get_user_timezone(user_id):
+    """The zone the user last set an alarm in (default for new alarms), or None for unknown users."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT timezone FROM users WHERE user_id = %s;", (user_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
+    finally:
+        conn.close()
+
+def get_due_alarms(lookahead):
     """
-    Returns a list of tuples (user_id, alarm_time, timezone)
-    for users whose alarm time is within the next 5 minutes.
+    Returns [(alarm_id, user_id, alarm_time, timezone, weekdays, next_fire_utc)] for
+    alarms firing within `lookahead` (a timedelta) or overdue, earliest first.
+
+    Sent alarms are moved to their next occurrence by mark_alarms_fired, so this
+    is one range scan on user_alarms_next_fire_idx whose size is the number of
+    alarms due, however many users or zones there are. Alarms of users whose chat
+    is unreachable are paused (NULL) and never match.
     """
     conn = get_db_connection()
-    user_data = []
+    alarms = []
     try:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT user_id, alarm_time, timezone
-                FROM users
-                WHERE
-                    alarm_time IS NOT NULL AND
-                    (
-                        -- Check if alarm timestamp is in the future but within 5 minutes
-                        (
-                            ((NOW() AT TIME ZONE timezone)::DATE + alarm_time) > (NOW() AT TIME ZONE timezone) AND
-                            ((NOW() AT TIME ZONE timezone)::DATE + alarm_time) <= ((NOW() AT TIME ZONE timezone) + INTERVAL '5 minutes')
-                        )
-                    )
-                    AND
-                    (last_alert_sent_at IS NULL OR (last_alert_sent_at AT TIME ZONE timezone)::DATE < (NOW() AT TIME ZONE timezone)::DATE)
-            """)
-            user_data = cur.fetchall()
-            logger.info(f"Found {len(user_data)} users needing alerts.")
+            cur.execute(
+                """
+                SELECT alarm_id, user_id, alarm_time, timezone, weekdays, next_fire_utc
+                FROM user_alarms
+                WHERE next_fire_utc <= NOW() + %s
+                ORDER BY next_fire_utc;
+                """,
+                (lookahead,)
+            )
+            alarms = cur.fetchall()
+            logger.info(f"Found {len(alarms)} alarms due.")
     except Exception as e:
-        logger.error(f"Failed to get users needing alerts: {e}")
+        logger.error(f"Failed to get due alarms: {e}")
     finally:
-        if conn:
-            conn.close()
-    return user_data
+        conn.close()
+    return alarms
+
+def add_coin_for_user(user_id, coin_id):
+    """Adds a coin to a user's watchlist. Returns False if it was already there."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            _ensure_user(cur, user_id)
+            cur.execute(
+                "INSERT INTO user_coins (user_id, coin_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+                (user_id, coin_id)
+            )
+            added = cur.rowcount > 0
+            if added:
+                notify_change(cur, 'watch', u=user_id, c=coin_id, op='+')
+        conn.commit()
+        return added
+    except Exception as e:
+        logger.error(f"Failed to add coin {coin_id} for user {user_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
 
 def remove_coin_for_user(user_id, coin_id):
     """Removes a coin from a user's watchlist."""
@@ -192,8 +514,11 @@ def remove_coin_for_user(user_id, coin_id):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM user_coins WHERE user_id = %s AND coin_id = %s;", (user_id, coin_id))
+            removed = cur.rowcount > 0
+            if removed:
+                notify_change(cur, 'watch', u=user_id, c=coin_id, op='-')
         conn.commit()
-        return cur.rowcount > 0
+        return removed
     except Exception as e:
         logger.error(f"Failed to remove coin {coin_id} for user {user_id}: {e}")
         conn.rollback()
@@ -201,6 +526,117 @@ def remove_coin_for_user(user_id, coin_id):
     finally:
         conn.close()
         
+def record_delivery_errors(rows):
+    """
+    Records failed sends, rows being (user_id, kind, error) with kind from delivery.classify.
+
+    Users whose chat is permanently unreachable are marked pruned and their
+    alarms paused, so due-alarm queries and broadcasts stop reaching them.
+    Transient failures are only counted.
+    """
+    if not rows:
+        return
+    latest = {user_id: (kind, error) for user_id, kind, error in rows}
+    pruned = [user_id for user_id, (kind, _) in latest.items() if delivery.is_permanent(kind)]
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                """
+                INSERT INTO user_delivery_status AS s (user_id, status, failures, last_error, last_error_at, pruned_at)
+                SELECT v.user_id, v.status, 1, v.error, CURRENT_TIMESTAMP,
+                       CASE WHEN v.status <> 'ok' THEN CURRENT_TIMESTAMP END
+                FROM (VALUES %s) AS v (user_id, status, error)
+                -- A user deleted meanwhile has nothing left to prune
+                WHERE EXISTS (SELECT 1 FROM users u WHERE u.user_id = v.user_id)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    status = CASE WHEN EXCLUDED.status = 'ok' THEN s.status ELSE EXCLUDED.status END,
+                    failures = s.failures + 1,
+                    last_error = EXCLUDED.last_error,
+                    last_error_at = EXCLUDED.last_error_at,
+                    pruned_at = COALESCE(EXCLUDED.pruned_at, s.pruned_at);
+                """,
+                [(user_id, kind if delivery.is_permanent(kind) else 'ok', error[:500])
+                 for user_id, (kind, error) in latest.items()],
+                template="(%s::BIGINT, %s, %s)"
+            )
+            if pruned:
+                cur.execute(
+                    "UPDATE user_alarms SET next_fire_utc = NULL WHERE user_id = ANY(%s) AND next_fire_utc IS NOT NULL;",
+                    (pruned,)
+                )
+                for user_id in pruned:
+                    notify_change(cur, 'alarms', u=user_id, d=[])
+        conn.commit()
+        if pruned:
+            logger.info(f"Pruned {len(pruned)} unreachable users from alert delivery.")
+    except Exception as e:
+        logger.error(f"Failed to record {len(rows)} delivery errors: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def revive_user(user_id):
+    """Resumes a pruned user's alarms once they talk to the bot again. Returns True if they were pruned."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE user_delivery_status SET status = 'ok', failures = 0 WHERE user_id = %s AND status <> 'ok' RETURNING 1;",
+                (user_id,)
+            )
+            if cur.fetchone() is None:
+                conn.rollback()
+                return False
+            now = datetime.now(timezone.utc)
+            for alarm_id, alarm_time, tz_name, weekdays, next_fire in _user_alarm_rows(cur, user_id):
+                if next_fire is None:
+                    cur.execute(
+                        "UPDATE user_alarms SET next_fire_utc = %s WHERE alarm_id = %s;",
+                        (timezones.next_fire(alarm_time, tz_name, weekdays, now), alarm_id)
+                    )
+            _publish_alarms(cur, user_id)
+        conn.commit()
+        logger.info(f"User {user_id} is reachable again; alarms resumed.")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to revive user {user_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def get_delivery_report(max_staleness=None):
+    """Counts of pruned (unreachable), revived and transiently failing users for the admin report."""
+    conn = get_read_connection(max_staleness)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM users),
+                    COUNT(*) FILTER (WHERE status = 'blocked'),
+                    COUNT(*) FILTER (WHERE status = 'chat_not_found'),
+                    COUNT(*) FILTER (WHERE status <> 'ok' AND pruned_at >= NOW() - INTERVAL '7 days'),
+                    COUNT(*) FILTER (WHERE status = 'ok' AND pruned_at IS NOT NULL),
+                    COUNT(*) FILTER (WHERE status = 'ok' AND failures > 0)
+                FROM user_delivery_status;
+                """
+            )
+            total, blocked, not_found, pruned_7d, revived, transient = cur.fetchone()
+    finally:
+        conn.close()
+    return {
+        'total_users': total,
+        'blocked': blocked,
+        'chat_not_found': not_found,
+        'pruned': blocked + not_found,
+        'pruned_7d': pruned_7d,
+        'revived': revived,
+        'transient_failures': transient,
+    }
+
 def get_user_coins(user_id):
     """Returns a list of coin IDs for a given user."""
     conn = get_db_connection()
@@ -265,46 +701,108 @@ def store_price_data(coin_data):
     finally:
         conn.close()
 
-def was_alert_sent_for_alarm(user_id, alert_key):
-    """
-    Checks if an alert with a specific key was already sent today.
-    The key should combine date and alarm time (e.g., '2025-09-21_14:30:00_EST').
+def mark_alarms_fired(rows):
+    """Moves fired alarms to their next occurrence and records sent digests in alert_deliveries.
+
+    rows are (alarm_id, fired_at, next_fire_utc, user_id, local_date); local_date is None
+    for an occurrence that was skipped rather than sent. An alarm edited since it was
+    read (next_fire_utc no longer fired_at) keeps its new schedule. Returns False if
+    the rows could not be recorded.
     """
+    if not rows:
+        return True
     conn = get_db_connection()
-    result = False
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT 1 FROM sent_alerts WHERE user_id = %s AND alert_key = %s;",
-                (user_id, alert_key)
+            # One statement, so marking a single send costs one round trip
+            psycopg2.extras.execute_values(
+                cur,
+                """
+                WITH v (alarm_id, fired_at, next_fire, user_id, local_date) AS (VALUES %s),
+                moved AS (
+                    UPDATE user_alarms a SET next_fire_utc = v.next_fire, last_fired_utc = v.fired_at
+                    FROM v WHERE a.alarm_id = v.alarm_id AND a.next_fire_utc = v.fired_at
+                )
+                INSERT INTO alert_deliveries (alarm_id, user_id, local_date)
+                SELECT alarm_id, user_id, local_date FROM v WHERE local_date IS NOT NULL
+                ON CONFLICT DO NOTHING;
+                """,
+                rows,
+                template="(%s::BIGINT, %s::TIMESTAMPTZ, %s::TIMESTAMPTZ, %s::BIGINT, %s::DATE)",
+                page_size=len(rows)
             )
-            result = cur.fetchone() is not None
+        conn.commit()
+        return True
     except Exception as e:
-        logger.error(f"Failed to check for alert status for user {user_id}: {e}")
+        logger.error(f"Failed to record {len(rows)} fired alarms: {e}")
+        conn.rollback()
+        return False
     finally:
-        if conn:
-            conn.close()
-    return result
+        conn.close()
 
-def mark_alert_sent_for_alarm(user_id, alert_key):
-    """Marks a specific alert as sent by storing a record in the database."""
+def prune_alert_deliveries(days_to_keep=30, batch_size=5000):
+    """Deletes ledger rows older than `days_to_keep` in short batches so no long lock is held."""
     conn = get_db_connection()
+    total = 0
+    try:
+        while True:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM alert_deliveries WHERE ctid = ANY(ARRAY(
+                        SELECT ctid FROM alert_deliveries
+                        WHERE local_date < CURRENT_DATE - %s
+                        LIMIT %s
+                    ));
+                    """,
+                    (days_to_keep, batch_size)
+                )
+                deleted = cur.rowcount
+            conn.commit()
+            total += deleted
+            if deleted < batch_size:
+                break
+        logger.info(f"Pruned {total} alert ledger rows older than {days_to_keep} days.")
+    except Exception as e:
+        logger.error(f"Failed to prune alert ledger: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return total
+
+def get_admin_stats(max_staleness=None):
+    """Headline counts for the dashboard, read from the replica when one is fresh enough."""
+    conn = get_read_connection(max_staleness)
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO sent_alerts (user_id, alert_key) VALUES (%s, %s) ON CONFLICT (alert_key) DO NOTHING;",
-                (user_id, alert_key)
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(DISTINCT user_id) FROM user_coins),
+                    (SELECT COUNT(*) FROM user_coins),
+                    (SELECT COUNT(*) FROM users WHERE created_at >= NOW() - INTERVAL '7 days'),
+                    -- coin_prices is large; the planner's estimate is plenty for a dashboard
+                    (SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = 'coin_prices'::regclass),
+                    (SELECT COUNT(*) FROM coin_mapping);
+                """
             )
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to mark alert as sent for user {user_id}: {e}")
-        conn.rollback()
+            total_users, active_users, watchlist_entries, new_users, price_records, tracked_coins = cur.fetchone()
     finally:
         conn.close()
+    return {
+        'total_users': total_users,
+        'active_users': active_users,
+        'total_watchlist_entries': watchlist_entries,
+        'avg_coins_per_user': watchlist_entries / active_users if active_users else 0,
+        'new_users_7d': new_users,
+        'price_records': price_records,
+        'tracked_coins': tracked_coins,
+    }
 
-def get_coin_current_and_7d_high(coin_ids):
+def get_coin_current_and_7d_high(coin_ids, max_staleness=None):
     """Fetches current price and 7-day high for a list of coins."""
-    conn = get_db_connection()
+    conn = get_read_connection(max_staleness)
     coin_data = {}
     try:
         with conn.cursor() as cur:
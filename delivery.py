@@ -0,0 +1,32 @@
+"""
+Classification of Telegram delivery errors.
+
+A chat that blocked the bot or no longer exists fails on every send, so
+database.record_delivery_errors marks such users in user_delivery_status
+and pauses their alarms (next_fire_utc NULL). Due-alarm queries and
+broadcasts then skip them until they come back with /start. Anything else
+is transient: counted, and retried as before.
+
+database imports this module, so telegram is only imported once an error
+is classified; offline tools such as backfill.py don't load it.
+"""
+BLOCKED = 'blocked'  # blocked the bot, left, or the account was deleted
+CHAT_NOT_FOUND = 'chat_not_found'
+TRANSIENT = 'transient'
+
+PERMANENT = (BLOCKED, CHAT_NOT_FOUND)
+
+
+def classify(error):
+    """BLOCKED, CHAT_NOT_FOUND or TRANSIENT for an exception raised while sending."""
+    from telegram.error import BadRequest, Forbidden
+
+    if isinstance(error, Forbidden):
+        return BLOCKED
+    if isinstance(error, BadRequest) and "chat not found" in str(error).lower():
+        return CHAT_NOT_FOUND
+    return TRANSIENT
+
+
+def is_permanent(kind):
+    return kind in PERMANENT
@@ -0,0 +1,100 @@
+"""
+Ready-to-send daily digests for alarms that are about to fire.
+
+price_collector.prepare_digests runs after every price ingest (or standby
+catch-up) and renders the digest of each alarm that fires within PREPARE_AHEAD, so the work for a popular slot is spread over the minutes
+before it instead of landing in one send_daily_alerts run. A digest is
+re-rendered when the watchlist changes or a coin's price moves more than
+REFRESH_THRESHOLD_PCT. send_daily_alerts takes the digest for each due
+alarm and only transmits it, rendering inline for any not prepared. A
+digest whose watchlist version no longer matches at take() time (the user
+edited their list after it was rendered) is dropped and rendered afresh.
+"""
+import threading
+from datetime import timedelta
+
+# How far ahead of an alarm its digest is rendered; covers ALERT_LOOKAHEAD plus a fetch interval
+PREPARE_AHEAD = timedelta(minutes=10)
+
+# Re-render a prepared digest once any of its prices moves by more than this
+REFRESH_THRESHOLD_PCT = 0.5
+
+# Digests, sent or not, are dropped this long after their alarm
+EXPIRE_AFTER = timedelta(minutes=30)
+
+
+class Digest:
+    __slots__ = ('user_id', 'timezone', 'local_date', 'fire_at', 'coins', 'prices', 'message',
+                 'watchlist_version', 'sent')
+
+    def __init__(self, user_id, timezone, local_date, fire_at, coins, prices, message, watchlist_version):
+        self.user_id = user_id
+        self.timezone = timezone
+        self.local_date = local_date
+        self.fire_at = fire_at
+        self.coins = coins
+        self.prices = prices  # coin_id -> current_price the message was rendered with
+        self.message = message
+        self.watchlist_version = watchlist_version  # watchlists.cache.version() when coins were read
+        self.sent = False  # taken by send_daily_alerts; kept until expiry so it isn't rebuilt
+
+    def is_for(self, fire_at):
+        # A rescheduled alarm fires at a different instant, so its old digest no longer applies
+        return self.fire_at == fire_at
+
+    def is_current(self, coins, coin_data):
+        """False if the watchlist changed or a price moved materially since rendering."""
+        if coins != self.coins or coin_data.keys() != self.prices.keys():
+            return False
+        for coin_id, rendered in self.prices.items():
+            price = coin_data[coin_id]['current_price']
+            if rendered and abs(price - rendered) / rendered * 100 > REFRESH_THRESHOLD_PCT:
+                return False
+        return True
+
+
+class DigestQueue:
+    """alarm_id -> the Digest prepared for that alarm's next occurrence."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.digests = {}
+        self.prepared = 0
+        self.taken = 0
+        self.stale = 0
+
+    def get(self, alarm_id):
+        return self.digests.get(alarm_id)
+
+    def put(self, alarm_id, digest):
+        with self._lock:
+            self.digests[alarm_id] = digest
+            self.prepared += 1
+
+    def take(self, alarm_id, fire_at, timezone, watchlist_version):
+        """The message prepared for this occurrence of the alarm, or None if there is none still valid."""
+        with self._lock:
+            digest = self.digests.get(alarm_id)
+            if digest is None or not digest.is_for(fire_at):
+                return None
+            if watchlist_version is None or digest.watchlist_version != watchlist_version \
+                    or digest.timezone != timezone:
+                # Rendered before a watchlist or alarm change; the caller renders it afresh
+                del self.digests[alarm_id]
+                self.stale += 1
+                return None
+            digest.sent = True
+            self.taken += 1
+            return digest.message
+
+    def expire(self, now_utc):
+        with self._lock:
+            for alarm_id in [a for a, d in self.digests.items() if d.fire_at + EXPIRE_AFTER < now_utc]:
+                del self.digests[alarm_id]
+
+    def clear(self):
+        with self._lock:
+            self.digests.clear()
+
+
+queue = DigestQueue()
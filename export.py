@@ -0,0 +1,224 @@
+"""
+Streaming export of price history.
+
+Rows are read through a named (server-side) cursor, so Postgres hands them
+over CHUNK_SIZE at a time and memory stays flat however large the range.
+Each chunk is encoded straight away as CSV, NDJSON or one Parquet row
+group. Writing CSV to a file skips Python row handling altogether and
+uses COPY ... TO STDOUT.
+
+The same generators back the dashboard's /export endpoint and the bot's
+/export command. There are no rollup tables yet, so exports read the raw
+coin_prices ticks.
+
+Usage:
+    python export.py --days 7 --format ndjson > week.ndjson
+    python export.py --coins bitcoin,ethereum --start 2025-01-01 --format parquet -o prices.parquet
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+import database
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+COLUMNS = ('coin_id', 'timestamp', 'price', 'source')
+CHUNK_SIZE = 10000
+# Exports are bulk reads of settled history; a replica a few minutes behind is fine
+EXPORT_MAX_STALENESS = 300
+
+
+def parse_time(value):
+    """ISO date or datetime -> naive UTC, matching coin_prices.timestamp."""
+    if value is None or isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed is not None and parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _query(coin_ids=None, start=None, end=None):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("timestamp >= %s")
+        params.append(parse_time(start))
+    if end is not None:
+        clauses.append("timestamp < %s")
+        params.append(parse_time(end))
+    if coin_ids:
+        clauses.append("coin_id = ANY(%s)")
+        params.append(list(coin_ids))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # Either order walks an existing index, so rows stream without a sort
+    order = "coin_id, timestamp" if coin_ids else "timestamp"
+    return f"SELECT coin_id, timestamp, price, source FROM coin_prices {where} ORDER BY {order}", params
+
+
+def iter_chunks(coin_ids=None, start=None, end=None, chunk_size=CHUNK_SIZE, max_staleness=EXPORT_MAX_STALENESS):
+    """Yields lists of (coin_id, timestamp, price, source) rows, chunk_size at a time."""
+    sql, params = _query(coin_ids, start, end)
+    conn = database.get_read_connection(max_staleness)
+    try:
+        with conn.cursor(name="price_export") as cur:
+            cur.itersize = chunk_size
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        conn.close()
+
+
+# --- Encoders: chunks of rows in, bytes out ---
+def encode_csv(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows((coin_id, ts.isoformat(' '), repr(price), source or '') for coin_id, ts, price, source in rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def encode_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps({'coin_id': coin_id, 'timestamp': ts.isoformat(), 'price': price, 'source': source}) + "\n"
+            for coin_id, ts, price, source in rows
+        ).encode()
+
+
+class _ByteSink(io.RawIOBase):
+    """Write-only file that hands back whatever has been written since the last drain()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def encode_parquet(chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from e
+
+    schema = pa.schema([
+        ('coin_id', pa.string()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('price', pa.float64()),
+        ('source', pa.string()),
+    ])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for rows in chunks:
+            coin_ids, timestamps, prices, sources = zip(*rows)
+            writer.write_table(pa.table([coin_ids, timestamps, prices, sources], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson, 'parquet': encode_parquet}
+
+
+def stream(fmt, coin_ids=None, start=None, end=None, counter=None, **options):
+    """Yields the export as encoded byte chunks. counter, if given, is a list whose [0] counts rows."""
+    if fmt not in ENCODERS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    chunks = iter_chunks(coin_ids, start, end, **options)
+    if counter is not None:
+        chunks = _counted(chunks, counter)
+    return ENCODERS[fmt](chunks)
+
+
+def _counted(chunks, counter):
+    for rows in chunks:
+        counter[0] += len(rows)
+        yield rows
+
+
+def copy_csv(out, coin_ids=None, start=None, end=None, max_staleness=EXPORT_MAX_STALENESS):
+    """Writes CSV to a binary file with COPY, without building Python rows. Returns the row count."""
+    sql, params = _query(coin_ids, start, end)
+    conn = database.get_read_connection(max_staleness)
+    try:
+        with conn.cursor() as cur:
+            query = cur.mogrify(sql, params).decode()
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            return cur.rowcount
+    finally:
+        conn.close()
+
+
+def write(out, fmt, coin_ids=None, start=None, end=None, **options):
+    """Writes the export to a binary file object. Returns the number of rows."""
+    if fmt == 'csv':
+        return copy_csv(out, coin_ids, start, end, **options)
+    counter = [0]
+    for data in stream(fmt, coin_ids, start, end, counter=counter, **options):
+        out.write(data)
+    return counter[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--coins", help="comma-separated coin ids (default: all)")
+    parser.add_argument("--start", help="ISO date/time in UTC (inclusive)")
+    parser.add_argument("--end", help="ISO date/time in UTC (exclusive)")
+    parser.add_argument("--days", type=float, help="shorthand for --start <now - days>")
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    start = args.start
+    if args.days is not None:
+        start = datetime.utcnow() - timedelta(days=args.days)
+    coin_ids = args.coins.split(",") if args.coins else None
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        rows = write(out, args.format, coin_ids, start, args.end)
+    finally:
+        if args.output:
+            out.close()
+    print(f"Exported {rows} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    main()
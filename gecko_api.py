@@ -1,11 +1,68 @@
+import os
+from datetime import datetime, timezone
+
 import requests
 
+from circuit_breaker import CircuitBreaker
+
+# Overridable so benchmarks and tests can point at a local stub server
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+
+# (connect, read) seconds; a hung request must not outlive the 2-minute fetch job
+REQUEST_TIMEOUT = (5, 20)
+
+# Shared by every call so an outage or rate limit stops all traffic to CoinGecko at once
+breaker = CircuitBreaker("CoinGecko", failure_threshold=3, cooldown=60, max_cooldown=900)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(value):
+    """Parses CoinGecko's ISO-8601 timestamps into naive UTC datetimes (None if missing or malformed)."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_markets(data):
+    """Turns a /coins/markets response into {coin_id: {current_price, symbol, name, last_updated}}."""
+    coin_data = {}
+    for coin in data:
+        # Skip coins with null/zero prices
+        if coin['current_price'] is None or coin['current_price'] <= 0:
+            print(f"Skipping {coin['id']} - invalid price: {coin['current_price']}")
+            continue
+
+        coin_data[coin['id']] = {
+            'current_price': coin['current_price'],
+            'symbol': coin['symbol'].upper(),
+            'name': coin['name'],
+            'last_updated': parse_timestamp(coin.get('last_updated'))
+        }
+    return coin_data
+
 
 def fetch_top_coins(limit=100):
     """Fetch top coins by market cap from CoinGecko with debug info"""
+    if not breaker.allow():
+        status = breaker.status()
+        print(f"CoinGecko circuit open, skipping request (retry in {status['retry_in']:.0f}s)")
+        return {}
+
     print(f"Requesting top {limit} coins from CoinGecko...")
     
-    url = "https://api.coingecko.com/api/v3/coins/markets"
+    url = f"{COINGECKO_API_URL}/coins/markets"
     params = {
         'vs_currency': 'usd',
         'order': 'market_cap_desc',
@@ -15,25 +72,18 @@ def fetch_top_coins(limit=100):
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
         print(f"API Response status: {response.status_code}")
+        if response.status_code == 429:
+            breaker.record_failure("rate limited", retry_after=_retry_after(response))
+            return {}
         response.raise_for_status()
         data = response.json()
+        breaker.record_success()
         
         print(f"API returned {len(data)} coins")
         
-        coin_data = {}
-        for coin in data:
-            # Skip coins with null/zero prices
-            if coin['current_price'] is None or coin['current_price'] <= 0:
-                print(f"Skipping {coin['id']} - invalid price: {coin['current_price']}")
-                continue
-                
-            coin_data[coin['id']] = {
-                'current_price': coin['current_price'],
-                'symbol': coin['symbol'].upper(),
-                'name': coin['name']
-            }
+        coin_data = parse_markets(data)
         
         print(f"Processed {len(coin_data)} valid coins")
         
@@ -47,6 +97,7 @@ def fetch_top_coins(limit=100):
         
     except requests.RequestException as e:
         print(f"API Request Error: {e}")
+        breaker.record_failure(e)
         return {}
     except Exception as e:
         print(f"Processing Error: {e}")
@@ -54,11 +105,11 @@ def fetch_top_coins(limit=100):
 
 def fetch_current_prices(coin_ids):
     """Fetch specific coins - kept for compatibility"""
-    if not coin_ids:
+    if not coin_ids or not breaker.allow():
         return {}
     
     coins_string = ','.join(coin_ids)
-    url = "https://api.coingecko.com/api/v3/coins/markets"
+    url = f"{COINGECKO_API_URL}/coins/markets"
     params = {
         'vs_currency': 'usd',
         'ids': coins_string,
@@ -69,9 +120,10 @@ def fetch_current_prices(coin_ids):
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
+        breaker.record_success()
         
         coin_data = {}
         for coin in data:
@@ -83,6 +135,33 @@ def fetch_current_prices(coin_ids):
         
         return coin_data
         
+    except requests.RequestException as e:
+        print(f"Error fetching from CoinGecko: {e}")
+        breaker.record_failure(e)
+        return {}
     except Exception as e:
         print(f"Error fetching from CoinGecko: {e}")
-        return {}
\ No newline at end of file
+        return {}
+
+
+def fetch_market_chart(coin_id, days):
+    """Fetch the raw /market_chart response for one coin. Raises requests.HTTPError on failure.
+
+    CoinGecko returns 5-minute points for 1 day and hourly points for 2-90 days.
+    """
+    response = requests.get(
+        f"{COINGECKO_API_URL}/coins/{coin_id}/market_chart",
+        params={'vs_currency': 'usd', 'days': days},
+        timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def parse_market_chart(data):
+    """Turns a /market_chart response into [(naive UTC datetime, price), ...], dropping empty points."""
+    return [
+        (datetime.fromtimestamp(ms / 1000, timezone.utc).replace(tzinfo=None), price)
+        for ms, price in data.get('prices', [])
+        if price is not None and price > 0
+    ]
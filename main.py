@@ -1,57 +1,149 @@
+import startup  # first, so the startup breakdown covers every import
 import logging
 import os
-import price_collector
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler
+from logging_config import setup_logging
+
+# Settings and logging before anything else: modules read env vars and log as they load
+load_dotenv()
+setup_logging()
+
+import price_collector
+from telegram.ext import Application, ContextTypes, InlineQueryHandler, MessageHandler, TypeHandler, filters
 from telegram import Update
+import alert_workers
+import broadcasts
+import coin_search
 import database
+import change_feed
+import coordination
+import price_store
+import profiling
+import snapshot
+from alarm_schedule import schedule as alarm_schedule
 import asyncio
 import datetime
-import bot as bot
-import gecko_api as gecko_api
-import database as database
-from logging_config import setup_logging
-
-ASK_TIMEZONE = 1
+import bot
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-# set higher logging level for httpx to avoid all GET and POST requests being logged
-logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Load .env variables
-load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Future of the schema check main() starts before the event loop runs
+schema_ready = None
+
+startup.timer.mark("imports")
+
+async def reconcile_state() -> None:
+    """Brings in-process state up to date with Postgres."""
+    timer = startup.timer
+    await asyncio.gather(
+        timer.run("price_store", price_store.store.warm_from_db),
+        timer.run("alarm_schedule", alarm_schedule.load_from_db),
+    )
+    # Built now rather than on the first inline query
+    await timer.run("coin_index", coin_search.index.refresh)
+
+
+async def post_init(application: Application) -> None:
+    """Warms in-process state before the job queue and polling start."""
+    timer = startup.timer
+    # Time since run_polling: mostly getMe, which overlapped the schema check
+    timer.mark("telegram_init")
+    if alert_workers.enabled():
+        # Worker processes boot in parallel with the rest of startup
+        alert_workers.start()
+    # The change feed listens first so no change committed while state is being loaded is
+    # missed; neither it nor the snapshot file needs the schema check to have finished
+    _, _, rate_limits = await asyncio.gather(
+        asyncio.wrap_future(schema_ready),
+        timer.run("change_feed", change_feed.start),
+        timer.run("snapshot", snapshot.load),
+    )
+    if rate_limits is None:
+        # Cold start: nothing to serve from until the database has been read
+        await reconcile_state()
+        timer.ready()
+        return
+
+    bot.user_last_command.update(
+        {user_id: datetime.datetime.fromtimestamp(ts) for user_id, ts in rate_limits.items()}
+    )
+    # Warm start: answer from the snapshot straight away and catch up in the background
+    application.create_task(reconcile_state())
+    timer.ready()
+
+
+async def checkpoint_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Writes the snapshot used by the next warm restart."""
+    if not price_store.store.warm:
+        # Never replace a good snapshot with a half-initialised one
+        return
+    # Only cooldowns that are still running are worth carrying across a restart
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=bot.COMMAND_COOLDOWN)
+    rate_limits = {
+        user_id: ts.timestamp() for user_id, ts in list(bot.user_last_command.items()) if ts > cutoff
+    }
+    try:
+        await asyncio.to_thread(snapshot.save, rate_limits=rate_limits)
+    except Exception as e:
+        logger.error(f"Failed to save snapshot: {e}")
+
+
+async def post_shutdown(application: Application) -> None:
+    await checkpoint_state(None)
+    change_feed.stop()
+    await asyncio.to_thread(alert_workers.shutdown)
+    # Let a standby replica take over the jobs without waiting for the connection to time out
+    await asyncio.to_thread(coordination.coordinator.release_all)
+
+
 def main() -> None:
     """Start the bot."""
-    database.init_database()
-    setup_logging()
+    global schema_ready
+    # Checked in a thread while the application is built and PTB's initialize() calls getMe;
+    # post_init waits for it before reading any table
+    schema_ready = startup.timer.in_background("database", database.init_database)
 
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
     application.add_error_handler(bot.error_handler)
 
-    # on different commands - add handlers
-    application.add_handler(CommandHandler("add", bot.add_coin))
-    application.add_handler(CommandHandler("remove", bot.remove_coin))
-    application.add_handler(CommandHandler("setalarm", bot.set_alarm))
-    application.add_handler(CommandHandler("message", bot.message_admin))
-    application.add_handler(CommandHandler("donate", bot.donate))
-    application.add_handler(CommandHandler("list", bot.list_coins))
-    application.add_handler(CommandHandler("help", bot.start))
-    application.add_handler(CommandHandler("start", bot.start))
+    # on different commands - add handlers; each one's queries are attributed to its command
+    application.add_handler(bot.command_handler("add", bot.add_coin))
+    application.add_handler(bot.command_handler("remove", bot.remove_coin))
+    application.add_handler(bot.command_handler("setalarm", bot.set_alarm))
+    application.add_handler(bot.command_handler("addalarm", bot.add_alarm))
+    application.add_handler(bot.command_handler("alarms", bot.list_alarms))
+    application.add_handler(bot.command_handler("delalarm", bot.remove_alarm))
+    application.add_handler(bot.command_handler("message", bot.message_admin))
+    application.add_handler(bot.command_handler("broadcast", bot.broadcast))
+    application.add_handler(bot.command_handler("deliveryreport", bot.delivery_report))
+    application.add_handler(bot.command_handler("profile", bot.profile))
+    application.add_handler(bot.command_handler("donate", bot.donate))
+    application.add_handler(bot.command_handler("list", bot.list_coins))
+    application.add_handler(bot.command_handler("price", bot.show_prices))
+    application.add_handler(bot.command_handler("chart", bot.show_chart))
+    application.add_handler(bot.command_handler("export", bot.export_history))
+    application.add_handler(InlineQueryHandler(profiling.profiled("inline_query")(database.scoped("inline_query")(bot.inline_query))))
+    application.add_handler(bot.command_handler("help", bot.start))
+    application.add_handler(bot.command_handler("start", bot.start))
     application.add_handler(MessageHandler(filters.Regex(r'^/set alarm'), bot.remind_correct_setalarm))
+    # Runs after every other group, so it sees when the first update has been answered
+    application.add_handler(TypeHandler(Update, startup.timer.first_response), group=100)
 
     # We use a job queue to schedule recurring tasks
     job_queue = application.job_queue
 
+    # Every replica schedules every job; only the elected leader for each one runs it
+    leader_only = coordination.leader_only
+    if coordination.LEADER_ELECTION:
+        # Until the change feed connects, alarms set through another replica can't reach this schedule
+        alarm_schedule.sees_all_writes = False
+
     # Schedule the price fetching job to run every 5 minutes
     job_queue.run_repeating(
-        price_collector.fetch_and_store_prices, 
+        leader_only("fetch_prices", standby=price_collector.catch_up_prices)(price_collector.fetch_and_store_prices),
         interval=datetime.timedelta(minutes=2), 
         first=0
     )
@@ -59,17 +151,33 @@ def main() -> None:
     # Schedule the daily alerts job to run every 5 minutes
     # This task will check for users who need alerts and send them
     job_queue.run_repeating(
-        price_collector.send_daily_alerts, 
+        leader_only("daily_alerts")(price_collector.send_daily_alerts),
         interval=datetime.timedelta(minutes=2), 
         first=0
     )
 
+    # Sends queued broadcasts, and resumes one interrupted by a restart or failover
+    job_queue.run_repeating(
+        leader_only("broadcasts")(broadcasts.run_broadcasts),
+        interval=datetime.timedelta(minutes=1),
+        first=datetime.timedelta(seconds=20)
+    )
+
+    # Checkpoint in-process state shortly after each price fetch
+    job_queue.run_repeating(
+        checkpoint_state,
+        interval=datetime.timedelta(minutes=2),
+        first=datetime.timedelta(seconds=30)
+    )
+
     # Schedule database cleanup to run once a day
     job_queue.run_daily(
-        price_collector.cleanup_old_data, 
+        leader_only("cleanup")(price_collector.cleanup_old_data),
         time=datetime.time(hour=3, minute=0, tzinfo=datetime.timezone.utc)
     )
 
+    startup.timer.mark("setup")
+
     # Run the bot until the user presses Ctrl-C
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
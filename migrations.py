@@ -0,0 +1,317 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in order, and is recorded in schema_version.
+Boot costs a single version query when the schema is current; otherwise
+the runner takes an advisory lock so only one replica migrates at a time.
+Waiting replicas poll pg_try_advisory_lock rather than blocking in
+pg_advisory_lock: a blocked statement holds a snapshot, which CREATE INDEX
+CONCURRENTLY in the lock holder's session would wait for, deadlocking the two.
+
+Migrations marked concurrent run outside a transaction (one statement at
+a time) so CREATE INDEX CONCURRENTLY never blocks ingest or the bot. If a
+concurrent build was interrupted, the invalid index it left behind is
+dropped and rebuilt on the next run.
+
+Every statement must be idempotent: a migration interrupted half-way is
+simply run again.
+"""
+import logging
+import re
+import time
+from collections import namedtuple
+
+import database
+
+logger = logging.getLogger("CryptoBot.Migrations")
+
+# Arbitrary, but shared by every replica
+MIGRATION_LOCK_ID = 0x43524D47
+# How often a replica waiting for another one's migration retries the lock
+LOCK_POLL_INTERVAL = 0.5
+
+Migration = namedtuple("Migration", "version description statements concurrent")
+
+MIGRATIONS = [
+    Migration(1, "baseline tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            timezone TEXT,
+            alarm_time TIME,
+            last_alert_sent_at DATE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_coins (
+            user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+            coin_id TEXT,
+            PRIMARY KEY (user_id, coin_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS coin_prices (
+            coin_id TEXT,
+            price FLOAT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (coin_id, timestamp)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS admin_messages (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            message TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS coin_mapping (
+            coin_id TEXT PRIMARY KEY,
+            name TEXT,
+            symbol TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sent_alerts (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            alert_key TEXT UNIQUE,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ], False),
+    Migration(2, "indexes for the alert, watchlist and retention hot paths", [
+        # was_alert_sent_for_alarm looks up (user_id, alert_key)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS sent_alerts_user_key_idx ON sent_alerts (user_id, alert_key);",
+        # Popular-coin aggregates and per-coin fan-out
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS user_coins_coin_id_idx ON user_coins (coin_id);",
+        # get_users_needing_alerts range-scans each timezone's local alarm window
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS users_due_alarm_idx
+            ON users (timezone, alarm_time) WHERE alarm_time IS NOT NULL;
+        """,
+        # Retention deletes and warm-up/analytics window scans filter on time alone
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS coin_prices_timestamp_idx ON coin_prices (timestamp);",
+    ], True),
+    Migration(3, "replace sent_alerts with a per-user, per-local-date delivery ledger", [
+        # sent_alerts.alert_key was globally UNIQUE but only encoded date/time/zone, so users
+        # sharing an alarm collided. Re-keyed per alarm in version 9.
+        """
+        CREATE TABLE IF NOT EXISTS alert_deliveries (
+            user_id BIGINT NOT NULL,
+            local_date DATE NOT NULL,
+            PRIMARY KEY (user_id, local_date)
+        ) WITH (fillfactor = 100);
+        """,
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('sent_alerts') IS NOT NULL THEN
+                INSERT INTO alert_deliveries (user_id, local_date)
+                SELECT DISTINCT user_id, LEFT(alert_key, 10)::DATE
+                FROM sent_alerts
+                WHERE user_id IS NOT NULL AND alert_key ~ '^\\d{4}-\\d{2}-\\d{2}_'
+                ON CONFLICT DO NOTHING;
+            END IF;
+        END $$;
+        """,
+        "DROP TABLE IF EXISTS sent_alerts;",
+    ], False),
+    Migration(4, "record which price provider served each coin_prices row", [
+        # NULL for rows stored before providers were pluggable (all CoinGecko)
+        "ALTER TABLE coin_prices ADD COLUMN IF NOT EXISTS source TEXT;",
+    ], False),
+    Migration(5, "signup dates and message read status for the dashboard", [
+        # Existing users keep a NULL signup date rather than all appearing to sign up today
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP;",
+        "ALTER TABLE users ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;",
+        "ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'unread';",
+    ], False),
+    Migration(6, "several alarms per user with weekdays, scheduled by next UTC fire time", [
+        # Postgres reads 'CET' as the fixed-offset abbreviation; users meant central European time
+        "UPDATE users SET timezone = 'Europe/Berlin' WHERE timezone = 'CET';",
+        """
+        CREATE TABLE IF NOT EXISTS user_alarms (
+            alarm_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            alarm_time TIME NOT NULL,
+            timezone TEXT NOT NULL,
+            -- Bit 0 = Monday ... bit 6 = Sunday
+            weekdays SMALLINT NOT NULL DEFAULT 127,
+            next_fire_utc TIMESTAMPTZ NOT NULL,
+            last_fired_utc TIMESTAMPTZ,
+            UNIQUE (user_id, alarm_time, timezone)
+        );
+        """,
+        # get_due_alarms range-scans the alarms firing next, whatever their zone
+        "CREATE INDEX IF NOT EXISTS user_alarms_next_fire_idx ON user_alarms (next_fire_utc);",
+        # Each user's single alarm moves over. One that already sent today's digest next fires tomorrow.
+        """
+        INSERT INTO user_alarms (user_id, alarm_time, timezone, next_fire_utc)
+        SELECT u.user_id, u.alarm_time, u.timezone,
+            CASE
+                WHEN ((NOW() AT TIME ZONE u.timezone)::DATE + u.alarm_time) AT TIME ZONE u.timezone > NOW()
+                     AND NOT EXISTS (
+                         SELECT 1 FROM alert_deliveries d
+                         WHERE d.user_id = u.user_id AND d.local_date = (NOW() AT TIME ZONE u.timezone)::DATE
+                     )
+                THEN ((NOW() AT TIME ZONE u.timezone)::DATE + u.alarm_time) AT TIME ZONE u.timezone
+                ELSE ((NOW() AT TIME ZONE u.timezone)::DATE + 1 + u.alarm_time) AT TIME ZONE u.timezone
+            END
+        FROM users u
+        WHERE u.alarm_time IS NOT NULL AND u.timezone IS NOT NULL
+        ON CONFLICT (user_id, alarm_time, timezone) DO NOTHING;
+        """,
+        # users.timezone stays as the user's zone for new alarms and message times
+        "UPDATE users SET alarm_time = NULL WHERE alarm_time IS NOT NULL;",
+        "DROP INDEX IF EXISTS users_due_alarm_idx;",
+    ], False),
+    Migration(7, "admin broadcasts with a resumable checkpoint", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id SERIAL PRIMARY KEY,
+            message TEXT NOT NULL,
+            -- 'all', 'coin:<coin_id>' or 'tz:<zone>'
+            segment TEXT NOT NULL DEFAULT 'all',
+            created_by BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            -- pending -> running -> done, or cancelled
+            status TEXT NOT NULL DEFAULT 'pending',
+            -- Recipients are walked in user_id order; everyone up to here has been handled
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            blocked INT NOT NULL DEFAULT 0,
+            finished_at TIMESTAMP
+        );
+        """,
+    ], False),
+    Migration(8, "per-user delivery status so dead chats stop being scheduled", [
+        """
+        CREATE TABLE IF NOT EXISTS user_delivery_status (
+            user_id BIGINT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+            -- 'ok', or why every send fails: 'blocked' / 'chat_not_found'
+            status TEXT NOT NULL DEFAULT 'ok',
+            failures INT NOT NULL DEFAULT 0,
+            last_error TEXT,
+            last_error_at TIMESTAMP,
+            pruned_at TIMESTAMP
+        );
+        """,
+        # NULL pauses an alarm: get_due_alarms' range scan never reaches it
+        "ALTER TABLE user_alarms ALTER COLUMN next_fire_utc DROP NOT NULL;",
+    ], False),
+    Migration(9, "key the delivery ledger per alarm", [
+        # With several alarms per user, (user_id, local_date) kept one row for all of a day's digests
+        "ALTER TABLE alert_deliveries ADD COLUMN IF NOT EXISTS alarm_id BIGINT;",
+        # Rows from before version 6 belong to the user's only alarm, which moved to user_alarms
+        """
+        UPDATE alert_deliveries d
+        SET alarm_id = (SELECT MIN(a.alarm_id) FROM user_alarms a WHERE a.user_id = d.user_id)
+        WHERE d.alarm_id IS NULL;
+        """,
+        "DELETE FROM alert_deliveries WHERE alarm_id IS NULL;",
+        "ALTER TABLE alert_deliveries DROP CONSTRAINT IF EXISTS alert_deliveries_pkey;",
+        "ALTER TABLE alert_deliveries ADD PRIMARY KEY (alarm_id, local_date);",
+    ], False),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+_INDEX_NAME = re.compile(r"INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+def _current_version(cur):
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cur.fetchone()[0]
+
+
+def _drop_invalid_index(cur, statement):
+    match = _INDEX_NAME.search(statement)
+    if not match:
+        return
+    cur.execute(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid;
+        """,
+        (match.group(1),)
+    )
+    if cur.fetchone():
+        logger.warning(f"Dropping invalid index {match.group(1)} left by an interrupted build")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)};")
+
+
+def _apply(conn, migration):
+    if migration.concurrent:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for statement in migration.statements:
+                _drop_invalid_index(cur, statement)
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                (migration.version, migration.description)
+            )
+    else:
+        conn.autocommit = False
+        with conn:
+            with conn.cursor() as cur:
+                for statement in migration.statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                    (migration.version, migration.description)
+                )
+        conn.autocommit = True
+
+
+def _acquire_lock(cur):
+    """Takes the migration lock, sleeping between attempts so no snapshot is held while waiting."""
+    waited = False
+    while True:
+        cur.execute("SELECT pg_try_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+        if cur.fetchone()[0]:
+            return
+        if not waited:
+            logger.info("Another replica is migrating; waiting for it to finish")
+            waited = True
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def migrate():
+    """Brings the schema up to LATEST_VERSION. Returns the resulting version."""
+    conn = database.get_db_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            version = _current_version(cur)
+            if version >= LATEST_VERSION:
+                return version
+
+            _acquire_lock(cur)
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT PRIMARY KEY,
+                        description TEXT,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                # Another replica may have migrated while we waited for the lock
+                version = _current_version(cur)
+                for migration in MIGRATIONS:
+                    if migration.version <= version:
+                        continue
+                    logger.info(f"Applying migration {migration.version}: {migration.description}")
+                    _apply(conn, migration)
+                    version = migration.version
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+        return version
+    finally:
+        conn.close()
@@ -1,14 +1,22 @@
-import time
-from datetime import datetime
+from datetime import datetime, timedelta
+import alarm_schedule
+import alert_workers
+import analytics
+import coin_search
+import coordination
 import database
-import gecko_api
-from telegram import Bot
+import delivery
+import digests
+import price_providers
+import price_store
+import timezones
+import watchlists
 import pytz
 import os
 from dotenv import load_dotenv
 import logging
 import asyncio
-import psycopg2.errors
+import psycopg2.extras
 
 logger = logging.getLogger("CryptoBot.PriceCollector")
 
@@ -16,68 +24,133 @@ logger = logging.getLogger("CryptoBot.PriceCollector")
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Dip percentages (down from the 7-day high) that change how a coin is flagged
+DIP_ALERT_THRESHOLD = 20
+DIP_WARNING_THRESHOLD = 10
 
-tz_map = {
-    'EST': 'US/Eastern',
-    'PST': 'US/Pacific',
-    'CST': 'US/Central',
-    'MST': 'US/Mountain',
-    'UTC': 'UTC',
-    'GMT': 'GMT',
-    'CET': 'CET',
-    'JST': 'Japan',
-    'NZT': 'Pacific/Auckland'
-}
+# send_daily_alerts picks up alarms firing within this window
+ALERT_LOOKAHEAD = timedelta(minutes=5)
+
+# An alarm still unsent this long after it was due (downtime, repeated send failures) is
+# skipped to its next occurrence rather than delivering a stale digest
+MISSED_ALARM_GRACE = timedelta(hours=1)
+
+# The delivery ledger only feeds the dashboard's counts; due alarms are deduplicated by next_fire_utc
+ALERT_LEDGER_RETENTION_DAYS = 30
+
+# Prices older than this are shown with their age (CoinGecko itself lags a few minutes)
+STALE_AFTER = timedelta(minutes=15)
+
+ALERT_FOOTER = "\nTip: Use /donate to support the bot and keep the coffee flowing! ☕🚀"
+
+# coin_id -> (source timestamp, price) of the last row this process stored
+last_seen_prices = {}
+# coin_id -> (symbol, name) last written to coin_mapping
+last_seen_coins = {}
 
-import asyncio
-from datetime import datetime
-import psycopg2
 
 async def fetch_and_store_prices(context):
-    """Fetches coin data and stores it in the database."""
+    """Fetches coin data and stores the prices that changed since the last ingest."""
     print("Fetching prices for top 100 coins...")
     
     try:
-        # fetch_top_coins() returns a dictionary {coin_id: data}
-        top_coins_data = await asyncio.to_thread(gecko_api.fetch_top_coins)
+        # fetch_top_coins() returns a dictionary {coin_id: data}, each tagged with its provider
+        top_coins_data = await asyncio.to_thread(price_providers.fetch_top_coins)
 
         if not top_coins_data:
-            print("API did not return any data.")
+            # Alerts and commands keep serving the stored prices, marked with their age
+            states = ", ".join(f"{s['name']}: {s['state']}" for s in price_providers.status())
+            print(f"No provider returned data; serving last known prices ({states}).")
             return
 
-        # Prepare a list of tuples for the bulk insert
-        current_time = datetime.now()
-        values_to_insert = [
-            (coin_id, current_time, coin_info['current_price'])
+        # coin_prices.timestamp is naive UTC, which is also what the price store assumes.
+        # Rows are keyed on CoinGecko's own last_updated so a retry or a second replica
+        # storing the same observation hits ON CONFLICT instead of adding a duplicate.
+        current_time = datetime.now(pytz.UTC).replace(tzinfo=None)
+        changed, sources = {}, {}
+        for coin_id, coin_info in top_coins_data.items():
+            source_time = coin_info.get('last_updated') or current_time
+            observation = (source_time, coin_info['current_price'])
+            if last_seen_prices.get(coin_id) != observation:
+                changed[coin_id] = observation
+                sources[coin_id] = coin_info.get('source')
+
+        new_coins = {
+            coin_id: (coin_info['symbol'], coin_info['name'])
             for coin_id, coin_info in top_coins_data.items()
-        ]
-
-        # Use a single database connection and transaction
-        # The 'with' statement handles commit/rollback and closing
-        conn = await asyncio.to_thread(database.get_db_connection)
-        with conn:  # This acts as a transaction block, committing on success
-            with conn.cursor() as cur:
-                print(f"Attempting to store {len(values_to_insert)} prices...")
-                try:
-                    # Use ON CONFLICT DO NOTHING to handle duplicates cleanly
-                    cur.executemany(
-                        """
-                        INSERT INTO coin_prices (coin_id, timestamp, price)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (coin_id, timestamp) DO NOTHING;
-                        """,
-                        values_to_insert
-                    )
-                    print(f"Stored prices for {cur.rowcount} coins at {current_time}")
-
-                except Exception as e:
-                    # If an error happens, the 'with' block will handle the rollback
-                    print(f"Failed to insert prices into the database: {e}")
-                    raise # Re-raise the exception to be caught by the outer try-except
+            if last_seen_coins.get(coin_id) != (coin_info['symbol'], coin_info['name'])
+        }
+
+        if not changed and not new_coins:
+            print("No prices changed since the last fetch.")
+            return
+
+        def store():
+            conn = database.get_db_connection()
+            try:
+                with conn:  # This acts as a transaction block, committing on success
+                    with conn.cursor() as cur:
+                        if new_coins:
+                            psycopg2.extras.execute_values(
+                                cur,
+                                """
+                                INSERT INTO coin_mapping (coin_id, symbol, name) VALUES %s
+                                ON CONFLICT (coin_id) DO UPDATE SET symbol = EXCLUDED.symbol, name = EXCLUDED.name;
+                                """,
+                                [(coin_id, symbol, name) for coin_id, (symbol, name) in new_coins.items()]
+                            )
+                            database.notify_rows(cur, 'coins', [
+                                [coin_id, symbol, name] for coin_id, (symbol, name) in new_coins.items()
+                            ])
+                        if not changed:
+                            return 0
+                        psycopg2.extras.execute_values(
+                            cur,
+                            """
+                            INSERT INTO coin_prices (coin_id, timestamp, price, source) VALUES %s
+                            ON CONFLICT (coin_id, timestamp) DO NOTHING;
+                            """,
+                            [(coin_id, ts, price, sources[coin_id]) for coin_id, (ts, price) in changed.items()]
+                        )
+                        stored = cur.rowcount
+                        # Other replicas append these to their price stores as soon as we commit
+                        database.notify_rows(cur, 'prices', [
+                            [coin_id, price_store.to_epoch(ts), price] for coin_id, (ts, price) in changed.items()
+                        ])
+                        return stored
+            finally:
+                conn.close()
+
+        print(f"Attempting to store {len(changed)} changed prices of {len(top_coins_data)}...")
+        try:
+            stored = await asyncio.to_thread(store)
+        except Exception as e:
+            print(f"Failed to insert prices into the database: {e}")
+            raise # Re-raise the exception to be caught by the outer try-except
+        print(f"Stored prices for {stored} coins at {current_time}")
+
+        last_seen_prices.update(changed)
+        last_seen_coins.update(new_coins)
+
+        # Keep the in-memory store in step with what was just committed
+        price_store.store.ingest(top_coins_data, current_time)
+        analytics.mark_stale()
+        coin_search.index.refresh()
+        await asyncio.to_thread(prepare_digests)
             
     except Exception as e:
         print(f"An error occurred during fetch or store: {e}")
 
+async def catch_up_prices(context):
+    """Standby replicas: pull in the prices the ingest leader stored since our newest tick."""
+    try:
+        rows = await asyncio.to_thread(price_store.store.catch_up_from_db)
+        if rows:
+            analytics.mark_stale()
+            await asyncio.to_thread(prepare_digests)
+    except Exception as e:
+        logger.error(f"Failed to catch up on prices: {e}")
+
 def format_price(price):
     """Format price with dynamic significant figures based on magnitude"""
     if price >= 1:
@@ -86,99 +159,277 @@ def format_price(price):
         return f"{price:,.4f}"      # 4 decimals for $0.01 - $1
     else:
         return f"{price:,.6f}"      # 6 decimals for tiny coins
+
+
+def format_age(seconds):
+    """Compact age such as '45m' or '3h 10m'."""
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m" if minutes else f"{hours}h"
+    return f"{hours // 24}d {hours % 24}h"
+
+
+def stale_age(updated_at, now_utc=None):
+    """Seconds since updated_at (epoch) if older than STALE_AFTER, else None."""
+    if updated_at is None or updated_at != updated_at:  # missing or NaN
+        return None
+    age = (now_utc or datetime.now(pytz.UTC)).timestamp() - updated_at
+    return age if age > STALE_AFTER.total_seconds() else None
+
+
+def dip_status(dip, alert_threshold=DIP_ALERT_THRESHOLD, warning_threshold=DIP_WARNING_THRESHOLD):
+    """Returns the (emoji, status suffix) pair for a dip percentage."""
+    if dip >= alert_threshold:
+        return "🔴", " - **DIP ALERT!**"
+    if dip >= warning_threshold:
+        return "🟡", ""
+    return "🟢", ""
+
+
+def build_alert_message(user_coins, coin_data, timezone, now_utc=None, **thresholds):
+    """Renders the daily digest for one user's watchlist."""
+    now_utc = now_utc or datetime.now(pytz.UTC)
+    message = "🌅 **Daily Crypto Update**\n\n"
+    oldest = None
+
+    for coin_id in user_coins:
+        if coin_id in coin_data:
+            data = coin_data[coin_id]
+            symbol = data['symbol']
+            price = data['current_price']
+            high = data['seven_day_high']
+            dip = data['dip_percentage']
+
+            price_str = format_price(price)
+            high_str = format_price(high)
+            emoji, status = dip_status(dip, **thresholds)
+
+            age = stale_age(data.get('updated_at'), now_utc)
+            age_str = f" _(as of {format_age(age)} ago)_" if age else ""
+            if age and (oldest is None or age > oldest):
+                oldest = age
+
+            message += f"{emoji} **{symbol}**: ${price_str} (7d high: ${high_str}) - Down {dip:.1f}%{status}{age_str}\n"
+
+    if oldest:
+        message += f"\n⚠️ Price data is delayed; some prices are up to {format_age(oldest)} old."
+
+    # Add last updated time in user's timezone
+    user_tz = timezones.get_zone(timezone)
+    now_local = now_utc.astimezone(user_tz)
+
+    message += f"\n_Last updated: {now_local.strftime('%H:%M %Z')}_"
+    return message
     
 
+def render_digest(user_coins, timezone, now_utc=None):
+    """(message, coin_data) for a watchlist from the shared analytics snapshot; message is None without prices."""
+    coin_data = analytics.get_coin_data(user_coins) if user_coins else {}
+    if not coin_data:
+        return None, coin_data
+    return build_alert_message(user_coins, coin_data, timezone, now_utc), coin_data
+
+
+def prepare_digests(now_utc=None):
+    """Renders digests for alarms firing within digests.PREPARE_AHEAD. Returns how many were (re)rendered.
+
+    Runs only where send_daily_alerts runs, since the queue is process-local.
+    """
+    if coordination.LEADER_ELECTION and not coordination.coordinator.is_leader("daily_alerts"):
+        return 0
+    now_utc = now_utc or datetime.now(pytz.UTC)
+    digests.queue.expire(now_utc)
+    due = alarm_schedule.schedule.due_alarms(now_utc, digests.PREPARE_AHEAD)
+    if not due:
+        return 0
+
+    analytics.get_snapshot()
+    rendered = 0
+    for alarm_id, user_id, alarm_time, timezone, fire_at in due:
+        try:
+            existing = digests.queue.get(alarm_id)
+            if existing is not None and existing.sent and existing.is_for(fire_at):
+                continue
+            # Read before the watchlist, so an edit landing in between shows up as a mismatch at take()
+            watchlist_version = watchlists.cache.version(user_id)
+            if watchlist_version is None:
+                # Without the change feed edits can't be tracked; send_daily_alerts renders inline
+                continue
+            user_coins = watchlists.cache.get(user_id)
+            message, coin_data = render_digest(user_coins, timezone, now_utc)
+            if existing is not None and existing.is_for(fire_at) and existing.is_current(user_coins, coin_data) \
+                    and existing.watchlist_version == watchlist_version:
+                continue
+            if message is None:
+                continue
+            prices = {coin_id: data['current_price'] for coin_id, data in coin_data.items()}
+            digests.queue.put(alarm_id, digests.Digest(user_id, timezone, timezones.local_date(fire_at, timezone),
+                                                       fire_at, user_coins, prices, message, watchlist_version))
+            rendered += 1
+        except Exception as e:
+            logger.error(f"Failed to prepare digest for alarm {alarm_id} of user {user_id}: {e}")
+    if rendered:
+        logger.info(f"Prepared {rendered} digests for {len(due)} alarms in the next "
+                    f"{int(digests.PREPARE_AHEAD.total_seconds() // 60)} minutes.")
+    return rendered
+
+
+def _fired(alarm_id, user_id, alarm_time, timezone, weekdays, fire_at, now_utc, sent):
+    """The mark_alarms_fired row for one occurrence: next fire after it (and after now), plus the digest's local date."""
+    next_fire = timezones.next_fire(alarm_time, timezone, weekdays, max(fire_at, now_utc))
+    return (alarm_id, fire_at, next_fire, user_id, timezones.local_date(fire_at, timezone) if sent else None)
+
+
+# (alarm_id, fired_at) -> mark_alarms_fired row for occurrences sent (or skipped) but not recorded.
+# Each run records these again before anything else and never sends them a second time.
+_unmarked = {}
+
+
+async def _record_fired(rows):
+    try:
+        return await asyncio.to_thread(database.mark_alarms_fired, rows)
+    except Exception as e:
+        # Connecting failed; mark_alarms_fired logs its own errors otherwise
+        logger.error(f"Failed to record {len(rows)} fired alarms: {e}")
+        return False
+
+
+async def _mark_fired(rows):
+    """mark_alarms_fired, keeping rows it failed to record for the next run to retry."""
+    if not await _record_fired(rows):
+        _unmarked.update(((row[0], row[1]), row) for row in rows)
+
+
+async def _retry_unmarked():
+    rows = list(_unmarked.values())
+    if rows and await _record_fired(rows):
+        for row in rows:
+            _unmarked.pop((row[0], row[1]), None)
+
+
+# Set when a run leaves due alarms unsent, so the next run retries them even if no new slot is due.
+# Starts set: alarms that came due while the process was down are only found by the query.
+_retry_pending = True
+
+
 async def send_daily_alerts(context):
     """Send alerts to users whose alarm time has arrived."""
-    
+    global _retry_pending
+
     bot_instance = context.bot
     try:
-        today = datetime.now().strftime('%Y-%m-%d')
+        await _retry_unmarked()
+
+        # The in-memory schedule can rule out the due-alarm query without touching the database
+        schedule = alarm_schedule.schedule
+        if not _retry_pending and schedule.loaded and schedule.sees_all_writes \
+                and not schedule.has_due(datetime.now(pytz.UTC), ALERT_LOOKAHEAD):
+            print("No alarms due in the next few minutes.")
+            return
         
-        # This will now return a list of tuples: [(user_id, alarm_time, timezone), ...]
-        users_to_alert = await asyncio.to_thread(database.get_users_needing_alerts)
+        # [(alarm_id, user_id, alarm_time, timezone, weekdays, next_fire_utc), ...], overdue ones included
+        due_alarms = await asyncio.to_thread(database.get_due_alarms, ALERT_LOOKAHEAD)
+        _retry_pending = False
         
-        if not users_to_alert:
+        if not due_alarms:
             print("No users to alert at this time.")
             return
+
+        now_utc = datetime.now(pytz.UTC)
+        skipped, alarms_to_send = [], []
+        for alarm_id, user_id, alarm_time, timezone, weekdays, fire_at in due_alarms:
+            if (alarm_id, fire_at) in _unmarked:
+                # Already sent; only recording it failed
+                continue
+            if fire_at < now_utc - MISSED_ALARM_GRACE:
+                skipped.append(_fired(alarm_id, user_id, alarm_time, timezone, weekdays, fire_at, now_utc, False))
+            else:
+                alarms_to_send.append((alarm_id, user_id, alarm_time, timezone, weekdays, fire_at))
+        if skipped:
+            logger.warning(f"Skipping {len(skipped)} alarms missed by more than {MISSED_ALARM_GRACE}.")
+            await _mark_fired(skipped)
         
-        print(f"Checking alerts for {len(users_to_alert)} users...")
-    
-        # Unpack the tuple directly in the for loop
-        for user_id, alarm_time, timezone in users_to_alert:
+        print(f"Checking alerts for {len(alarms_to_send)} alarms...")
 
-            
+        if alert_workers.enabled():
+            await _send_alerts_sharded(bot_instance, alarms_to_send, now_utc)
+            return
+
+        for alarm_id, user_id, alarm_time, timezone, weekdays, fire_at in alarms_to_send:
             try:
-                alert_key = f"{today}_{alarm_time}_{timezone}"
-                
-                # Check if alert was already sent
-                if await asyncio.to_thread(database.was_alert_sent_for_alarm, user_id, alert_key):
-                    continue
-                
-                # Get user's watchlist
-                user_coins = await asyncio.to_thread(database.get_user_coins, user_id)
-                
-                if not user_coins:
-                    continue
-                
-                # Get current prices and dip data
-                coin_data = await asyncio.to_thread(database.get_coin_current_and_7d_high, user_coins)
-                
-                if not coin_data:
-                    continue
+                # Usually rendered ahead of time by prepare_digests; otherwise render now
+                message = digests.queue.take(alarm_id, fire_at, timezone, watchlists.cache.version(user_id))
+                if message is None:
+                    user_coins = await asyncio.to_thread(watchlists.cache.get, user_id)
+                    if not user_coins:
+                        # Nothing to send; move on to the next occurrence
+                        await _mark_fired([
+                            _fired(alarm_id, user_id, alarm_time, timezone, weekdays, fire_at, now_utc, False)
+                        ])
+                        continue
+                    message, _ = await asyncio.to_thread(render_digest, user_coins, timezone)
+                    if message is None:
+                        _retry_pending = True
+                        continue
                 
-                message = "🌅 **Daily Crypto Update**\n\n"
+                await bot_instance.send_message(chat_id=user_id, text=message + ALERT_FOOTER, parse_mode='Markdown')
                 
-                for coin_id in user_coins:
-                    if coin_id in coin_data:
-                        data = coin_data[coin_id]
-                        symbol = data['symbol']
-                        price = data['current_price']
-                        high = data['seven_day_high']
-                        dip = data['dip_percentage']
-                        
-                        price_str = format_price(price)
-                        high_str = format_price(high)
-                        
-                        if dip >= 20:
-                            emoji = "🔴"
-                            status = " - **DIP ALERT!**"
-                        elif dip >= 10:
-                            emoji = "🟡"
-                            status = ""
-                        else:
-                            emoji = "🟢"
-                            status = ""
-                        
-                        message += f"{emoji} **{symbol}**: ${price_str} (7d high: ${high_str}) - Down {dip:.1f}%{status}\n"
-
-
-                # Add last updated time in user's timezone
-                
-                user_tz_str = tz_map.get(timezone, 'UTC')
-                user_tz = pytz.timezone(user_tz_str)
-                now_local = datetime.now(pytz.UTC).astimezone(user_tz)
-                
-                message += f"\n_Last updated: {now_local.strftime('%H:%M %Z')}_"
-                
-                footer = (
-                    "\nTip: Use /donate to support the bot and keep the coffee flowing! ☕🚀"
-                )
-                
-                await bot_instance.send_message(chat_id=user_id, text=message + footer, parse_mode='Markdown')
-                
-                await asyncio.to_thread(database.mark_alert_sent_for_alarm, user_id, alert_key)
+                await _mark_fired([
+                    _fired(alarm_id, user_id, alarm_time, timezone, weekdays, fire_at, now_utc, True)
+                ])
                 print(f"Sent daily alert to user {user_id} for alarm {alarm_time} {timezone}")
                 
             except Exception as e:
-                print(f"Failed to send alert to user {user_id}: {e}")
+                kind = delivery.classify(e)
+                # Unreachable chats are pruned rather than retried every run
+                await asyncio.to_thread(database.record_delivery_errors, [(user_id, kind, str(e))])
+                if not delivery.is_permanent(kind):
+                    _retry_pending = True
+                print(f"Failed to send alert to user {user_id} ({kind}): {e}")
 
     except Exception as e:
         print(f"Error caught in send_daily_alerts: {e}")
 
+async def _send_alerts_sharded(bot_instance, alarms_to_send, now_utc):
+    """send_daily_alerts with rendering and sending split across alert_workers processes."""
+    global _retry_pending
+
+    jobs, coin_ids, alarms, empty = [], set(), {}, []
+    for alarm_id, user_id, alarm_time, timezone, weekdays, fire_at in alarms_to_send:
+        alarms[alarm_id] = (alarm_id, user_id, alarm_time, timezone, weekdays, fire_at)
+        message = digests.queue.take(alarm_id, fire_at, timezone, watchlists.cache.version(user_id))
+        user_coins = [] if message is not None else await asyncio.to_thread(watchlists.cache.get, user_id)
+        if message is None and not user_coins:
+            empty.append(_fired(alarm_id, user_id, alarm_time, timezone, weekdays, fire_at, now_utc, False))
+            continue
+        coin_ids.update(user_coins)
+        jobs.append((alarm_id, user_id, timezone, user_coins, message))
+    if empty:
+        await _mark_fired(empty)
+    coin_data = await asyncio.to_thread(analytics.get_coin_data, coin_ids) if coin_ids else {}
+
+    sent = failed = 0
+    async for results in alert_workers.fan_out(bot_instance, jobs, coin_data, ALERT_FOOTER):
+        fired = [_fired(*alarms[alarm_id], now_utc, True) for alarm_id, _, error, _ in results if error is None]
+        await _mark_fired(fired)
+        sent += len(fired)
+        errors = [(user_id, kind, error) for _, user_id, error, kind in results if error is not None]
+        await asyncio.to_thread(database.record_delivery_errors, errors)
+        for user_id, kind, error in errors:
+            failed += 1
+            if not delivery.is_permanent(kind):
+                _retry_pending = True
+            print(f"Failed to send alert to user {user_id} ({kind}): {error}")
+    print(f"Sent {sent} daily alerts across {alert_workers.WORKERS} workers ({failed} failed).")
+
+
 async def cleanup_old_data(context):
-    """Cleans up old price data in the database."""
+    """Cleans up old price data and delivery ledger rows in the database."""
     logger.info("Running database cleanup...")
-    await asyncio.to_thread(database.cleanup_old_price_data, days_to_keep=7)
+    await asyncio.to_thread(database.cleanup_old_price_data, days_to_keep=database.PRICE_RETENTION_DAYS)
+    await asyncio.to_thread(database.prune_alert_deliveries, days_to_keep=ALERT_LEDGER_RETENTION_DAYS)
     logger.info("Database cleanup complete.")
 
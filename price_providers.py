@@ -0,0 +1,199 @@
+"""
+Pluggable price sources.
+
+A provider returns the top coins in the shape gecko_api.fetch_top_coins
+does. PRICE_PROVIDERS lists the active ones, comma-separated:
+
+    coingecko               the public CoinGecko API (gecko_api)
+    http:<name>=<base url>  any CoinGecko-compatible /coins/markets endpoint
+    file:<path>             a JSON file in /coins/markets format (tests, replays)
+
+fetch_top_coins() asks providers concurrently. With PRICE_AGGREGATION=first
+each coin takes the first healthy answer; with median it takes the median
+price across every provider that answered. In first mode each poll starts
+at the next provider in rotation and fans out to PRICE_FANOUT of them, so
+every provider carries a share of the request volume. Providers with an
+open circuit are skipped, and the rest are tried before a poll gives up.
+Each coin is tagged with the provider(s) that served it.
+"""
+import itertools
+import json
+import logging
+import os
+import statistics
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import gecko_api
+from circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger("CryptoBot.PriceProviders")
+
+PRICE_PROVIDERS = os.getenv("PRICE_PROVIDERS", "coingecko")
+PRICE_AGGREGATION = os.getenv("PRICE_AGGREGATION", "first")
+PRICE_FANOUT = int(os.getenv("PRICE_FANOUT", "2"))
+# A poll never waits longer than this for slow providers
+FETCH_TIMEOUT = 30
+
+
+class PriceProvider:
+    """Base class: subclasses implement _fetch(limit) and may raise on failure."""
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+
+    def available(self):
+        return self.breaker.available()
+
+    def fetch_top_coins(self, limit=100):
+        if not self.breaker.allow():
+            return {}
+        try:
+            coin_data = self._fetch(limit)
+        except Exception as e:
+            logger.warning(f"Provider {self.name} failed: {e}")
+            self.breaker.record_failure(e)
+            return {}
+        self.breaker.record_success()
+        return coin_data
+
+    def _fetch(self, limit):
+        raise NotImplementedError
+
+
+class CoinGeckoProvider(PriceProvider):
+    """The public CoinGecko API; gecko_api owns the breaker and error handling."""
+
+    def __init__(self):
+        super().__init__("coingecko")
+        # Share gecko_api's breaker, which its own calls already trip
+        self.breaker = gecko_api.breaker
+
+    def fetch_top_coins(self, limit=100):
+        return gecko_api.fetch_top_coins(limit)
+
+
+class HttpProvider(PriceProvider):
+    """A CoinGecko-compatible /coins/markets endpoint (a mirror, a paid plan or a local stub)."""
+
+    def __init__(self, name, base_url):
+        super().__init__(name)
+        self.base_url = base_url.rstrip('/')
+
+    def _fetch(self, limit):
+        response = requests.get(
+            f"{self.base_url}/coins/markets",
+            params={'vs_currency': 'usd', 'order': 'market_cap_desc', 'per_page': limit, 'page': 1},
+            timeout=gecko_api.REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return gecko_api.parse_markets(response.json())
+
+
+class FileProvider(PriceProvider):
+    """Reads a saved /coins/markets response from disk."""
+
+    def __init__(self, path):
+        super().__init__(f"file:{os.path.basename(path)}")
+        self.path = path
+
+    def _fetch(self, limit):
+        with open(self.path) as f:
+            return gecko_api.parse_markets(json.load(f)[:limit])
+
+
+def from_spec(spec):
+    """Builds a provider from one PRICE_PROVIDERS entry."""
+    spec = spec.strip()
+    if spec == "coingecko":
+        return CoinGeckoProvider()
+    if spec.startswith("http:"):
+        name, _, url = spec[len("http:"):].partition("=")
+        if not url:
+            raise ValueError(f"Expected http:<name>=<url>, got {spec!r}")
+        return HttpProvider(name, url)
+    if spec.startswith("file:"):
+        return FileProvider(spec[len("file:"):])
+    raise ValueError(f"Unknown price provider {spec!r}")
+
+
+providers = [from_spec(spec) for spec in PRICE_PROVIDERS.split(",") if spec.strip()]
+
+_rotation = itertools.count()
+_executor = ThreadPoolExecutor(max_workers=max(len(providers), 1), thread_name_prefix="price-provider")
+
+
+def _query(batch, limit, timeout):
+    """Runs the batch concurrently; returns [(provider, coin_data)] in completion order."""
+    futures = {_executor.submit(provider.fetch_top_coins, limit): provider for provider in batch}
+    results, pending = [], set(futures)
+    deadline = time.monotonic() + timeout
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            names = ", ".join(futures[f].name for f in pending)
+            logger.warning(f"Giving up on slow providers: {names}")
+            break
+        for future in done:
+            if future.exception() is None and future.result():
+                results.append((futures[future], future.result()))
+    return results
+
+
+def _first(results):
+    coin_data = {}
+    for provider, data in results:
+        for coin_id, info in data.items():
+            if coin_id not in coin_data:
+                coin_data[coin_id] = dict(info, source=provider.name)
+    return coin_data
+
+
+def _median(results):
+    answers = {}
+    for provider, data in results:
+        for coin_id, info in data.items():
+            answers.setdefault(coin_id, []).append((provider.name, info))
+
+    coin_data = {}
+    for coin_id, quotes in answers.items():
+        timestamps = [info['last_updated'] for _, info in quotes if info.get('last_updated')]
+        coin_data[coin_id] = dict(
+            quotes[0][1],
+            current_price=statistics.median(info['current_price'] for _, info in quotes),
+            last_updated=max(timestamps) if timestamps else None,
+            source="+".join(sorted(name for name, _ in quotes)),
+        )
+    return coin_data
+
+
+def fetch_top_coins(limit=100, aggregation=None, fanout=None, timeout=FETCH_TIMEOUT):
+    """Top coins from the configured providers, each tagged with a 'source'. {} if none answered."""
+    aggregation = aggregation or PRICE_AGGREGATION
+    fanout = fanout or PRICE_FANOUT
+    if not providers:
+        return {}
+
+    start = next(_rotation) % len(providers)
+    rotated = providers[start:] + providers[:start]
+    candidates = [provider for provider in rotated if provider.available()]
+    if not candidates:
+        print("All price providers are cooling off; skipping this poll.")
+        return {}
+
+    if aggregation == "median":
+        return _median(_query(candidates, limit, timeout))
+
+    results = _query(candidates[:fanout], limit, timeout)
+    if not results and len(candidates) > fanout:
+        # The first choices failed; fall back to the remaining healthy providers
+        results = _query(candidates[fanout:], limit, timeout)
+    return _first(results)
+
+
+def status():
+    """Breaker status for every configured provider."""
+    return [provider.breaker.status() for provider in providers]
@@ -0,0 +1,384 @@
+"""
+Process-local time-series store for recent price ticks.
+
+Each coin keeps a fixed-capacity ring buffer of (timestamp, price) pairs
+backed by array('d'), sized for HISTORY_DAYS of 2-minute ticks plus a
+margin, alongside monotonic deques that answer the rolling high and low
+in amortised O(1). fetch_and_store_prices appends every ingest and
+startup warms the buffers from coin_prices, so alert rendering and bot
+commands read prices from memory instead of Postgres.
+"""
+import logging
+import threading
+from array import array
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+import database
+
+logger = logging.getLogger("CryptoBot.PriceStore")
+
+TICK_SECONDS = 120
+HISTORY_DAYS = 7
+# One spare day so a full window is always available even if ticks arrive early
+CAPACITY = (HISTORY_DAYS + 1) * 86400 // TICK_SECONDS
+WINDOW_SECONDS = HISTORY_DAYS * 86400
+# How far behind the newest tick a catch-up scan starts
+CATCH_UP_MARGIN = 30 * 60
+
+
+def to_epoch(ts):
+    """Epoch seconds for a datetime; naive values are UTC like coin_prices.timestamp."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class RingBuffer:
+    """Fixed-capacity circular buffer of (timestamp, price) in time order."""
+
+    __slots__ = ('capacity', 'times', 'prices', 'start', 'size')
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.prices = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, ts, price):
+        """Adds a tick. Ticks not newer than the last one are ignored so replays are idempotent."""
+        if self.size and ts <= self.times[(self.start + self.size - 1) % self.capacity]:
+            return False
+        if self.size < self.capacity:
+            slot = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[slot] = ts
+        self.prices[slot] = price
+        return True
+
+    def latest(self):
+        if not self.size:
+            return None
+        slot = (self.start + self.size - 1) % self.capacity
+        return self.times[slot], self.prices[slot]
+
+    def _at(self, i):
+        slot = (self.start + i) % self.capacity
+        return self.times[slot], self.prices[slot]
+
+    def price_at(self, ts):
+        """Last tick at or before ts (O(log n)), or None if the buffer starts later."""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._at(mid)[0] <= ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self._at(lo - 1) if lo else None
+
+    @classmethod
+    def from_arrays(cls, times, prices, capacity=CAPACITY):
+        """Builds a buffer holding the newest `capacity` ticks of sorted arrays."""
+        ring = cls(capacity)
+        times = np.ascontiguousarray(times[-capacity:], dtype=np.float64)
+        prices = np.ascontiguousarray(prices[-capacity:], dtype=np.float64)
+        ring.size = len(times)
+        np.frombuffer(ring.times, dtype=np.float64)[:ring.size] = times
+        np.frombuffer(ring.prices, dtype=np.float64)[:ring.size] = prices
+        return ring
+
+    def arrays(self):
+        """(times, prices) as ordered NumPy arrays."""
+        times = np.frombuffer(self.times, dtype=np.float64)
+        prices = np.frombuffer(self.prices, dtype=np.float64)
+        if self.size < self.capacity:
+            return times[:self.size].copy(), prices[:self.size].copy()
+        return np.roll(times, -self.start), np.roll(prices, -self.start)
+
+
+class MonotonicWindow:
+    """Rolling max (or min) over a time window in amortised O(1) per tick."""
+
+    __slots__ = ('window', 'sign', 'items')
+
+    def __init__(self, window=WINDOW_SECONDS, maximum=True):
+        self.window = window
+        self.sign = 1 if maximum else -1
+        self.items = deque()  # (timestamp, price), monotonic in price
+
+    def push(self, ts, price):
+        key = self.sign * price
+        while self.items and self.sign * self.items[-1][1] <= key:
+            self.items.pop()
+        self.items.append((ts, price))
+
+    @classmethod
+    def from_arrays(cls, times, prices, window=WINDOW_SECONDS, maximum=True):
+        """Rebuilds the deque for sorted arrays in one vectorised pass.
+
+        The deque holds exactly the ticks strictly above (below) every later tick.
+        """
+        monotonic = cls(window, maximum)
+        if len(prices):
+            keyed = prices if maximum else -prices
+            later_best = np.maximum.accumulate(keyed[::-1])[::-1]
+            keep = np.append(keyed[:-1] > later_best[1:], True)
+            monotonic.items.extend(zip(times[keep].tolist(), prices[keep].tolist()))
+        return monotonic
+
+    def value(self, now):
+        cutoff = now - self.window
+        while self.items and self.items[0][0] <= cutoff:
+            self.items.popleft()
+        return self.items[0][1] if self.items else None
+
+
+class CoinSeries:
+    __slots__ = ('ticks', 'high', 'low')
+
+    def __init__(self):
+        self.ticks = RingBuffer()
+        self.high = MonotonicWindow(maximum=True)
+        self.low = MonotonicWindow(maximum=False)
+
+    def append(self, ts, price):
+        if self.ticks.append(ts, price):
+            self.high.push(ts, price)
+            self.low.push(ts, price)
+
+    @classmethod
+    def from_arrays(cls, times, prices):
+        series = cls.__new__(cls)
+        series.ticks = RingBuffer.from_arrays(times, prices)
+        times, prices = series.ticks.arrays()
+        series.high = MonotonicWindow.from_arrays(times, prices, maximum=True)
+        series.low = MonotonicWindow.from_arrays(times, prices, maximum=False)
+        return series
+
+    def merged(self, times, prices):
+        """A new series holding the union of this one and the given ticks; existing ticks win."""
+        own_times, own_prices = self.ticks.arrays()
+        all_times = np.concatenate((own_times, times))
+        all_prices = np.concatenate((own_prices, prices))
+        all_times, first = np.unique(all_times, return_index=True)
+        return CoinSeries.from_arrays(all_times, all_prices[first])
+
+
+class PriceStore:
+    """Recent ticks and coin metadata for every coin the process has seen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.series = {}
+        self.coins = {}  # coin_id -> {'symbol': ..., 'name': ..., 'rank': market-cap rank once ingested}
+        self.warm = False
+        self.version = 0
+        # Bumped only when coin metadata changes, so indexes over it rebuild rarely
+        self.coins_version = 0
+
+    # --- Writes ---
+    def _update_coins(self, coins):
+        """Merges {coin_id: metadata} into self.coins. Caller holds the lock."""
+        changed = False
+        for coin_id, meta in coins.items():
+            current = self.coins.get(coin_id)
+            merged = {**current, **meta} if current else dict(meta)
+            if merged != current:
+                self.coins[coin_id] = merged
+                changed = True
+        if changed:
+            self.coins_version += 1
+
+    def update_coins(self, coins):
+        with self._lock:
+            self._update_coins(coins)
+
+    def append(self, coin_id, ts, price):
+        with self._lock:
+            series = self.series.get(coin_id)
+            if series is None:
+                series = self.series[coin_id] = CoinSeries()
+            series.append(ts, price)
+
+    def ingest(self, coin_data, ts):
+        """Applies one fetch_top_coins batch fetched at ts (datetime or epoch seconds).
+
+        Each coin is stamped with its source 'last_updated' when present, so unchanged
+        observations are dropped by the ring buffer like they are by coin_prices.
+        """
+        fetched_at = ts if isinstance(ts, (int, float)) else to_epoch(ts)
+        with self._lock:
+            for coin_id, data in coin_data.items():
+                series = self.series.get(coin_id)
+                if series is None:
+                    series = self.series[coin_id] = CoinSeries()
+                source_time = data.get('last_updated')
+                series.append(to_epoch(source_time) if source_time else fetched_at, data['current_price'])
+            # Batches arrive in market-cap order, which gives search results their ranking
+            self._update_coins({
+                coin_id: {'symbol': data['symbol'], 'name': data['name'], 'rank': rank}
+                for rank, (coin_id, data) in enumerate(coin_data.items(), start=1)
+            })
+            self.version += 1
+
+    def apply_ticks(self, ticks):
+        """Appends [(coin_id, epoch seconds, price)] published by another process."""
+        with self._lock:
+            for coin_id, ts, price in ticks:
+                series = self.series.get(coin_id)
+                if series is None:
+                    series = self.series[coin_id] = CoinSeries()
+                series.append(ts, price)
+            self.version += 1
+
+    def warm_from_db(self, days=HISTORY_DAYS):
+        """Loads the last `days` of coin_prices and the coin mapping. Safe to call on a running store."""
+        # Ticks committed while a replica catches up arrive through the change feed or catch_up_from_db
+        conn = database.get_read_connection(max_staleness=60)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT coin_id, symbol, name FROM coin_mapping;")
+                coins = {coin_id: {'symbol': symbol, 'name': name} for coin_id, symbol, name in cur.fetchall()}
+                cur.execute(
+                    """
+                    SELECT coin_id, EXTRACT(EPOCH FROM timestamp)::float8, price FROM coin_prices
+                    WHERE timestamp > NOW() - INTERVAL '%s days'
+                    ORDER BY timestamp;
+                    """,
+                    (days,)
+                )
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+
+        grouped = {}
+        for coin_id, ts, price in rows:
+            grouped.setdefault(coin_id, ([], []))
+            grouped[coin_id][0].append(ts)
+            grouped[coin_id][1].append(price)
+
+        with self._lock:
+            self._update_coins(coins)
+            for coin_id, (times, prices) in grouped.items():
+                self._merge(coin_id, np.array(times), np.array(prices))
+            self.warm = True
+            self.version += 1
+        logger.info(f"Warmed price store with {len(rows)} ticks for {len(self.series)} coins.")
+
+    def catch_up_from_db(self, margin=CATCH_UP_MARGIN):
+        """Appends ticks another process stored since our newest one. Returns the number of rows read.
+
+        Source timestamps lag the wall clock by different amounts per coin, so the
+        scan starts `margin` seconds before the newest tick; appends are idempotent.
+        """
+        newest = max((series.ticks.latest()[0] for series in list(self.series.values()) if len(series.ticks)),
+                     default=None)
+        if newest is None:
+            self.warm_from_db()
+            return 0
+
+        conn = database.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT coin_id, symbol, name FROM coin_mapping;")
+                coins = {coin_id: {'symbol': symbol, 'name': name} for coin_id, symbol, name in cur.fetchall()}
+                cur.execute(
+                    """
+                    SELECT coin_id, EXTRACT(EPOCH FROM timestamp)::float8, price FROM coin_prices
+                    WHERE timestamp > (to_timestamp(%s) AT TIME ZONE 'UTC')
+                    ORDER BY timestamp;
+                    """,
+                    (newest - margin,)
+                )
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._update_coins(coins)
+        self.apply_ticks(rows)
+        return len(rows)
+
+    def _merge(self, coin_id, times, prices):
+        # Ticks may predate what ingest already appended (e.g. reconciling after a restart)
+        series = self.series.get(coin_id)
+        if series is None:
+            self.series[coin_id] = CoinSeries.from_arrays(times, prices)
+        else:
+            self.series[coin_id] = series.merged(times, prices)
+
+    def restore(self, coins, series_arrays):
+        """Loads snapshot state: coin metadata and {coin_id: (times, prices)} sorted arrays."""
+        with self._lock:
+            self._update_coins(coins)
+            for coin_id, (times, prices) in series_arrays.items():
+                self._merge(coin_id, times, prices)
+            self.warm = True
+            self.version += 1
+
+    # --- Reads ---
+    def has_coin(self, coin_id):
+        return coin_id in self.coins
+
+    def latest(self, coin_id):
+        """(epoch seconds, price) of the newest tick, or None."""
+        series = self.series.get(coin_id)
+        return series.ticks.latest() if series else None
+
+    def rolling_high(self, coin_id, now=None):
+        series = self.series.get(coin_id)
+        if series is None:
+            return None
+        with self._lock:
+            return series.high.value(now or datetime.now(timezone.utc).timestamp())
+
+    def rolling_low(self, coin_id, now=None):
+        series = self.series.get(coin_id)
+        if series is None:
+            return None
+        with self._lock:
+            return series.low.value(now or datetime.now(timezone.utc).timestamp())
+
+    def price_at(self, coin_id, ts):
+        series = self.series.get(coin_id)
+        return series.ticks.price_at(ts) if series else None
+
+    def history(self, coin_id):
+        """(times, prices) NumPy arrays for one coin."""
+        series = self.series.get(coin_id)
+        if series is None:
+            return np.empty(0), np.empty(0)
+        with self._lock:
+            return series.ticks.arrays()
+
+    def coin_data(self, coin_ids, now=None):
+        """Current price, 7-day high, dip and tick time in the shape analytics.get_coin_data returns."""
+        now = now or datetime.now(timezone.utc).timestamp()
+        coin_data = {}
+        for coin_id in coin_ids:
+            latest = self.latest(coin_id)
+            high = self.rolling_high(coin_id, now)
+            if latest is None or high is None:
+                continue
+            current_price = latest[1]
+            coin_data[coin_id] = {
+                'current_price': current_price,
+                'seven_day_high': high,
+                'dip_percentage': ((high - current_price) / high) * 100,
+                'symbol': self.coins.get(coin_id, {}).get('symbol', coin_id.upper()),
+                'updated_at': latest[0],
+            }
+        return coin_data
+
+
+store = PriceStore()
@@ -0,0 +1,200 @@
+"""
+On-demand profiling of jobs and bot commands.
+
+A target is armed for its next N runs, from the PROFILE_TARGETS env var
+("fetch_prices,daily_alerts:5,/add") or the admin /profile command, and
+each of those runs writes a profile to PROFILE_DIR. Targets use the names
+already used for query scopes: a job name such as fetch_prices or
+daily_alerts, or a command such as /add. A job's function name
+(fetch_and_store_prices, send_daily_alerts) works too, and "all" matches
+everything.
+
+Two modes:
+  sample   - a thread reads every thread's stack with sys._current_frames()
+             every SAMPLE_INTERVAL and writes collapsed stacks
+             ("thread;frame;frame count", for flamegraph.pl or speedscope).
+             Cheap, and it also sees work handed to asyncio.to_thread.
+  cprofile - deterministic cProfile of the event-loop thread, written as
+             a .pstats file. Exact call counts, but slower and blind to
+             worker threads; only one such run is active at a time.
+
+Both see whatever else the event loop runs while the target is awaiting.
+A disarmed profiler costs one dict check per run.
+"""
+import collections
+import contextlib
+import cProfile
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("CryptoBot.Profiling")
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "logs")
+MODES = ("sample", "cprofile")
+DEFAULT_MODE = os.getenv("PROFILE_MODE", "sample")
+# Runs profiled per target armed through PROFILE_TARGETS without an explicit count
+DEFAULT_RUNS = int(os.getenv("PROFILE_RUNS", "3"))
+MAX_RUNS = 50
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # seconds
+ALL = "all"
+
+
+class _Sampler(threading.Thread):
+    """Counts collapsed stacks of every other thread until stop() is called."""
+
+    def __init__(self, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profiler:
+    """Targets armed for profiling, each with the runs it has left and its mode."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.armed = {}  # target -> [runs_left, mode]
+        self._cprofile_busy = False
+
+    def arm(self, target, runs=DEFAULT_RUNS, mode=DEFAULT_MODE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}'")
+        runs = max(1, min(runs, MAX_RUNS))
+        with self._lock:
+            self.armed[target] = [runs, mode]
+        logger.info(f"Profiling armed for {target}: next {runs} runs ({mode})")
+
+    def arm_from_spec(self, spec):
+        """Arms 'target[:runs]' entries from a comma-separated list."""
+        for entry in filter(None, (part.strip() for part in spec.split(","))):
+            target, _, runs = entry.partition(":")
+            try:
+                self.arm(target, int(runs) if runs else DEFAULT_RUNS)
+            except ValueError as e:
+                logger.warning(f"Ignoring profiling target '{entry}': {e}")
+
+    def disarm(self, target=None):
+        """Disarms one target, or all of them. Returns how many were armed."""
+        with self._lock:
+            if target is None:
+                count = len(self.armed)
+                self.armed.clear()
+                return count
+            return 1 if self.armed.pop(target, None) else 0
+
+    def status(self):
+        """{target: (runs_left, mode)}"""
+        with self._lock:
+            return {target: tuple(entry) for target, entry in self.armed.items()}
+
+    def _claim(self, names):
+        """Takes one run from the first armed target among names. Returns (target, mode, runs_left) or None."""
+        with self._lock:
+            for target in (*names, ALL):
+                entry = self.armed.get(target)
+                if entry is None:
+                    continue
+                runs_left, mode = entry
+                if mode == "cprofile":
+                    if self._cprofile_busy:
+                        # Another run owns the thread's profile hook; leave this run for later
+                        return None
+                    self._cprofile_busy = True
+                if runs_left <= 1:
+                    del self.armed[target]
+                else:
+                    entry[0] = runs_left - 1
+                return target, mode, runs_left - 1
+        return None
+
+    @contextlib.contextmanager
+    def profile(self, name, *aliases):
+        """Profiles the block if name (or an alias) is armed; otherwise does nothing."""
+        claim = self._claim((name, *aliases)) if self.armed else None
+        if claim is None:
+            yield
+            return
+
+        target, mode, runs_left = claim
+        started = time.perf_counter()
+        if mode == "cprofile":
+            collector = cProfile.Profile()
+            collector.enable()
+        else:
+            collector = _Sampler(SAMPLE_INTERVAL)
+            collector.start()
+        try:
+            yield
+        finally:
+            if mode == "cprofile":
+                collector.disable()
+                with self._lock:
+                    self._cprofile_busy = False
+            else:
+                collector.stop()
+            elapsed = time.perf_counter() - started
+            try:
+                path = _write(name, mode, collector)
+                logger.info(
+                    f"Profiled {name} ({mode}) in {elapsed:.2f}s -> {path}; {runs_left} runs of {target} left"
+                )
+            except OSError as e:
+                logger.error(f"Failed to write profile of {name}: {e}")
+
+
+def _write(name, mode, collector):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = re.sub(r"[^\w-]+", "_", name).strip("_") or "profile"
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    if mode == "cprofile":
+        path = os.path.join(PROFILE_DIR, f"profile-{stem}-{stamp}.pstats")
+        collector.dump_stats(path)
+        return path
+    path = os.path.join(PROFILE_DIR, f"profile-{stem}-{stamp}.collapsed")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in collector.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def profiled(name):
+    """Decorator running an async handler or job inside profiler.profile(name)."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with profiler.profile(name, func.__name__):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+profiler = Profiler()
+profiler.arm_from_spec(os.getenv("PROFILE_TARGETS", ""))
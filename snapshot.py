@@ -0,0 +1,144 @@
+"""
+Binary snapshot of in-process state for fast warm restarts.
+
+One file: an 8-byte magic, an 8-byte header length, a small JSON header
+(coin metadata, array offsets, rate-limit state) and then raw
+little-endian arrays aligned to 8 bytes, which load() maps with
+np.memmap instead of parsing. It holds the price store's ring buffers,
+the coin mapping, the alarm schedule and the per-user command cooldowns.
+
+The file is written to a temp path and renamed into place, so a crash
+mid-write leaves the previous snapshot intact.
+"""
+import json
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+
+import alarm_schedule
+import price_store
+
+logger = logging.getLogger("CryptoBot.Snapshot")
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join("state", "cryptobot.snap"))
+MAGIC = b"CDBSNAP1"
+FORMAT_VERSION = 2
+ALARM_DTYPE = np.dtype([('alarm_id', '<i8'), ('user_id', '<i8'), ('minute', '<i2'), ('weekdays', '<i2'), ('tz', '<i2')])
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def save(path=SNAPSHOT_PATH, rate_limits=None):
+    """Checkpoints the price store, alarm schedule and rate-limit state to `path`."""
+    started = time.perf_counter()
+    store = price_store.store
+
+    coins, times_parts, prices_parts = [], [], []
+    offset = 0
+    for coin_id in list(store.series):
+        times, prices = store.history(coin_id)
+        meta = store.coins.get(coin_id, {})
+        coins.append([coin_id, meta.get('symbol'), meta.get('name'), offset, len(times)])
+        times_parts.append(times)
+        prices_parts.append(prices)
+        offset += len(times)
+    for coin_id, meta in list(store.coins.items()):
+        if coin_id not in store.series:
+            coins.append([coin_id, meta.get('symbol'), meta.get('name'), offset, 0])
+
+    ticks = np.vstack((
+        np.concatenate(times_parts) if times_parts else np.empty(0),
+        np.concatenate(prices_parts) if prices_parts else np.empty(0),
+    )).astype('<f8')
+
+    alarm_ids, user_ids, minutes, weekdays, tz_indexes, tz_names = alarm_schedule.schedule.to_records()
+    alarms = np.empty(len(alarm_ids), dtype=ALARM_DTYPE)
+    alarms['alarm_id'], alarms['user_id'], alarms['minute'] = alarm_ids, user_ids, minutes
+    alarms['weekdays'], alarms['tz'] = weekdays, tz_indexes
+
+    blocks = [('ticks', ticks), ('alarms', alarms)]
+    arrays, data_offset = {}, 0
+    for name, block in blocks:
+        arrays[name] = {'offset': data_offset, 'shape': list(block.shape), 'count': int(block.size)}
+        data_offset = _align(data_offset + block.nbytes)
+
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'saved_at': time.time(),
+        'coins': coins,
+        'alarm_timezones': tz_names,
+        'alarms_loaded': alarm_schedule.schedule.loaded,
+        'rate_limits': {str(user_id): ts for user_id, ts in (rate_limits or {}).items()},
+        'arrays': arrays,
+    }).encode()
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(b"\0" * (_align(16 + len(header)) - 16 - len(header)))
+        for name, block in blocks:
+            f.write(block.tobytes())
+            f.write(b"\0" * (_align(block.nbytes) - block.nbytes))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info(
+        f"Saved snapshot: {ticks.shape[1]} ticks, {len(coins)} coins, {len(alarms)} alarms "
+        f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+
+
+def _map(path, data_start, spec, dtype):
+    if not spec['count']:
+        return np.empty(spec['shape'], dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=data_start + spec['offset'], shape=tuple(spec['shape']))
+
+
+def load(path=SNAPSHOT_PATH):
+    """Restores state from `path`. Returns the saved rate limits ({user_id: epoch}) or None if absent/invalid."""
+    if not os.path.exists(path):
+        return None
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) != MAGIC:
+                raise ValueError("bad magic")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len))
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"unsupported version {header['version']}")
+
+        data_start = _align(16 + header_len)
+        ticks = _map(path, data_start, header['arrays']['ticks'], '<f8')
+        alarms = _map(path, data_start, header['arrays']['alarms'], ALARM_DTYPE)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+    coins, series_arrays = {}, {}
+    for coin_id, symbol, name, offset, count in header['coins']:
+        coins[coin_id] = {'symbol': symbol, 'name': name}
+        if count:
+            series_arrays[coin_id] = (ticks[0, offset:offset + count], ticks[1, offset:offset + count])
+    price_store.store.restore(coins, series_arrays)
+
+    if header['alarms_loaded']:
+        alarm_schedule.schedule.load_records(
+            alarms['alarm_id'], alarms['user_id'], alarms['minute'], alarms['weekdays'], alarms['tz'],
+            header['alarm_timezones']
+        )
+
+    logger.info(
+        f"Loaded snapshot from {time.time() - header['saved_at']:.0f}s ago: "
+        f"{ticks.shape[1]} ticks, {len(coins)} coins, {len(alarms)} alarms "
+        f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+    return {int(user_id): ts for user_id, ts in header['rate_limits'].items()}
@@ -0,0 +1,98 @@
+"""
+Boot timing for main.py.
+
+main.py imports this module first, so the clock includes every import.
+Each step of boot is recorded as a phase. Steps that don't depend on
+each other run at the same time: the schema check runs in a thread while
+PTB's initialize() calls getMe, and the change feed, snapshot load and
+cold-start reads overlap. Phases can therefore sum to more than the wall
+time.
+
+Once the bot can answer, ready() logs the breakdown in one line. The
+first update answered after a restart is logged with its time since
+boot, which is the time-to-first-response a restart actually costs.
+"""
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("CryptoBot.Startup")
+
+
+class StartupTimer:
+    """(phase, seconds) for each step of boot, measured from when this module was imported."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._last_mark = self.started
+        self.phases = []
+        self.ready_after = None
+        self.first_response_after = None
+
+    def since_boot(self):
+        return time.perf_counter() - self.started
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+        if self.ready_after is not None:
+            logger.info(f"Startup phase {name} took {seconds:.2f}s (finished after the bot was ready)")
+
+    def mark(self, name):
+        """Records the time since the previous mark (or boot) as a phase of its own."""
+        now = time.perf_counter()
+        with self._lock:
+            seconds, self._last_mark = now - self._last_mark, now
+        self.record(name, seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    async def run(self, name, func, *args):
+        """Runs a blocking func in a thread as a timed phase; returns its result."""
+        with self.phase(name):
+            return await asyncio.to_thread(func, *args)
+
+    def in_background(self, name, func, *args):
+        """Starts func in a thread right away as a timed phase. Await it with asyncio.wrap_future."""
+        return _executor().submit(self._timed, name, func, *args)
+
+    def _timed(self, name, func, *args):
+        with self.phase(name):
+            return func(*args)
+
+    def ready(self):
+        """Logs the breakdown once the bot can start answering."""
+        self.ready_after = self.since_boot()
+        with self._lock:
+            phases = list(self.phases)
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in phases)
+        logger.info(f"Ready to answer {self.ready_after:.2f}s after boot ({breakdown})")
+
+    async def first_response(self, update, context):
+        """Handler for the last group: by the time it runs, the first update has been answered."""
+        if self.first_response_after is None:
+            self.first_response_after = self.since_boot()
+            logger.info(f"First update answered {self.first_response_after:.2f}s after boot")
+
+
+_pool = None
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    return _pool
+
+
+timer = StartupTimer()
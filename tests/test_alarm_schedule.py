@@ -0,0 +1,90 @@
+"""Alarm fire times across zones and DST, and the in-memory due check in front of the due-alarm query."""
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import alarm_schedule
+import price_collector
+import timezones
+
+BERLIN = "Europe/Berlin"
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_next_fire_later_today_then_tomorrow():
+    assert timezones.next_fire(time(9, 0), "UTC", timezones.EVERY_DAY, _utc(2026, 1, 5, 8)) == _utc(2026, 1, 5, 9)
+    assert timezones.next_fire(time(9, 0), "UTC", timezones.EVERY_DAY, _utc(2026, 1, 5, 9)) == _utc(2026, 1, 6, 9)
+
+
+def test_next_fire_skips_days_outside_the_mask():
+    # Friday 10:00 EST has passed; the next weekday is Monday
+    fire_at = timezones.next_fire(time(9, 0), "EST", timezones.WEEKDAYS, _utc(2026, 1, 2, 15))
+    assert fire_at == _utc(2026, 1, 5, 14)
+    assert timezones.local_date(fire_at, "EST").weekday() == 0
+
+
+def test_next_fire_in_the_spring_forward_gap_fires_once_that_day():
+    # 02:30 doesn't exist in Berlin on 2026-03-29; it fires an hour into summer time (03:30 CEST)
+    fire_at = timezones.next_fire(time(2, 30), BERLIN, timezones.EVERY_DAY, _utc(2026, 3, 28, 12))
+    assert fire_at == _utc(2026, 3, 29, 1, 30)
+    assert timezones.next_fire(time(2, 30), BERLIN, timezones.EVERY_DAY, fire_at) == _utc(2026, 3, 30, 0, 30)
+
+
+def test_next_fire_in_the_fall_back_fold_fires_only_the_first_occurrence():
+    # 02:30 happens twice in Berlin on 2026-10-25; the second one must not fire again
+    fire_at = timezones.next_fire(time(2, 30), BERLIN, timezones.EVERY_DAY, _utc(2026, 10, 24, 12))
+    assert fire_at == _utc(2026, 10, 25, 0, 30)
+    assert timezones.next_fire(time(2, 30), BERLIN, timezones.EVERY_DAY, fire_at) == _utc(2026, 10, 26, 1, 30)
+
+
+def test_parse_weekdays():
+    assert timezones.parse_weekdays("mon-fri") == timezones.WEEKDAYS
+    assert timezones.parse_weekdays("sat,sun") == timezones.WEEKENDS
+    assert timezones.parse_weekdays("fri-mon") == 0b1110001
+    assert timezones.parse_weekdays("someday") is None
+
+
+def _schedule(*alarms):
+    schedule = alarm_schedule.AlarmSchedule()
+    schedule.replace_all(alarms)
+    return schedule
+
+
+def test_has_due_only_within_the_horizon():
+    schedule = _schedule((1, 7, time(9, 0), BERLIN, timezones.EVERY_DAY), (2, 8, time(9, 0), "UTC", timezones.EVERY_DAY))
+    now = _utc(2026, 1, 5, 7, 57)
+    assert schedule.has_due(now, timedelta(minutes=5))
+    assert [alarm[0] for alarm in schedule.due_alarms(now, timedelta(minutes=5))] == [1]
+    assert not schedule.has_due(_utc(2026, 1, 5, 8, 1), timedelta(minutes=5))
+
+
+def test_unknown_zone_defers_to_the_database():
+    assert _schedule((1, 7, time(9, 0), "Mars/Olympus", timezones.EVERY_DAY)).has_due(_utc(2026, 1, 5), timedelta(0))
+
+
+@pytest.fixture
+def due_queries(monkeypatch):
+    """Runs send_daily_alerts against a schedule with nothing due soon; returns how often the database was asked."""
+    now = datetime.now(timezone.utc)
+    far = (now + timedelta(hours=6)).time().replace(second=0, microsecond=0)
+    monkeypatch.setattr(alarm_schedule, "schedule", _schedule((1, 7, far, "UTC", timezones.EVERY_DAY)))
+    monkeypatch.setattr(price_collector, "_retry_pending", price_collector._retry_pending)
+    calls = []
+    monkeypatch.setattr(price_collector.database, "get_due_alarms", lambda lookahead: calls.append(lookahead) or [])
+
+    def run():
+        asyncio.run(price_collector.send_daily_alerts(SimpleNamespace(bot=None)))
+        return len(calls)
+    return run
+
+
+def test_first_run_after_boot_queries_for_overdue_alarms(due_queries):
+    # An alarm missed during a deploy is overdue, so no slot of the schedule is about to fire for it
+    assert due_queries() == 1
+    # From then on the schedule rules the query out
+    assert due_queries() == 1
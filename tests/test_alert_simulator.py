@@ -0,0 +1,45 @@
+"""The simulator's rolling high and replay over coins that stop ticking."""
+from datetime import datetime, time, timedelta, timezone
+
+import alert_simulator
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+WINDOW = timedelta(hours=6)
+
+
+def _series(*ticks):
+    series = alert_simulator._CoinSeries()
+    for hours, price in ticks:
+        series.times.append(START + timedelta(hours=hours))
+        series.prices.append(price)
+    return series
+
+
+def test_high_is_the_max_within_the_window():
+    series = _series((0, 100.0), (1, 120.0), (2, 90.0), (8, 80.0))
+    series.advance(START + timedelta(hours=2), WINDOW)
+    assert (series.current, series.high()) == (90.0, 120.0)
+    # The 120 tick has left the window; 90 is still inside it
+    series.advance(START + timedelta(hours=7, minutes=30), WINDOW)
+    assert (series.current, series.high()) == (90.0, 90.0)
+    series.advance(START + timedelta(hours=8), WINDOW)
+    assert (series.current, series.high()) == (80.0, 80.0)
+
+
+def test_coin_that_stops_ticking_drops_out_of_the_replay():
+    simulator = alert_simulator.AlertSimulator(START, START + timedelta(hours=12), high_window=WINDOW)
+    simulator.series = {
+        "bitcoin": _series(*((h, 100.0 - h) for h in range(13))),
+        # Leaves the top 100 after two hours; its last tick ages out of the window at hour 8
+        "delisted": _series((0, 10.0), (1, 12.0), (2, 5.0)),
+    }
+    simulator.symbols = {"bitcoin": "BTC", "delisted": "DLST"}
+    simulator.alarms = [(1, 7, time(9, 0), "UTC", 127)]
+    simulator.watchlists = {7: ["bitcoin", "delisted"]}
+
+    alerts, dip_triggers = simulator.run()
+
+    assert [t["coin_id"] for t in dip_triggers] == ["delisted"]
+    assert simulator.series["delisted"].current is None
+    assert len(alerts) == 1
+    assert "DLST" not in alerts[0]["message"] and "BTC" in alerts[0]["message"]
@@ -0,0 +1,46 @@
+"""Indicators computed over the wide price frame."""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+
+TWO_DAYS = pd.date_range("2026-01-01", periods=2 * 720, freq="2min")
+
+
+@pytest.fixture
+def indicators():
+    falling = pd.Series(np.linspace(100, 80, len(TWO_DAYS)), index=TWO_DAYS)
+    # Listed two hours before the end: no price for most of the frame
+    listed = pd.Series(np.nan, index=TWO_DAYS)
+    listed.iloc[-60:] = 10.0
+    listed.iloc[-1] = 12.0
+    # Falls all along, then jumps on the last tick
+    reversal = falling.copy()
+    reversal.iloc[-1] = 1000.0
+    return analytics.compute_indicators(pd.DataFrame({"bitcoin": falling, "newcoin": listed, "reversal": reversal}))
+
+
+def test_dip_from_the_window_high(indicators):
+    assert indicators.loc["bitcoin", "seven_day_high"] == pytest.approx(100.0)
+    assert indicators.loc["bitcoin", "dip_percentage"] == pytest.approx(20.0)
+    assert indicators.loc["bitcoin", "max_drawdown"] == pytest.approx(-20.0)
+
+
+def test_returns_are_per_coin(indicators):
+    # A coin without a price an hour ago must not shift the other coins' lookback
+    assert indicators.loc["bitcoin", "return_1h"] == pytest.approx((80 / (80 + 20 * 30 / 1439) - 1) * 100)
+    assert indicators.loc["newcoin", "return_1h"] == pytest.approx(20.0)
+    assert math.isnan(indicators.loc["newcoin", "return_24h"])
+    assert indicators.loc["bitcoin", "return_24h"] == pytest.approx((80 / (80 + 20 * 720 / 1439) - 1) * 100)
+
+
+def test_moving_average_crossover(indicators):
+    assert indicators.loc["bitcoin", "ma_cross"] == "below"
+    assert indicators.loc["reversal", "ma_cross"] == "golden_cross"
+
+
+def test_empty_history():
+    assert analytics.compute_indicators(pd.DataFrame()).empty
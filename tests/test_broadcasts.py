@@ -0,0 +1,100 @@
+"""Broadcast paging and checkpoints: a resumed broadcast never re-sends a finished batch."""
+import asyncio
+
+import pytest
+from telegram.error import Forbidden
+
+import broadcasts
+
+USERS = list(range(1, 11))
+CREATOR = 99
+
+
+class FakeBot:
+    def __init__(self, blocked=(), crash_on=None):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.crash_on = crash_on
+
+    async def send_message(self, chat_id, text):
+        if chat_id == self.crash_on:
+            self.crash_on = None
+            raise RuntimeError("process killed")
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+class FakeTable:
+    """The broadcasts row: checkpoint, counters and status."""
+
+    def __init__(self):
+        self.last_user_id = 0
+        self.totals = [0, 0, 0]
+        self.status = "running"
+        self.checkpoints = []
+
+    def checkpoint(self, broadcast_id, last_user_id, sent, failed, blocked, done=False):
+        if self.status != "running":
+            return None
+        self.checkpoints.append(last_user_id)
+        self.last_user_id = max(self.last_user_id, last_user_id)
+        self.totals = [a + b for a, b in zip(self.totals, (sent, failed, blocked))]
+        if done:
+            self.status = "done"
+        return tuple(self.totals)
+
+    def claim(self):
+        return 1, "hello", "all", self.last_user_id, CREATOR
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeTable()
+    errors = []
+    monkeypatch.setattr(broadcasts, "BATCH_SIZE", 3)
+    monkeypatch.setattr(broadcasts, "SEND_RATE", 1e6)
+    monkeypatch.setattr(broadcasts, "_next_batch",
+                        lambda segment, after: [u for u in USERS if u > after][:broadcasts.BATCH_SIZE])
+    monkeypatch.setattr(broadcasts, "_checkpoint", table.checkpoint)
+    monkeypatch.setattr(broadcasts.database, "record_delivery_errors", errors.extend)
+    table.errors = errors
+    return table
+
+
+def _run(bot, table):
+    asyncio.run(broadcasts._run(bot, table.claim()))
+
+
+def test_checkpoints_after_every_batch_and_reports_totals(table):
+    bot = FakeBot(blocked={5})
+    _run(bot, table)
+    assert table.checkpoints == [3, 6, 9, 10, 0]
+    assert table.status == "done" and table.totals == [9, 0, 1]
+    assert [user_id for user_id, kind, _ in table.errors] == [5] and table.errors[0][1] == "blocked"
+    assert bot.sent == [u for u in USERS if u != 5] + [CREATOR]
+
+
+def test_resume_after_a_crash_skips_finished_batches(table):
+    bot = FakeBot(crash_on=5)
+    with pytest.raises(RuntimeError):
+        _run(bot, table)
+    assert table.last_user_id == 3
+    _run(bot, table)
+    recipients = [u for u in bot.sent if u != CREATOR]
+    # Only the unfinished batch (4-6) can be sent twice, never users 1-3
+    assert sorted(set(recipients)) == USERS
+    assert all(recipients.count(u) == 1 for u in (1, 2, 3, 7, 8, 9, 10))
+
+
+def test_cancel_stops_after_the_current_batch(table):
+    class CancellingBot(FakeBot):
+        async def send_message(self, chat_id, text):
+            # /broadcast cancel arrives while the first batch is going out
+            table.status = "cancelled"
+            await super().send_message(chat_id, text)
+
+    bot = CancellingBot()
+    _run(bot, table)
+    assert bot.sent == [1, 2, 3]
+    assert table.checkpoints == []
@@ -0,0 +1,70 @@
+"""Circuit breaker state transitions, on a fake monotonic clock."""
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return circuit_breaker.CircuitBreaker("test", failure_threshold=3, cooldown=60, max_cooldown=200)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure("boom")
+    breaker.record_failure("boom")
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure("boom")
+    assert breaker.state == OPEN
+    assert not breaker.allow() and not breaker.available()
+    assert breaker.status()["retry_in"] == 60
+
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_a_single_trial_through(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 60
+    # available() only peeks; allow() claims the trial
+    assert breaker.available() and breaker.available()
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.cooldown == 60 and breaker.allow()
+
+
+def test_failed_trial_doubles_the_cooldown_up_to_the_cap(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    for expected in (120, 200, 200):
+        clock[0] += breaker.cooldown
+        assert breaker.allow()
+        breaker.record_failure("still down")
+        assert (breaker.state, breaker.cooldown) == (OPEN, expected)
+    assert breaker.status()["last_error"] == "still down"
+
+
+def test_retry_after_opens_at_once_within_bounds(breaker):
+    breaker.record_failure("429", retry_after=90)
+    assert (breaker.state, breaker.cooldown) == (OPEN, 90)
+    breaker.record_success()
+    breaker.record_failure("429", retry_after=5)
+    assert breaker.cooldown == 60
+    breaker.record_success()
+    breaker.record_failure("429", retry_after=3600)
+    assert breaker.cooldown == 200
@@ -0,0 +1,63 @@
+"""Inline coin search ranking, index rebuilds and the result cache."""
+import pytest
+
+import coin_search
+import price_store
+
+COINS = {
+    "bitcoin": {"symbol": "btc", "name": "Bitcoin", "rank": 1},
+    "ethereum": {"symbol": "eth", "name": "Ethereum", "rank": 2},
+    "bitcoin-cash": {"symbol": "bch", "name": "Bitcoin Cash", "rank": 15},
+    "wrapped-bitcoin": {"symbol": "wbtc", "name": "Wrapped Bitcoin", "rank": 12},
+    "btc-2x": {"symbol": "btc2x", "name": "Bitcoin 2x", "rank": 900},
+}
+
+
+@pytest.fixture
+def index():
+    store = price_store.PriceStore()
+    store.update_coins(COINS)
+    return coin_search.CoinIndex(store)
+
+
+def test_exact_symbol_then_prefixes_then_words(index):
+    assert index.search("btc") == ["bitcoin", "btc-2x"]
+    # Exact name beats name prefixes; market-cap rank breaks ties
+    assert index.search("Bitcoin") == ["bitcoin", "bitcoin-cash", "btc-2x", "wrapped-bitcoin"]
+    assert index.search("$ETH ") == ["ethereum"]
+    assert index.search("cash") == ["bitcoin-cash"]
+    assert index.search("doge") == []
+
+
+def test_empty_query_lists_by_rank(index):
+    assert index.search("", limit=3) == ["bitcoin", "ethereum", "wrapped-bitcoin"]
+
+
+def test_queries_longer_than_the_indexed_prefix_are_filtered(index):
+    assert index.search("wrapped bitco") == ["wrapped-bitcoin"]
+    assert index.search("wrapped bitcoins") == []
+
+
+def test_index_rebuilds_when_coin_metadata_changes(index):
+    assert index.search("sol") == []
+    index.store.update_coins({"solana": {"symbol": "sol", "name": "Solana", "rank": 5}})
+    assert index.search("sol") == ["solana"]
+    # Unchanged metadata doesn't trigger a rebuild
+    version = index.version
+    index.store.update_coins({"solana": {"symbol": "sol", "name": "Solana", "rank": 5}})
+    index.search("sol")
+    assert index.version == version
+
+
+def test_result_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(coin_search.time, "monotonic", lambda: now[0])
+    cache = coin_search.ResultCache(ttl=10, maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # "b" was least recently used
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    now[0] += 11
+    assert cache.get("a") is None
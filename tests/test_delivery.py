@@ -0,0 +1,25 @@
+"""Which send errors mark a chat unreachable."""
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+import delivery
+
+
+@pytest.mark.parametrize("error, kind", [
+    (Forbidden("Forbidden: bot was blocked by the user"), delivery.BLOCKED),
+    (Forbidden("Forbidden: user is deactivated"), delivery.BLOCKED),
+    (BadRequest("Chat not found"), delivery.CHAT_NOT_FOUND),
+    (BadRequest("Message is too long"), delivery.TRANSIENT),
+    (RetryAfter(30), delivery.TRANSIENT),
+    (TimedOut(), delivery.TRANSIENT),
+    (NetworkError("connection reset"), delivery.TRANSIENT),
+    (RuntimeError("anything else"), delivery.TRANSIENT),
+])
+def test_classify(error, kind):
+    assert delivery.classify(error) == kind
+
+
+def test_only_blocked_and_missing_chats_are_permanent():
+    assert delivery.is_permanent(delivery.BLOCKED)
+    assert delivery.is_permanent(delivery.CHAT_NOT_FOUND)
+    assert not delivery.is_permanent(delivery.TRANSIENT)
@@ -0,0 +1,107 @@
+"""Prepared digests are only sent while they still match the user's watchlist and alarm, and only once."""
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import alert_workers
+import digests
+import price_collector
+import watchlists
+
+FIRE_AT = datetime(2026, 1, 5, 8, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def cache():
+    cache = watchlists.WatchlistCache()
+    cache.set_enabled(True)
+    return cache
+
+
+def _prepare(queue, cache, alarm_id=1, user_id=7, tz="UTC"):
+    digest = digests.Digest(user_id, tz, FIRE_AT.date(), FIRE_AT, ["bitcoin"], {"bitcoin": 100.0}, "digest",
+                            cache.version(user_id))
+    queue.put(alarm_id, digest)
+
+
+def test_take_returns_a_current_digest_once(cache):
+    queue = digests.DigestQueue()
+    _prepare(queue, cache)
+    assert queue.take(1, FIRE_AT, "UTC", cache.version(7)) == "digest"
+    assert queue.taken == 1
+
+
+def test_watchlist_edit_after_prepare_is_not_sent_stale(cache):
+    queue = digests.DigestQueue()
+    _prepare(queue, cache)
+    cache.apply(7, "ethereum", added=True)
+    assert queue.take(1, FIRE_AT, "UTC", cache.version(7)) is None
+    assert queue.stale == 1
+    # Dropped, so the inline render isn't followed by a second, stale send
+    assert queue.get(1) is None
+
+
+def test_edits_by_other_users_keep_the_digest(cache):
+    queue = digests.DigestQueue()
+    _prepare(queue, cache)
+    cache.apply(8, "ethereum", added=True)
+    assert queue.take(1, FIRE_AT, "UTC", cache.version(7)) == "digest"
+
+
+def test_alarm_change_after_prepare_is_not_sent_stale(cache):
+    queue = digests.DigestQueue()
+    _prepare(queue, cache)
+    assert queue.take(1, FIRE_AT + timedelta(hours=1), "UTC", cache.version(7)) is None
+    assert queue.take(1, FIRE_AT, "Europe/Berlin", cache.version(7)) is None
+
+
+def test_disabled_cache_never_vouches_for_a_digest(cache):
+    queue = digests.DigestQueue()
+    _prepare(queue, cache)
+    cache.set_enabled(False)
+    assert queue.take(1, FIRE_AT, "UTC", cache.version(7)) is None
+    cache.set_enabled(True)
+    _prepare(queue, cache)
+    cache.set_enabled(False)
+    cache.set_enabled(True)
+    # Edits made while the change feed was down may have been missed
+    assert queue.take(1, FIRE_AT, "UTC", cache.version(7)) is None
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+
+
+def test_failed_mark_after_a_send_is_retried_without_resending(monkeypatch):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    alarm = (1, 7, time(now.hour, now.minute), "UTC", 127, now)
+    recorded, attempts = [], []
+
+    def mark_alarms_fired(rows):
+        attempts.append(rows)
+        # The first two writes hit a transient database error
+        if len(attempts) <= 2:
+            return False
+        recorded.extend(rows)
+        return True
+
+    monkeypatch.setattr(price_collector, "_unmarked", {})
+    monkeypatch.setattr(price_collector, "_retry_pending", True)
+    monkeypatch.setattr(alert_workers, "WORKERS", 1)
+    monkeypatch.setattr(price_collector.database, "get_due_alarms", lambda lookahead: [] if recorded else [alarm])
+    monkeypatch.setattr(price_collector.database, "mark_alarms_fired", mark_alarms_fired)
+    monkeypatch.setattr(digests.queue, "take", lambda *args: "digest")
+    bot = FakeBot()
+
+    for _ in range(3):
+        asyncio.run(price_collector.send_daily_alerts(SimpleNamespace(bot=bot)))
+
+    assert bot.sent == [7]
+    assert len(attempts) == 3 and attempts[0] == attempts[2]
+    assert recorded[0][:2] == (1, now) and price_collector._unmarked == {}
@@ -0,0 +1,105 @@
+"""Migration runner locking, against a scripted connection."""
+import re
+
+import pytest
+
+import migrations
+
+
+class ScriptedCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append(sql)
+        if self.conn.fail_on and re.search(self.conn.fail_on, sql):
+            raise RuntimeError("statement failed")
+        if "to_regclass('schema_version')" in sql:
+            self.result = (True,)
+        elif "MAX(version)" in sql:
+            self.result = (self.conn.versions.pop(0),)
+        elif "pg_try_advisory_lock" in sql:
+            self.result = (self.conn.lock_results.pop(0),)
+        else:
+            self.result = None
+
+    def fetchone(self):
+        return self.result
+
+
+class ScriptedConnection:
+    def __init__(self, versions, lock_results=(True,), fail_on=None):
+        self.versions = list(versions)
+        self.lock_results = list(lock_results)
+        self.fail_on = fail_on
+        self.statements = []
+        self.autocommit = True
+        self.closed = False
+
+    def cursor(self):
+        return ScriptedCursor(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        self.closed = True
+
+    def ran(self, pattern):
+        return [sql for sql in self.statements if re.search(pattern, sql)]
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(migrations.time, "sleep", sleeps.append)
+
+    def install(conn):
+        monkeypatch.setattr(migrations.database, "get_db_connection", lambda: conn)
+        return conn, sleeps
+    return install
+
+
+def test_current_schema_costs_one_version_query(connect):
+    conn, _ = connect(ScriptedConnection([migrations.LATEST_VERSION]))
+    assert migrations.migrate() == migrations.LATEST_VERSION
+    assert not conn.ran("advisory")
+    assert conn.closed
+
+
+def test_waits_by_polling_and_skips_what_another_replica_applied(connect):
+    latest = migrations.LATEST_VERSION
+    conn, sleeps = connect(ScriptedConnection([latest - 1, latest], lock_results=[False, False, True]))
+    assert migrations.migrate() == latest
+    # Never a blocking pg_advisory_lock, which would hold a snapshot while waiting
+    assert not conn.ran(r"pg_advisory_lock\(")
+    assert sleeps == [migrations.LOCK_POLL_INTERVAL] * 2
+    assert not conn.ran("INSERT INTO schema_version")
+    assert len(conn.ran("pg_advisory_unlock")) == 1
+
+
+def test_applies_pending_migrations_in_order(connect):
+    latest = migrations.LATEST_VERSION
+    conn, _ = connect(ScriptedConnection([latest - 2, latest - 2]))
+    assert migrations.migrate() == latest
+    assert len(conn.ran("INSERT INTO schema_version")) == 2
+    assert conn.ran("pg_advisory_unlock")
+
+
+def test_lock_is_released_when_a_migration_fails(connect):
+    latest = migrations.LATEST_VERSION
+    conn, _ = connect(ScriptedConnection([latest - 1, latest - 1], fail_on="INSERT INTO schema_version"))
+    with pytest.raises(RuntimeError):
+        migrations.migrate()
+    assert conn.statements[-1].startswith("SELECT pg_advisory_unlock")
+    assert conn.closed
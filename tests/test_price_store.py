@@ -0,0 +1,90 @@
+"""Ring buffer, rolling windows and the store's reads."""
+import numpy as np
+import pytest
+
+import price_store
+
+
+def _filled(capacity, count):
+    ring = price_store.RingBuffer(capacity)
+    for i in range(count):
+        ring.append(float(i), 100.0 + i)
+    return ring
+
+
+def test_ring_buffer_keeps_the_newest_ticks_in_order_once_full():
+    ring = _filled(4, 6)
+    times, prices = ring.arrays()
+    assert len(ring) == 4
+    assert times.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert prices.tolist() == [102.0, 103.0, 104.0, 105.0]
+    assert ring.latest() == (5.0, 105.0)
+
+
+def test_ring_buffer_ignores_replayed_ticks():
+    ring = _filled(4, 3)
+    assert not ring.append(2.0, 999.0)
+    assert not ring.append(1.0, 999.0)
+    assert ring.arrays()[1].tolist() == [100.0, 101.0, 102.0]
+
+
+@pytest.mark.parametrize("count", [3, 6])
+def test_price_at_finds_the_last_tick_at_or_before(count):
+    ring = _filled(4, count)
+    first = ring.arrays()[0][0]
+    assert ring.price_at(first - 0.5) is None
+    assert ring.price_at(first) == (first, 100.0 + first)
+    assert ring.price_at(count - 1.5) == (count - 2.0, 100.0 + count - 2)
+    assert ring.price_at(1e9) == ring.latest()
+
+
+def test_from_arrays_matches_appending():
+    times, prices = np.arange(10, dtype=float), np.arange(10, dtype=float) * 2
+    built = price_store.RingBuffer.from_arrays(times, prices, capacity=4)
+    appended = price_store.RingBuffer(4)
+    for t, p in zip(times, prices):
+        appended.append(t, p)
+    assert [a.tolist() for a in built.arrays()] == [a.tolist() for a in appended.arrays()]
+    # Appending after a bulk load wraps like any other buffer
+    built.append(10.0, 20.0)
+    assert built.arrays()[0].tolist() == [7.0, 8.0, 9.0, 10.0]
+
+
+@pytest.mark.parametrize("maximum", [True, False])
+def test_monotonic_window_matches_a_brute_force_window(maximum):
+    rng = np.random.default_rng(7)
+    times = np.arange(200, dtype=float)
+    prices = rng.uniform(50, 150, size=200)
+    window = price_store.MonotonicWindow(window=20, maximum=maximum)
+    pick = max if maximum else min
+    for t, p in zip(times, prices):
+        window.push(t, p)
+        assert window.value(t) == pick(prices[(times > t - 20) & (times <= t)])
+    # Bulk rebuilt over the same ticks, it answers the same
+    rebuilt = price_store.MonotonicWindow.from_arrays(times, prices, window=20, maximum=maximum)
+    assert rebuilt.value(times[-1]) == window.value(times[-1])
+
+
+def test_merged_series_keeps_existing_ticks():
+    series = price_store.CoinSeries()
+    series.append(10.0, 1.0)
+    series.append(20.0, 2.0)
+    merged = series.merged(np.array([5.0, 20.0, 30.0]), np.array([0.5, 99.0, 3.0]))
+    times, prices = merged.ticks.arrays()
+    assert times.tolist() == [5.0, 10.0, 20.0, 30.0]
+    assert prices.tolist() == [0.5, 1.0, 2.0, 3.0]
+    assert merged.high.value(30.0) == 3.0
+
+
+def test_coin_data_leaves_out_coins_without_a_tick_in_the_window():
+    store = price_store.PriceStore()
+    now = 10 * 86400.0
+    store.append("bitcoin", now - 3600, 80.0)
+    store.append("bitcoin", now - 60, 60.0)
+    # Stopped ticking more than a window ago
+    store.append("delisted", now - price_store.WINDOW_SECONDS - 60, 5.0)
+    store.update_coins({"bitcoin": {"symbol": "btc", "name": "Bitcoin"}})
+    data = store.coin_data(["bitcoin", "delisted", "unknown"], now)
+    assert list(data) == ["bitcoin"]
+    assert data["bitcoin"]["dip_percentage"] == pytest.approx(25.0)
+    assert data["bitcoin"]["updated_at"] == now - 60
@@ -0,0 +1,59 @@
+"""Arming profiling targets and writing profiles for the runs that were armed."""
+import asyncio
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def profiler(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    profiler = profiling.Profiler()
+    monkeypatch.setattr(profiling, "profiler", profiler)
+    return profiler
+
+
+def test_arm_from_spec(profiler):
+    profiler.arm_from_spec("fetch_prices, /add:2,daily_alerts:0,bogus:x")
+    assert profiler.status() == {
+        "fetch_prices": (profiling.DEFAULT_RUNS, profiling.DEFAULT_MODE),
+        "/add": (2, profiling.DEFAULT_MODE),
+        # Clamped to at least one run
+        "daily_alerts": (1, profiling.DEFAULT_MODE),
+    }
+    with pytest.raises(ValueError):
+        profiler.arm("/add", mode="perf")
+
+
+def test_armed_runs_are_counted_down_and_written(profiler, tmp_path):
+    profiler.arm("/add", runs=2, mode="cprofile")
+
+    @profiling.profiled("/add")
+    async def handler():
+        return sum(range(1000))
+
+    for _ in range(3):
+        assert asyncio.run(handler()) == 499500
+    assert len(list(tmp_path.glob("profile-add-*.pstats"))) == 2
+    assert profiler.status() == {}
+
+
+def test_function_name_and_all_match(profiler, tmp_path):
+    profiler.arm(profiling.ALL, runs=1)
+    with profiler.profile("fetch_prices", "fetch_and_store_prices"):
+        pass
+    profiler.arm("fetch_and_store_prices", runs=1)
+    with profiler.profile("fetch_prices", "fetch_and_store_prices"):
+        pass
+    assert len(list(tmp_path.glob("profile-fetch_prices-*.collapsed"))) == 2
+    assert profiler.disarm() == 0
+
+
+def test_only_one_cprofile_run_at_a_time(profiler):
+    profiler.arm("a", runs=1, mode="cprofile")
+    profiler.arm("b", runs=1, mode="cprofile")
+    assert profiler._claim(("a",))[0] == "a"
+    # b stays armed for a later run instead of fighting over the profile hook
+    assert profiler._claim(("b",)) is None
+    assert profiler.status() == {"b": (1, "cprofile")}
@@ -0,0 +1,183 @@
+"""
+Query budgets of the alert and watchlist handlers, against a stubbed connection.
+
+The budgets are the ones benchmark.py enforces against a real database, so a
+change that adds a statement to a hot handler fails here first.
+"""
+import asyncio
+import re
+import time
+from datetime import time as time_of_day, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import benchmark
+import bot
+import database
+import price_store
+import watchlists
+from alarm_schedule import schedule as alarm_schedule
+
+USER_ID = 4242
+COIN = "bitcoin"
+
+
+class FakeCursor:
+    """Answers statements from FakeDatabase and reports them like InstrumentedCursor does."""
+
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = -1
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        self._rows, self.rowcount = self.db.respond(query)
+        self.db.statements.append(query)
+        database._record(query, 1, started, max(self.rowcount, 0))
+
+    def executemany(self, query, vars_list):
+        for vars in vars_list:
+            self.execute(query, vars)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.autocommit = False
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_session(self, **kwargs):
+        pass
+
+
+class FakeDatabase:
+    """(pattern, rows, rowcount) rules, first match wins; anything else returns no rows and touches one."""
+
+    def __init__(self):
+        self.rules = []
+        self.statements = []
+
+    def on(self, pattern, rows=(), rowcount=None):
+        self.rules.append((re.compile(pattern, re.IGNORECASE | re.DOTALL), list(rows), rowcount))
+
+    def respond(self, query):
+        for pattern, rows, rowcount in self.rules:
+            if pattern.search(query):
+                return rows, len(rows) if rowcount is None else rowcount
+        return [], 1
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(database, "connect", lambda *args, **kwargs: FakeConnection(fake))
+    monkeypatch.setattr(database, "DATABASE_READ_URL", None)
+    # An existing user whose watchlist, alarms and coins are known, as on a warm replica
+    fake.on(r"INSERT INTO users", rowcount=0)
+    fake.on(r"SELECT coin_id FROM user_coins", [(COIN,)])
+    fake.on(r"SELECT 1 FROM coin_mapping", [(1,)])
+    fake.on(r"FROM user_alarms\s+WHERE user_id", [(1, time_of_day(8, 0), "UTC", 127, None)])
+    watchlists.cache.set_enabled(True)
+    monkeypatch.setitem(price_store.store.coins, COIN, {"symbol": "btc", "name": "Bitcoin"})
+    monkeypatch.setitem(price_store.store.coins, "ethereum", {"symbol": "eth", "name": "Ethereum"})
+    alarm_schedule.set_user(USER_ID, [(1, time_of_day(8, 0), "UTC", 127)])
+    bot.user_last_command.clear()
+    yield fake
+    watchlists.cache.set_enabled(False)
+    alarm_schedule.remove_user(USER_ID)
+
+
+def _run_command(handler, *args):
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=USER_ID, username="budget", full_name="Budget"),
+        message=SimpleNamespace(text=" ".join(("/cmd",) + args), reply_text=reply_text),
+    )
+    bot.user_last_command.clear()
+    asyncio.run(handler(update, SimpleNamespace(args=list(args))))
+    return replies
+
+
+def _assert_budget(name, handler, *args):
+    with database.query_budget(benchmark.QUERY_BUDGETS[name], name) as scope:
+        replies = _run_command(handler, *args)
+    assert replies, f"{name} sent no reply"
+    return scope, replies[-1]
+
+
+def test_get_due_alarms_within_budget(db):
+    with database.query_budget(benchmark.QUERY_BUDGETS["get_due_alarms"], "get_due_alarms") as scope:
+        database.get_due_alarms(timedelta(minutes=5))
+    assert scope.count == 1
+
+
+def test_setalarm_within_budget(db):
+    _, reply = _assert_budget("/setalarm", bot.set_alarm, "08:30", "UTC")
+    assert reply.startswith("✅")
+
+
+@pytest.mark.parametrize("name, handler, args, expected", [
+    ("/list", bot.list_coins, (), "Bitcoin"),
+    ("/add", bot.add_coin, ("ethereum",), "✅ Added"),
+    ("/remove", bot.remove_coin, (COIN,), "✅ Removed"),
+])
+def test_watchlist_handlers_within_budget(db, name, handler, args, expected):
+    # A cold watchlist cache and a change that succeeds: the most each command issues
+    _, reply = _assert_budget(name, handler, *args)
+    assert expected in reply
+
+
+def test_list_is_served_from_the_cache_once_warm(db):
+    _run_command(bot.list_coins)
+    with database.query_budget(0, "/list") as scope:
+        _run_command(bot.list_coins)
+    assert scope.count == 0
+
+
+def test_budget_exceeded_raises(db):
+    with pytest.raises(database.QueryBudgetExceeded, match=r"issued 2 queries, budget 1"):
+        with database.query_budget(1, "two lookups"):
+            database.is_valid_coin(COIN)
+            database.is_valid_coin("ethereum")
+
+
+def test_budget_counts_statements_from_worker_threads(db):
+    async def handler():
+        await asyncio.to_thread(database.get_user_coins, USER_ID)
+        await asyncio.to_thread(database.get_user_coins, USER_ID)
+
+    with pytest.raises(database.QueryBudgetExceeded):
+        with database.query_budget(1, "threaded"):
+            asyncio.run(handler())
@@ -0,0 +1,62 @@
+"""Snapshots restore the price store, alarm schedule and cooldowns they were saved from."""
+from datetime import time
+
+import pytest
+
+import alarm_schedule
+import price_store
+import snapshot
+
+
+@pytest.fixture
+def state(monkeypatch):
+    """Swaps in empty module singletons; returns a function that swaps in fresh ones again."""
+    def fresh():
+        monkeypatch.setattr(price_store, "store", price_store.PriceStore())
+        monkeypatch.setattr(alarm_schedule, "schedule", alarm_schedule.AlarmSchedule())
+    fresh()
+    return fresh
+
+
+def test_round_trip(state, tmp_path):
+    path = str(tmp_path / "state.snap")
+    for i in range(5):
+        price_store.store.append("bitcoin", 1000.0 + 120 * i, 100.0 + i)
+    price_store.store.update_coins({
+        "bitcoin": {"symbol": "btc", "name": "Bitcoin"},
+        "ethereum": {"symbol": "eth", "name": "Ethereum"},
+    })
+    alarm_schedule.schedule.replace_all([(1, 7, time(9, 30), "Europe/Berlin", 31), (2, 8, time(21, 0), "UTC", 127)])
+    snapshot.save(path, rate_limits={7: 123.5})
+
+    state()
+    assert snapshot.load(path) == {7: 123.5}
+
+    times, prices = price_store.store.history("bitcoin")
+    assert times.tolist() == [1000.0 + 120 * i for i in range(5)]
+    assert prices.tolist() == [100.0 + i for i in range(5)]
+    assert price_store.store.coins["ethereum"]["symbol"] == "eth"
+    assert price_store.store.warm
+    assert alarm_schedule.schedule.alarms == {
+        1: (7, time(9, 30), "Europe/Berlin", 31),
+        2: (8, time(21, 0), "UTC", 127),
+    }
+    # Appends continue from the restored buffer
+    price_store.store.append("bitcoin", 2000.0, 50.0)
+    assert price_store.store.latest("bitcoin") == (2000.0, 50.0)
+
+
+def test_unloaded_schedule_is_not_restored(state, tmp_path):
+    path = str(tmp_path / "state.snap")
+    snapshot.save(path)
+    state()
+    assert snapshot.load(path) == {}
+    assert not alarm_schedule.schedule.loaded
+
+
+def test_missing_or_corrupt_snapshot_means_cold_start(state, tmp_path):
+    path = tmp_path / "state.snap"
+    assert snapshot.load(str(path)) is None
+    path.write_bytes(b"not a snapshot at all")
+    assert snapshot.load(str(path)) is None
+    assert not price_store.store.warm
@@ -0,0 +1,106 @@
+"""
+Time zone and weekday helpers for alarms.
+
+Any IANA zone name is accepted (case-insensitively), plus the short
+abbreviations /setalarm used to be limited to. Zone rules are loaded once
+per name and cached, so scheduling never re-parses a zone. Alarm weekdays
+are a bitmask over date.weekday(): bit 0 is Monday, bit 6 is Sunday.
+"""
+import functools
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+# Abbreviations users already know from earlier versions -> the DST-aware zone they meant
+ABBREVIATIONS = {
+    'EST': 'US/Eastern',
+    'PST': 'US/Pacific',
+    'CST': 'US/Central',
+    'MST': 'US/Mountain',
+    'UTC': 'UTC',
+    'GMT': 'GMT',
+    'CET': 'Europe/Berlin',
+    'JST': 'Japan',
+    'NZT': 'Pacific/Auckland'
+}
+
+EVERY_DAY = 0b1111111
+WEEKDAYS = 0b0011111
+WEEKENDS = 0b1100000
+DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_DAY_SETS = {'daily': EVERY_DAY, 'everyday': EVERY_DAY, 'weekdays': WEEKDAYS, 'weekends': WEEKENDS}
+
+
+@functools.lru_cache(maxsize=None)
+def _zone_names():
+    """Lower-cased name -> canonical IANA spelling, built once."""
+    return {name.lower(): name for name in available_timezones()}
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    """Cached ZoneInfo for a stored zone name; legacy abbreviations are mapped first."""
+    return ZoneInfo(ABBREVIATIONS.get(name, name))
+
+
+def resolve(name):
+    """Canonical zone name for user input ('europe/berlin', 'EST', ...), or None if unknown."""
+    if not name:
+        return None
+    upper = name.strip().upper()
+    if upper in ABBREVIATIONS:
+        return ABBREVIATIONS[upper]
+    canonical = _zone_names().get(name.strip().lower())
+    if canonical is None:
+        return None
+    try:
+        get_zone(canonical)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+    return canonical
+
+
+def parse_weekdays(spec):
+    """Bitmask for 'daily', 'weekdays', 'weekends', 'mon-fri' or 'mon,wed,fri'. None if invalid."""
+    spec = (spec or 'daily').strip().lower()
+    if spec in _DAY_SETS:
+        return _DAY_SETS[spec]
+    mask = 0
+    for part in spec.split(','):
+        days = part.split('-')
+        if len(days) > 2 or not all(day[:3] in DAY_NAMES for day in days):
+            return None
+        first, last = DAY_NAMES.index(days[0][:3]), DAY_NAMES.index(days[-1][:3])
+        for i in range(7):
+            day = (first + i) % 7
+            mask |= 1 << day
+            if day == last:
+                break
+    return mask or None
+
+
+def format_weekdays(mask):
+    if mask == EVERY_DAY:
+        return "daily"
+    if mask == WEEKDAYS:
+        return "weekdays"
+    if mask == WEEKENDS:
+        return "weekends"
+    return ",".join(name.capitalize() for i, name in enumerate(DAY_NAMES) if mask & (1 << i))
+
+
+def next_fire(alarm_time, tz_name, weekdays, after_utc):
+    """The first UTC instant after after_utc at which a local alarm_time falls on one of weekdays."""
+    zone = get_zone(tz_name)
+    local_day = after_utc.astimezone(zone).date()
+    for offset in range(8):
+        day = local_day + timedelta(days=offset)
+        if not weekdays & (1 << day.weekday()):
+            continue
+        candidate = datetime.combine(day, alarm_time, tzinfo=zone).astimezone(timezone.utc)
+        if candidate > after_utc:
+            return candidate
+    return None
+
+
+def local_date(fire_at, tz_name):
+    return fire_at.astimezone(get_zone(tz_name)).date()
@@ -0,0 +1,66 @@
+"""
+Process-local cache of users' watchlists.
+
+Only trusted while the change feed is connected: change_feed enables it
+once LISTEN is established and disables (and empties) it whenever the
+listener loses its connection, since edits made meanwhile would be missed.
+While disabled every read goes to Postgres.
+"""
+import threading
+
+import database
+
+
+class WatchlistCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lists = {}  # user_id -> set of coin_ids
+        self.enabled = False
+        # A load is cached only if neither counter moved while it read Postgres (compare-and-set):
+        # _generation is bumped by every edit to the user's list, _epoch by every enable/disable.
+        # Neither ever goes back, so a stale load can't match a later state by coincidence.
+        self._generation = {}
+        self._epoch = 0
+
+    def _version(self, user_id):
+        return self._epoch, self._generation.get(user_id, 0)
+
+    def get(self, user_id):
+        """The user's coin ids, from memory when possible."""
+        with self._lock:
+            cached = self.lists.get(user_id) if self.enabled else None
+            version = self._version(user_id)
+        if cached is not None:
+            return sorted(cached)
+
+        coins = database.get_user_coins(user_id)
+        with self._lock:
+            if self.enabled and self._version(user_id) == version:
+                self.lists[user_id] = set(coins)
+        return sorted(coins)
+
+    def version(self, user_id):
+        """Changes whenever the user's list may have; None while disabled, as edits can then go unseen."""
+        with self._lock:
+            return self._version(user_id) if self.enabled else None
+
+    def apply(self, user_id, coin_id, added):
+        """Applies one watchlist edit, from this process or another replica."""
+        with self._lock:
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+            coins = self.lists.get(user_id)
+            if coins is None:
+                return
+            if added:
+                coins.add(coin_id)
+            else:
+                coins.discard(coin_id)
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+            self.lists.clear()
+            self._epoch += 1
+
+
+cache = WatchlistCache()